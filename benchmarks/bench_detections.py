@@ -0,0 +1,94 @@
+"""
+对比逐个标量换算坐标与 Detections 数组运算的耗时 (plot_bounding_boxes / draw_bbox_on_image 的坐标处理部分)。
+
+用法:
+    python benchmarks/bench_detections.py [--boxes 5000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cable_detection"))
+
+from detections import Detections  # noqa: E402
+from json_extract import Detection  # noqa: E402
+
+IMAGE_SIZE = (1920, 1080)
+
+
+# --- 原来的逐个换算方式 (仅用于对比) ---
+def legacy_plot_coordinates(detections, image_size):
+    """plot_bounding_boxes：0~1000 -> 像素，int 取整后交换反向的角点"""
+    width, height = image_size
+    result = []
+    for detection in detections:
+        abs_y1 = int(detection.bbox[1] / 1000 * height)
+        abs_x1 = int(detection.bbox[0] / 1000 * width)
+        abs_y2 = int(detection.bbox[3] / 1000 * height)
+        abs_x2 = int(detection.bbox[2] / 1000 * width)
+        if abs_x1 > abs_x2:
+            abs_x1, abs_x2 = abs_x2, abs_x1
+        if abs_y1 > abs_y2:
+            abs_y1, abs_y2 = abs_y2, abs_y1
+        result.append((abs_x1, abs_y1, abs_x2, abs_y2))
+    return result
+
+
+def legacy_clip_and_filter(detections, image_size):
+    """draw_bbox_on_image：裁剪到图像范围，丢弃宽或高为 0 的框"""
+    width, height = image_size
+    result = []
+    for detection in detections:
+        x1, y1, x2, y2 = detection.bbox
+        x1 = max(0, min(x1, width))
+        y1 = max(0, min(y1, height))
+        x2 = max(0, min(x2, width))
+        y2 = max(0, min(y2, height))
+        if x1 >= x2 or y1 >= y2:
+            continue
+        result.append((x1, y1, x2, y2))
+    return result
+
+
+def bench(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detections 基准测试")
+    parser.add_argument("--boxes", type=int, default=5000, help="检测框数量")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    detections = [
+        Detection(label=f"线缆_{i}", bbox=tuple(rng.uniform(-50, 1050) for _ in range(4)))
+        for i in range(args.boxes)
+    ]
+
+    cases = [
+        ("legacy plot 坐标换算", lambda: len(legacy_plot_coordinates(detections, IMAGE_SIZE))),
+        ("Detections plot 坐标换算", lambda: len(
+            Detections.from_detections(detections).denormalize(IMAGE_SIZE).truncate().sort_corners())),
+        ("legacy 裁剪 + 过滤", lambda: len(legacy_clip_and_filter(detections, IMAGE_SIZE))),
+        ("Detections 裁剪 + 过滤", lambda: len(
+            Detections.from_detections(detections).clip(IMAGE_SIZE).filter())),
+    ]
+    boxes = Detections.from_detections(detections)
+    cases.append(("Detections 换算 (已构建数组)", lambda: len(
+        boxes.denormalize(IMAGE_SIZE).truncate().sort_corners().clip(IMAGE_SIZE).filter())))
+
+    print(f"--- {args.boxes} 个检测框，图像 {IMAGE_SIZE[0]}x{IMAGE_SIZE[1]} ---")
+    for name, fn in cases:
+        elapsed, count = bench(fn, args.repeat)
+        print(f"{name:<28} {elapsed:8.2f} ms   {count} 个框")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+对比 json_extract 与原来几种解析方式在大输出、截断输出和夹杂说明文字的输出上的耗时和结果。
+
+用法:
+    python benchmarks/bench_json_extract.py [--boxes 2000] [--repeat 20]
+"""
+import argparse
+import ast
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cable_detection"))
+
+from json_extract import extract_detections, extract_json  # noqa: E402
+
+
+# --- 原来的解析方式 (仅用于对比) ---
+def legacy_parse_vlm_response(vlm_response):
+    """utils.parse_vlm_response：json.loads，失败后用贪婪的 \\{.*\\} 正则"""
+    try:
+        return json.loads(vlm_response)
+    except json.JSONDecodeError:
+        pass
+    try:
+        json_match = re.search(r'\{.*\}', vlm_response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group())
+    except Exception:
+        pass
+    return None
+
+
+def legacy_plot_bounding_boxes_parse(bounding_boxes):
+    """qwen3_vl_2d.parse_json + ast.literal_eval，失败后按 rfind('"}') 截断"""
+    lines = bounding_boxes.splitlines()
+    for i, line in enumerate(lines):
+        if line == "```json":
+            bounding_boxes = "\n".join(lines[i + 1:])
+            bounding_boxes = bounding_boxes.split("```")[0]
+            break
+    try:
+        return ast.literal_eval(bounding_boxes)
+    except Exception:
+        try:
+            end_idx = bounding_boxes.rfind('"}') + len('"}')
+            return ast.literal_eval(bounding_boxes[:end_idx] + "]")
+        except Exception:
+            return None
+
+
+def legacy_decode_json_points(text):
+    """qwen3_vl_2d.decode_json_points 的代码块处理 + json.loads"""
+    try:
+        if "```json" in text:
+            text = text.split("```json")[1].split("```")[0]
+        return json.loads(text)
+    except Exception:
+        return None
+
+
+def make_cases(num_boxes):
+    boxes = [
+        {"bbox_2d": [i % 900, (i * 7) % 900, i % 900 + 50, (i * 7) % 900 + 60], "label": f"线缆_{i}"}
+        for i in range(num_boxes)
+    ]
+    body = json.dumps(boxes, ensure_ascii=False, indent=2)
+    prose = "根据图[1]所示，画面中 {左侧} 有若干线缆，下面给出检测结果。" * 200
+    return {
+        "large": f"```json\n{body}\n```",
+        "truncated": f"```json\n{body[: int(len(body) * 0.9)]}",
+        "chatty": f"{prose}\n{json.dumps(boxes, ensure_ascii=False)}\n{prose}",
+    }
+
+
+def count_boxes(value):
+    if isinstance(value, dict):
+        value = value.get("detections", [value])
+    return len(value) if isinstance(value, list) else 0
+
+
+def bench(fn, text, repeat):
+    fn(text)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(text)
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="json_extract 基准测试")
+    parser.add_argument("--boxes", type=int, default=2000, help="每个样例中的检测框数量")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    parsers = [
+        ("json_extract.extract_json", lambda text: count_boxes(extract_json(text))),
+        ("json_extract.extract_detections", lambda text: len(extract_detections(text))),
+        ("legacy parse_vlm_response", lambda text: count_boxes(legacy_parse_vlm_response(text))),
+        ("legacy plot_bounding_boxes", lambda text: count_boxes(legacy_plot_bounding_boxes_parse(text))),
+        ("legacy decode_json_points", lambda text: count_boxes(legacy_decode_json_points(text))),
+    ]
+
+    for case_name, text in make_cases(args.boxes).items():
+        print(f"--- {case_name} ({len(text) / 1024:.0f} KB) ---")
+        for name, fn in parsers:
+            elapsed, found = bench(fn, text, args.repeat)
+            print(f"{name:<34} {elapsed:8.2f} ms   解析出 {found} 个框")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+端到端基准测试：一次判断的各个阶段 (图片预处理、base64 编码、排队、网络调用、解析、绘制、写历史记录)
+分别计时，在 1 / 8 / 64 个并发调用方下给出 p50 / p95 / p99 和吞吐量。
+请求部分通过公开的 AsyncQwenRequester.request_qwen 发出，其中各阶段的耗时取自 requester 的 trace。
+
+默认在进程内启动 benchmarks/mock_dashscope.py 的模拟服务，也可以用 --base-url 指向单独运行的模拟服务
+(避免与压测客户端争用 GIL)。每次运行的结果以一行 JSON 追加到 --output，方便比较不同版本。
+
+用法:
+    python benchmarks/bench_pipeline.py [--concurrency 1 8 64] [--requests-per-caller 4] \\
+        [--latency-ms 300] [--cold-encode] [--output bench_pipeline.jsonl]
+"""
+import argparse
+import asyncio
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "cable_detection"))
+
+from mock_dashscope import CannedOutputs, LatencyModel, MockConfig, start_background_server  # noqa: E402
+
+DEFAULT_IMAGE_GLOB = os.path.join(REPO_DIR, "diff_image_judge", "qwen_pictures", "*.png")
+STAGES = ("preprocess", "encode", "queue", "network", "parse", "render", "history", "total")
+# 基准测试的阶段与 tracing 中各 span 的对应关系 (同一阶段的多个 span 相加)
+TRACE_STAGES = {
+    "preprocess": ("prepare",),
+    "encode": ("encode",),
+    "queue": ("queue", "rate_limit"),
+    "network": ("network", "retry_wait"),
+    "parse": ("parse",),
+}
+QUESTION = "请检测图片中的黑色线缆，以 JSON 格式返回 bbox_2d 和 label。"
+
+
+def percentile(sorted_values, q):
+    """最近秩法的分位数 (sorted_values 已排序)"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) * 1000,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Pipeline:
+    """一次完整判断的各个阶段，按 Gradio 界面中的调用方式执行 (CPU 密集的部分放到线程池)"""
+    def __init__(self, base_url, work_dir):
+        # 标注图写到临时目录 (image_writer 在导入时读取该环境变量)
+        os.environ["QWEN_ANNOTATED_DIR"] = os.path.join(work_dir, "annotated")
+        import utils
+        from history_manager import HistoryManager
+        from qwen3_vl_2d import plot_bounding_boxes
+        from qwen_requester import AsyncQwenRequester
+
+        self.utils = utils
+        self.plot_bounding_boxes = plot_bounding_boxes
+        self.history = HistoryManager(os.path.join(work_dir, "call_history.json"))
+        # 压测时关闭响应缓存和客户端限流，每次判断都真正发出请求
+        self.requester = AsyncQwenRequester(api_key="bench-key", base_url=base_url, cache=False,
+                                            rate_limiter=False, max_concurrency=256)
+
+    async def judge(self, image_path):
+        """执行一次判断，返回 {阶段: 秒数}，失败时返回 None"""
+        start = time.perf_counter()
+        # 预处理、编码、排队和网络阶段取自 requester 的 trace (UsageRecord.stages)，与线上指标口径一致
+        response_text, usage = await self.requester.request_qwen(QUESTION, image_path, "")
+        if usage.failed:
+            return None
+        stages = usage.stages or {}
+        timings = {stage: sum(stages.get(name, 0.0) for name in names) for stage, names in TRACE_STAGES.items()}
+
+        t = time.perf_counter()
+        await asyncio.to_thread(self.utils.parse_vlm_response, response_text)
+        timings["parse"] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        await asyncio.to_thread(self.plot_bounding_boxes, image_path, response_text)
+        timings["render"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        await asyncio.to_thread(self.history.add_record, image_path, QUESTION, "", response_text, usage)
+        timings["history"] = time.perf_counter() - t
+
+        timings["total"] = time.perf_counter() - start
+        return timings
+
+
+async def run_level(pipeline, images, concurrency, requests_per_caller):
+    samples = {stage: [] for stage in STAGES}
+    errors = 0
+
+    async def caller(index):
+        nonlocal errors
+        for i in range(requests_per_caller):
+            timings = await pipeline.judge(images[(index * requests_per_caller + i) % len(images)])
+            if timings is None:
+                errors += 1
+                continue
+            for stage, seconds in timings.items():
+                samples[stage].append(seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller(i) for i in range(concurrency)))
+    wall = time.perf_counter() - start
+    completed = len(samples["total"])
+    return {
+        "concurrency": concurrency,
+        "requests": concurrency * requests_per_caller,
+        "completed": completed,
+        "errors": errors,
+        "wall_s": wall,
+        "throughput_rps": completed / wall if wall > 0 else 0.0,
+        "stages": {stage: summarize(values) for stage, values in samples.items()},
+    }
+
+
+def print_level(result):
+    print(f"--- 并发 {result['concurrency']}: {result['completed']} 次完成, {result['errors']} 次失败, "
+          f"{result['wall_s']:.2f} 秒, 吞吐 {result['throughput_rps']:.2f} 次/秒 ---")
+    print(f"{'阶段':<12}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for stage, stats in result["stages"].items():
+        if not stats["count"]:
+            continue
+        print(f"{stage:<12}{stats['mean_ms']:>10.1f}{stats['p50_ms']:>10.1f}"
+              f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+
+async def run(args, images, base_url, work_dir):
+    pipeline = Pipeline(base_url, work_dir)
+    results = []
+    try:
+        # 预热：加载字体、建立连接
+        with contextlib.redirect_stdout(io.StringIO()):
+            await pipeline.judge(images[0])
+        for concurrency in args.concurrency:
+            if args.cold_encode:
+                pipeline.utils.clear_encode_cache()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = await run_level(pipeline, images, concurrency, args.requests_per_caller)
+            print_level(result)
+            results.append(result)
+    finally:
+        await pipeline.requester.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="请求 / 解析 / 绘制全流程基准测试")
+    parser.add_argument("--images", default=DEFAULT_IMAGE_GLOB, help="样例图片 glob (默认使用 diff_image_judge/qwen_pictures)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--requests-per-caller", type=int, default=4)
+    parser.add_argument("--base-url", help="使用已经运行的模拟服务 (例如 http://127.0.0.1:8765/api/v1)")
+    parser.add_argument("--latency-dist", default="lognormal",
+                        choices=["fixed", "uniform", "normal", "lognormal", "exponential"])
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--latency-jitter-ms", type=float, default=100)
+    parser.add_argument("--token-interval-ms", type=float, default=1)
+    parser.add_argument("--boxes", type=int, default=20, help="模拟输出中的检测框数量")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--cold-encode", action="store_true", help="每个并发级别开始前清空 base64 编码缓存")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_pipeline.jsonl", help="结果追加写入的 JSONL 文件")
+    args = parser.parse_args()
+
+    images = sorted(glob.glob(args.images))
+    if not images:
+        parser.error(f"没有找到样例图片: {args.images}")
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        config = MockConfig(
+            latency=LatencyModel(args.latency_dist, args.latency_ms, args.latency_jitter_ms),
+            token_interval_s=args.token_interval_ms / 1000,
+            error_rate=args.error_rate,
+            outputs=CannedOutputs("bbox", args.boxes),
+            seed=args.seed,
+        )
+        server, base_url = start_background_server(config)
+    print(f"样例图片 {len(images)} 张，服务地址 {base_url}")
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as work_dir:
+            results = asyncio.run(run(args, images, base_url, work_dir))
+            # 等待后台写完标注图再删除临时目录
+            from image_writer import get_image_writer
+            with contextlib.redirect_stdout(io.StringIO()):
+                get_image_writer().flush(timeout=30)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "images": len(images),
+        "levels": results,
+    }
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"结果已追加到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
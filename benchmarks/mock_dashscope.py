@@ -0,0 +1,490 @@
+"""
+本地 DashScope 模拟服务，用于在没有真实服务和付费 Key 的情况下做压测和延迟测试。
+
+同时支持:
+    - DashScope 原生接口 (MultiModalConversation / AsyncQwenRequester)：
+      POST .../services/aigc/multimodal-generation/generation，支持 SSE 流式和增量输出；
+      SDK 上传本地文件用到的 GET .../uploads?action=getPolicy 和 OSS 表单上传也一并模拟。
+    - OpenAI 兼容接口 (qwen3_vl_2d.inference_with_api)：POST .../chat/completions，支持 stream。
+    - GET /stats：各类请求和错误的计数。
+
+可以配置首 Token 延迟的分布、每个输出 Token 的间隔、错误率、限流 (随机 429 或按每分钟请求数)，
+以及返回的内容 (检测框 / 点 / 判断结论，或固定的文本文件)。
+
+用法:
+    python benchmarks/mock_dashscope.py --port 8765 --latency-dist lognormal --latency-ms 800 \\
+        --latency-jitter-ms 400 --error-rate 0.01 --throttle-rate 0.02 --output auto
+
+    # 所有 Requester 只需要一个设置即可指向模拟服务
+    # (inference_with_api 的兼容模式地址由它推出，也可以用 DASHSCOPE_COMPATIBLE_BASE_URL 单独指定)
+    export DASHSCOPE_HTTP_BASE_URL=http://127.0.0.1:8765/api/v1
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+NATIVE_PATH_SUFFIX = "/services/aigc/multimodal-generation/generation"
+OPENAI_PATH_SUFFIX = "/chat/completions"
+UPLOAD_POLICY_SUFFIX = "/uploads"
+OSS_UPLOAD_PATH = "/mock-oss"
+# 流式输出时每个分片包含的字符数 (近似一个 Token)
+CHARS_PER_TOKEN = 4
+
+
+class LatencyModel:
+    """
+    首 Token 延迟的分布 (毫秒)：
+    fixed / uniform (mean ± jitter) / normal (标准差 jitter) /
+    lognormal (均值 mean、标准差 jitter 的长尾分布) / exponential (均值 mean)
+    """
+    def __init__(self, dist="fixed", mean_ms=500.0, jitter_ms=0.0, rng=None):
+        self.dist = dist
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.rng = rng or random.Random()
+        if dist == "lognormal":
+            ratio = jitter_ms / mean_ms if mean_ms > 0 else 0.0
+            self._sigma = math.sqrt(math.log(1 + ratio ** 2))
+            self._mu = math.log(max(mean_ms, 1e-3)) - self._sigma ** 2 / 2
+
+    def sample(self):
+        """返回一次采样的秒数"""
+        if self.dist == "uniform":
+            value = self.rng.uniform(self.mean_ms - self.jitter_ms, self.mean_ms + self.jitter_ms)
+        elif self.dist == "normal":
+            value = self.rng.gauss(self.mean_ms, self.jitter_ms)
+        elif self.dist == "lognormal":
+            value = self.rng.lognormvariate(self._mu, self._sigma)
+        elif self.dist == "exponential":
+            value = self.rng.expovariate(1 / self.mean_ms) if self.mean_ms > 0 else 0.0
+        else:
+            value = self.mean_ms
+        return max(value, 0.0) / 1000
+
+
+class CannedOutputs:
+    """按提示词生成固定格式的模型输出：检测框 (bbox)、点 (point) 或判断结论 (verdict)"""
+    VERDICTS = (
+        "匹配。两个点云的轮廓和关键边缘基本重合，没有明显的偏移或旋转。",
+        "不匹配。两个点云在右侧边缘存在明显错位，整体有约 10 度的旋转偏差。",
+    )
+
+    def __init__(self, mode="auto", boxes=5, response_text=None, rng=None):
+        self.mode = mode
+        self.boxes = boxes
+        self.response_text = response_text
+        self.rng = rng or random.Random()
+
+    def pick_mode(self, prompt):
+        if self.mode != "auto":
+            return self.mode
+        lowered = prompt.lower()
+        if "point_2d" in lowered or '"point"' in lowered:
+            return "point"
+        if "bbox" in lowered or "检测" in prompt or "框" in prompt:
+            return "bbox"
+        return "verdict"
+
+    def generate(self, prompt):
+        if self.response_text is not None:
+            return self.response_text
+        mode = self.pick_mode(prompt)
+        rng = self.rng
+        if mode == "bbox":
+            items = []
+            for i in range(self.boxes):
+                x1, y1 = rng.randint(0, 800), rng.randint(0, 800)
+                items.append({"bbox_2d": [x1, y1, x1 + rng.randint(20, 199), y1 + rng.randint(20, 199)],
+                              "label": f"线缆_{i + 1}"})
+            return "```json\n" + json.dumps(items, ensure_ascii=False, indent=2) + "\n```"
+        if mode == "point":
+            items = [{"point_2d": [rng.randint(0, 999), rng.randint(0, 999)], "label": f"point_{i + 1}"}
+                     for i in range(self.boxes)]
+            return "```json\n" + json.dumps(items, ensure_ascii=False, indent=2) + "\n```"
+        return rng.choice(self.VERDICTS)
+
+
+class RateWindow:
+    """按每分钟请求数限流的滑动窗口，rpm=0 表示不限制"""
+    def __init__(self, rpm=0):
+        self.rpm = rpm
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if not self.rpm:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            while self._times and now - self._times[0] > 60:
+                self._times.popleft()
+            if len(self._times) >= self.rpm:
+                return False
+            self._times.append(now)
+            return True
+
+
+class MockConfig:
+    """模拟服务的全部可调参数 (由命令行参数构建，也可以在测试脚本中直接创建)"""
+    def __init__(self, latency=None, token_interval_s=0.02, error_rate=0.0, throttle_rate=0.0, rpm=0,
+                 image_tokens=1280, outputs=None, reject_keys=(), seed=None):
+        rng = random.Random(seed)
+        self.latency = latency or LatencyModel(rng=rng)
+        self.token_interval_s = token_interval_s
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_window = RateWindow(rpm)
+        self.image_tokens = image_tokens
+        self.outputs = outputs or CannedOutputs(rng=rng)
+        self.reject_keys = set(reject_keys)
+        self.rng = rng
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+
+    def count(self, *keys):
+        with self.stats_lock:
+            for key in keys:
+                self.stats[key] += 1
+
+
+def _split_tokens(text):
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)] or [""]
+
+
+def _native_prompt(messages):
+    """原生接口的消息：content 为 [{"text": ...}, {"image": ...}] 列表或字符串，返回 (文本, 图片数)"""
+    texts, images = [], 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for item in content or []:
+            if "text" in item:
+                texts.append(item["text"])
+            elif "image" in item:
+                images += 1
+    return "\n".join(texts), images
+
+
+def _openai_prompt(messages):
+    """兼容接口的消息：content 为字符串或 [{"type": "text" / "image_url", ...}] 列表"""
+    texts, images = [], 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for item in content or []:
+            if item.get("type") == "text":
+                texts.append(item.get("text", ""))
+            elif item.get("type") == "image_url":
+                images += 1
+    return "\n".join(texts), images
+
+
+class MockDashScopeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None  # MockConfig，由 make_server 绑定
+
+    def log_message(self, format, *args):
+        # 压测时每个请求一行日志会成为瓶颈，只统计不打印
+        pass
+
+    # --- 响应工具 ---
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream;charset=UTF-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw or b"{}")
+
+    def _api_key(self):
+        auth = self.headers.get("Authorization", "")
+        return auth[len("Bearer "):].strip() if auth.startswith("Bearer ") else ""
+
+    def _admission(self):
+        """鉴权、限流和随机错误，返回 (HTTP 状态码, 错误码, 错误信息)，放行时返回 None"""
+        config = self.config
+        key = self._api_key()
+        if not key or key in config.reject_keys:
+            return 401, "InvalidApiKey", "Invalid API-key provided."
+        if not config.rate_window.allow():
+            return 429, "Throttling.RateQuota", "Requests rate limit exceeded, please try again later."
+        roll = config.rng.random()
+        if roll < config.throttle_rate:
+            return 429, "Throttling", "Requests throttling triggered."
+        if roll < config.throttle_rate + config.error_rate:
+            return 500, "InternalError", "An internal error has occured, please try again later."
+        return None
+
+    # --- 路由 ---
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/stats":
+            with self.config.stats_lock:
+                self._send_json(200, dict(self.config.stats))
+            return
+        if path.endswith(UPLOAD_POLICY_SUFFIX):
+            # SDK 上传本地文件前先获取 OSS 上传凭证，上传地址指回本服务
+            self.config.count("upload_policy")
+            policy = {
+                "policy": "mock", "signature": "mock", "upload_dir": "mock-dir",
+                "upload_host": f"http://{self.headers.get('Host')}{OSS_UPLOAD_PATH}",
+                "expire_in_seconds": 300, "max_file_size_mb": 100, "capacity_limit_mb": 999999,
+                "oss_access_key_id": "mock", "x_oss_object_acl": "private", "x_oss_forbid_overwrite": "true",
+            }
+            self._send_json(200, {"request_id": str(uuid.uuid4()), "data": policy, "output": policy})
+            return
+        self._send_json(404, {"code": "NotFound", "message": f"Unknown path: {path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path == OSS_UPLOAD_PATH:
+            # 丢弃上传的文件内容
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self.config.count("oss_upload")
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            body = self._read_json()
+        except ValueError:
+            self._send_json(400, {"code": "InvalidParameter", "message": "Request body is not valid JSON."})
+            return
+        if path.endswith(NATIVE_PATH_SUFFIX):
+            self._handle_native(body)
+        elif path.endswith(OPENAI_PATH_SUFFIX):
+            self._handle_openai(body)
+        else:
+            self._send_json(404, {"code": "NotFound", "message": f"Unknown path: {path}"})
+
+    # --- DashScope 原生接口 ---
+    def _handle_native(self, body):
+        config = self.config
+        request_id = str(uuid.uuid4())
+        stream = self.headers.get("X-DashScope-SSE", "").lower() == "enable"
+        config.count("native", "native_stream" if stream else "native_call")
+
+        rejected = self._admission()
+        if rejected is not None:
+            status, code, message = rejected
+            config.count(f"error_{status}")
+            self._send_json(status, {"code": code, "message": message, "request_id": request_id})
+            return
+
+        prompt, images = _native_prompt(body.get("input", {}).get("messages", []))
+        text = config.outputs.generate(prompt)
+        tokens = _split_tokens(text)
+        usage = self._usage(prompt, images, len(tokens))
+        native_usage = {
+            "input_tokens": usage["input"],
+            "output_tokens": usage["output"],
+            "total_tokens": usage["input"] + usage["output"],
+            "image_tokens": usage["image"],
+            "input_tokens_details": {"text_tokens": usage["text"], "image_tokens": usage["image"]},
+            "output_tokens_details": {"text_tokens": usage["output"]},
+        }
+        time.sleep(config.latency.sample())
+
+        if not stream:
+            time.sleep(config.token_interval_s * len(tokens))
+            self._send_json(200, {
+                "output": {"choices": [{"finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": [{"text": text}]}}]},
+                "usage": native_usage,
+                "request_id": request_id,
+            })
+            return
+
+        incremental = body.get("parameters", {}).get("incremental_output", False)
+        self._start_stream()
+        sent = ""
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(config.token_interval_s)
+            sent += token
+            last = index == len(tokens) - 1
+            event = {
+                "output": {"choices": [{
+                    "finish_reason": "stop" if last else "null",
+                    "message": {"role": "assistant", "content": [{"text": token if incremental else sent}]},
+                }]},
+                "usage": {**native_usage, "output_tokens": index + 1,
+                          "output_tokens_details": {"text_tokens": index + 1}},
+                "request_id": request_id,
+            }
+            self._write_chunk(f"id:{index + 1}\nevent:result\n:HTTP_STATUS/200\n"
+                              f"data:{json.dumps(event, ensure_ascii=False)}\n\n")
+        self._end_stream()
+
+    # --- OpenAI 兼容接口 ---
+    def _handle_openai(self, body):
+        config = self.config
+        request_id = f"chatcmpl-{uuid.uuid4()}"
+        stream = bool(body.get("stream"))
+        config.count("openai", "openai_stream" if stream else "openai_call")
+
+        rejected = self._admission()
+        if rejected is not None:
+            status, code, message = rejected
+            config.count(f"error_{status}")
+            self._send_json(status, {"error": {"message": message, "type": code, "code": code},
+                                     "request_id": request_id})
+            return
+
+        prompt, images = _openai_prompt(body.get("messages", []))
+        text = config.outputs.generate(prompt)
+        tokens = _split_tokens(text)
+        usage = self._usage(prompt, images, len(tokens))
+        openai_usage = {
+            "prompt_tokens": usage["input"],
+            "completion_tokens": usage["output"],
+            "total_tokens": usage["input"] + usage["output"],
+            "prompt_tokens_details": {"text_tokens": usage["text"], "image_tokens": usage["image"]},
+        }
+        model = body.get("model", "mock")
+        created = int(time.time())
+        time.sleep(config.latency.sample())
+
+        if not stream:
+            time.sleep(config.token_interval_s * len(tokens))
+            self._send_json(200, {
+                "id": request_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": openai_usage,
+            })
+            return
+
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            data = {"id": request_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else []}
+            if chunk_usage is not None:
+                data["usage"] = chunk_usage
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        self._start_stream()
+        self._write_chunk(chunk({"role": "assistant", "content": ""}))
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(config.token_interval_s)
+            self._write_chunk(chunk({"content": token}))
+        self._write_chunk(chunk({}, finish_reason="stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._write_chunk(chunk(None, chunk_usage=openai_usage))
+        self._write_chunk("data: [DONE]\n\n")
+        self._end_stream()
+
+    def _usage(self, prompt, images, output_tokens):
+        # 文本 Token 按每 2 个字符 1 个粗略估计
+        text_tokens = max(1, len(prompt) // 2)
+        image_tokens = images * self.config.image_tokens
+        return {"text": text_tokens, "image": image_tokens, "input": text_tokens + image_tokens,
+                "output": output_tokens}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 压测时同时建立的连接可能很多
+    request_queue_size = 1024
+
+
+def make_server(config, host="127.0.0.1", port=8765):
+    """创建模拟服务 (port=0 时自动选择空闲端口，实际端口见 server.server_address)"""
+    handler = type("BoundMockDashScopeHandler", (MockDashScopeHandler,), {"config": config})
+    return _Server((host, port), handler)
+
+
+def start_background_server(config, host="127.0.0.1", port=0):
+    """在后台线程中启动模拟服务，返回 (server, 原生接口 base url)；用完调用 server.shutdown()"""
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, name="mock-dashscope", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/api/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 DashScope 模拟服务 (原生接口 + OpenAI 兼容接口)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-dist", default="lognormal",
+                        choices=["fixed", "uniform", "normal", "lognormal", "exponential"],
+                        help="首 Token 延迟的分布")
+    parser.add_argument("--latency-ms", type=float, default=800, help="首 Token 延迟的均值 (毫秒)")
+    parser.add_argument("--latency-jitter-ms", type=float, default=300, help="首 Token 延迟的抖动 / 标准差 (毫秒)")
+    parser.add_argument("--token-interval-ms", type=float, default=20, help="每个输出 Token 的间隔 (毫秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 InternalError 的概率")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 429 Throttling 的概率")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟请求数上限，超出返回 429 (0 表示不限制)")
+    parser.add_argument("--image-tokens", type=int, default=1280, help="每张图片计入的图像 Token 数")
+    parser.add_argument("--output", default="auto", choices=["auto", "bbox", "point", "verdict"],
+                        help="返回内容：auto 按提示词选择检测框 / 点 / 判断结论")
+    parser.add_argument("--boxes", type=int, default=5, help="bbox / point 输出中的目标数量")
+    parser.add_argument("--response-file", help="总是返回该文件的内容 (优先于 --output)")
+    parser.add_argument("--reject-keys", default="", help="逗号分隔，这些 API Key 返回 401 InvalidApiKey")
+    parser.add_argument("--seed", type=int, help="随机种子 (复现延迟和错误序列)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    response_text = None
+    if args.response_file:
+        with open(args.response_file, "r", encoding="utf-8") as f:
+            response_text = f.read()
+    config = MockConfig(
+        latency=LatencyModel(args.latency_dist, args.latency_ms, args.latency_jitter_ms, rng=rng),
+        token_interval_s=args.token_interval_ms / 1000,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        rpm=args.rpm,
+        image_tokens=args.image_tokens,
+        outputs=CannedOutputs(args.output, args.boxes, response_text, rng=rng),
+        reject_keys=[key for key in args.reject_keys.split(",") if key],
+        seed=args.seed,
+    )
+    server = make_server(config, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"DashScope 模拟服务已启动: http://{host}:{port}")
+    print(f"    export DASHSCOPE_HTTP_BASE_URL=http://{host}:{port}/api/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
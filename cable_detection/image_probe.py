@@ -0,0 +1,170 @@
+import os
+import struct
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+
+from PIL import Image
+
+from image_preprocess import DEFAULT_MAX_PIXELS, DEFAULT_MIN_PIXELS, IMAGE_FACTOR, smart_resize
+
+# 内存中缓存的探测结果条数
+PROBE_CACHE_ENTRIES = 4096
+# 每张图片除 patch Token 外额外计入的 <vision_start> / <vision_end> 两个 Token
+VISION_SPECIAL_TOKENS = 2
+# 解析 JPEG 时最多向后扫描的字节数 (SOF 一般在 EXIF / ICC 等段之后，通常远小于此值)
+JPEG_SCAN_LIMIT = 4 * 1024 * 1024
+
+# JPEG 中带有图像尺寸的 SOF 段 (排除 DHT=C4、JPG=C8、DAC=CC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    """只读文件头得到的图片信息，size 与 PIL 的 Image.size 一致为 (width, height)"""
+    width: int
+    height: int
+    format: str
+    file_size: int
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+
+def estimate_image_tokens(width, height, min_pixels=DEFAULT_MIN_PIXELS, max_pixels=DEFAULT_MAX_PIXELS):
+    """
+    按 Qwen-VL 的缩放规则估算一张图片会被计费的图像 Token 数：
+    缩放后每个 32x32 的 patch 计 1 个 Token，另加开始 / 结束两个特殊 Token。
+    """
+    h_bar, w_bar = smart_resize(height, width, min_pixels=min_pixels, max_pixels=max_pixels)
+    return (h_bar // IMAGE_FACTOR) * (w_bar // IMAGE_FACTOR) + VISION_SPECIAL_TOKENS
+
+
+def _probe_png(f):
+    # 8 字节签名 + IHDR 段 (长度 4 + 类型 4 + 宽 4 + 高 4)
+    header = f.read(24)
+    if len(header) < 24 or header[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", header[16:24])
+    return width, height
+
+
+def _probe_jpeg(f):
+    f.seek(2)
+    while f.tell() < JPEG_SCAN_LIMIT:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        # 跳过填充字节 0xFF
+        while marker == b"\xff":
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            # SOI / RST / TEM 没有长度字段
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+    return None
+
+
+def _probe_webp(f):
+    header = f.read(30)
+    if len(header) < 30:
+        return None
+    chunk = header[12:16]
+    if chunk == b"VP8 ":
+        # 有损格式：关键帧起始码之后是 14 位的宽和高
+        if header[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack("<HH", header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        # 无损格式：签名 0x2F 之后是两个 14 位的 (宽 - 1) 和 (高 - 1)
+        if header[20] != 0x2F:
+            return None
+        bits = int.from_bytes(header[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        # 扩展格式：24 位的 (宽 - 1) 和 (高 - 1)
+        width = int.from_bytes(header[24:27], "little") + 1
+        height = int.from_bytes(header[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def _probe_file(image_path, file_size):
+    with open(image_path, "rb") as f:
+        signature = f.read(12)
+        f.seek(0)
+        size, image_format = None, None
+        if signature.startswith(b"\x89PNG\r\n\x1a\n"):
+            size, image_format = _probe_png(f), "PNG"
+        elif signature.startswith(b"\xff\xd8"):
+            size, image_format = _probe_jpeg(f), "JPEG"
+        elif signature[:4] == b"RIFF" and signature[8:12] == b"WEBP":
+            size, image_format = _probe_webp(f), "WEBP"
+    if size is None:
+        # 其他格式或文件头不规范时交给 PIL (Image.open 同样只解析文件头，不解码像素)
+        with Image.open(image_path) as img:
+            size, image_format = img.size, img.format
+    return ImageInfo(width=size[0], height=size[1], format=image_format, file_size=file_size)
+
+
+_probe_cache = OrderedDict()
+_probe_cache_lock = Lock()
+
+
+def probe_image(image_path):
+    """
+    读取图片的宽高、格式和文件大小。PNG / JPEG / WebP 只解析文件头，
+    结果按 (路径, mtime, 大小) 缓存，文件被替换后自动重新探测。
+    """
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+    with _probe_cache_lock:
+        info = _probe_cache.get(key)
+        if info is not None:
+            _probe_cache.move_to_end(key)
+            return info
+
+    info = _probe_file(image_path, stat.st_size)
+    with _probe_cache_lock:
+        _probe_cache[key] = info
+        while len(_probe_cache) > PROBE_CACHE_ENTRIES:
+            _probe_cache.popitem(last=False)
+    return info
+
+
+def format_file_size(num_bytes):
+    """文件大小的可读形式，例如 2.3 MB"""
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    for unit in ("KB", "MB", "GB"):
+        num_bytes /= 1024
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.1f} {unit}"
+
+
+def describe_image(image_path):
+    """一行图片摘要 (尺寸、格式、大小、预计图像 Token)，文件不存在或无法识别时返回空字符串"""
+    try:
+        info = probe_image(image_path)
+        tokens = estimate_image_tokens(info.width, info.height)
+    except Exception:
+        return ""
+    return f"{info.width} x {info.height} · {info.format} · {format_file_size(info.file_size)} · 约 {tokens} Token"
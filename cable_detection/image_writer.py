@@ -0,0 +1,120 @@
+import atexit
+import hashlib
+import io
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+# 标注图输出目录
+ANNOTATED_IMAGE_DIR = os.getenv("QWEN_ANNOTATED_DIR", "detected_images")
+# 标注图格式 (PNG / JPEG / WEBP)
+ANNOTATED_IMAGE_FORMAT = os.getenv("QWEN_ANNOTATED_FORMAT", "PNG").upper()
+# PNG 压缩级别 (0~9)：标注图只用于回看，默认用最快的 1，文件比默认的 6 略大
+ANNOTATED_PNG_COMPRESS_LEVEL = int(os.getenv("QWEN_ANNOTATED_PNG_COMPRESS_LEVEL", 1))
+# JPEG / WEBP 质量
+ANNOTATED_IMAGE_QUALITY = int(os.getenv("QWEN_ANNOTATED_QUALITY", 90))
+# 等待写盘的图片数上限，队列满时 submit 阻塞，避免积压的图片占满内存
+ANNOTATED_MAX_PENDING = int(os.getenv("QWEN_ANNOTATED_MAX_PENDING", 16))
+# 内容哈希在文件名中保留的位数
+HASH_LENGTH = 16
+
+_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+
+class AnnotatedImageWriter:
+    """
+    后台保存标注图：调用方提交后立即返回，编码和写盘在单独的线程中完成。
+
+    文件名为 <原图名>_<编码后内容的 sha1>.<ext>，同名上传不会互相覆盖，
+    内容完全相同的标注图只写一次。submit 返回的 Future 在写盘完成后给出文件路径。
+    """
+    def __init__(self, output_dir=ANNOTATED_IMAGE_DIR, image_format=ANNOTATED_IMAGE_FORMAT,
+                 compress_level=ANNOTATED_PNG_COMPRESS_LEVEL, quality=ANNOTATED_IMAGE_QUALITY,
+                 max_pending=ANNOTATED_MAX_PENDING):
+        if image_format not in _EXTENSIONS:
+            raise ValueError(f"不支持的标注图格式: {image_format}")
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.quality = quality
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _save_params(self):
+        if self.image_format == "PNG":
+            return {"compress_level": self.compress_level}
+        return {"quality": self.quality}
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="annotated-image-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, img, name):
+        """
+        提交一张标注图，返回 Future (结果为保存路径)。
+        img 会被复制一份再入队，调用方之后可以继续使用或修改原图 (例如交给 Gradio 编码)。
+        """
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((img.copy(), name, future))
+        return future
+
+    def flush(self, timeout=None):
+        """等待已提交的图片全部写完，超时返回 False"""
+        if timeout is None:
+            self._queue.join()
+            return True
+        done = threading.Event()
+        threading.Thread(target=lambda: (self._queue.join(), done.set()), daemon=True).start()
+        return done.wait(timeout)
+
+    def _run(self):
+        while True:
+            img, name, future = self._queue.get()
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(self._write(img, name))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, img, name):
+        buffer = io.BytesIO()
+        img.save(buffer, format=self.image_format, **self._save_params())
+        data = buffer.getbuffer()
+        digest = hashlib.sha1(data).hexdigest()[:HASH_LENGTH]
+        path = os.path.join(self.output_dir, f"{name}_{digest}{_EXTENSIONS[self.image_format]}")
+        if os.path.exists(path):
+            return path
+
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+
+_default_writer = None
+_default_writer_lock = threading.Lock()
+
+
+def get_image_writer():
+    """进程内共享的标注图写入器 (按模块配置创建，退出时等待未写完的图片)"""
+    global _default_writer
+    with _default_writer_lock:
+        if _default_writer is None:
+            _default_writer = AnnotatedImageWriter()
+            atexit.register(_default_writer.flush, 30)
+        return _default_writer
+
+
+def save_annotated_image(img, name):
+    """后台保存标注图，返回 Future (结果为保存路径)"""
+    return get_image_writer().submit(img, name)
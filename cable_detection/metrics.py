@@ -0,0 +1,262 @@
+import logging
+import math
+import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 指标中的 app 标签，默认取本文件所在的应用目录名 (cable_detection / diff_image_judge / ...)
+APP_NAME = os.getenv("QWEN_APP_NAME") or os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+# Prometheus 文本格式指标的监听地址，默认只监听本机 (需要远程抓取时设置 QWEN_METRICS_HOST)。
+# 各应用默认使用不同端口，可同时运行；端口设为 0 时不启动
+METRICS_HOST = os.getenv("QWEN_METRICS_HOST", "127.0.0.1")
+DEFAULT_METRICS_PORTS = {
+    "cable_detection": 9464,
+    "diff_image_judge": 9465,
+    "one_image_judge": 9466,
+    "multi_view_judge": 9467,
+}
+METRICS_PORT = int(os.getenv("QWEN_METRICS_PORT", DEFAULT_METRICS_PORTS.get(APP_NAME, 9464)))
+# 估算费用用的单价 (元 / 千 Token)，默认按 qwen3-vl-plus 0~32K 输入档，以实际账单为准
+PRICE_INPUT_PER_1K = float(os.getenv("QWEN_PRICE_INPUT_PER_1K", 0.001))
+PRICE_OUTPUT_PER_1K = float(os.getenv("QWEN_PRICE_OUTPUT_PER_1K", 0.01))
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """带标签的指标，按标签值的组合分别计数 (线程安全)"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(后缀, 标签, 值)]"""
+        with self._lock:
+            return [("", key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", key + (("le", _format_value(bound)),), cumulative))
+            samples.append(("_sum", key, total))
+            samples.append(("_count", key, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "qwen_requests_total", "模型调用次数 (status: ok / cache_hit / failed / parse_error)",
+    ("app", "model", "status")))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "qwen_request_duration_seconds", "一次调用的总耗时 (含缓存查询、预处理和重试)",
+    ("app", "model", "status"), LATENCY_BUCKETS))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "qwen_stage_duration_seconds", "各阶段耗时 (见 tracing.STAGE_LABELS)", ("app", "stage"), STAGE_BUCKETS))
+ERRORS = REGISTRY.register(Counter(
+    "qwen_errors_total", "失败的调用尝试，按 DashScope 返回的 code 分类 (含之后重试成功的尝试)",
+    ("app", "model", "code")))
+CACHE_HITS = REGISTRY.register(Counter(
+    "qwen_cache_hits_total", "响应缓存命中次数 (不消耗 Token)", ("app", "model")))
+TOKENS = REGISTRY.register(Counter(
+    "qwen_tokens_total", "消耗的 Token 数 (kind: image / text / output)", ("app", "model", "kind")))
+REQUEST_TOKENS = REGISTRY.register(Histogram(
+    "qwen_request_tokens", "单次调用的 Token 数 (kind: image / text / output)",
+    ("app", "model", "kind"), TOKEN_BUCKETS))
+COST = REGISTRY.register(Counter(
+    "qwen_cost_yuan_total", "按 QWEN_PRICE_*_PER_1K 估算的费用 (元)", ("app", "model")))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "qwen_in_flight_requests", "正在进行中的调用数", ("app", "model")))
+
+
+def usage_tokens(usage):
+    """从 DashScope 的 usage 中取出 (图像, 文本输入, 输出) Token 数"""
+    usage = usage or {}
+    image_tokens = usage.get("image_tokens") or 0
+    text_tokens = (usage.get("input_tokens_details") or {}).get(
+        "text_tokens", max((usage.get("input_tokens") or 0) - image_tokens, 0))
+    output_tokens = (usage.get("output_tokens_details") or {}).get("text_tokens", usage.get("output_tokens") or 0)
+    return image_tokens, text_tokens, output_tokens
+
+
+def record_request(model, status, seconds, usage=None):
+    """记录一次调用的结果、耗时和 Token 用量 (缓存命中不计 Token)"""
+    REQUESTS.inc(app=APP_NAME, model=model, status=status)
+    REQUEST_SECONDS.observe(seconds, app=APP_NAME, model=model, status=status)
+    if status == "cache_hit":
+        CACHE_HITS.inc(app=APP_NAME, model=model)
+    if not usage:
+        return
+    image_tokens, text_tokens, output_tokens = usage_tokens(usage)
+    for kind, count in (("image", image_tokens), ("text", text_tokens), ("output", output_tokens)):
+        TOKENS.inc(count, app=APP_NAME, model=model, kind=kind)
+        REQUEST_TOKENS.observe(count, app=APP_NAME, model=model, kind=kind)
+    cost = (image_tokens + text_tokens) / 1000 * PRICE_INPUT_PER_1K + output_tokens / 1000 * PRICE_OUTPUT_PER_1K
+    COST.inc(cost, app=APP_NAME, model=model)
+
+
+def record_error(model, code):
+    """记录一次失败的调用尝试 (code 为 DashScope 的 response.code，网络错误为 NetworkError)"""
+    ERRORS.inc(app=APP_NAME, model=model, code=code or "Unknown")
+
+
+@contextmanager
+def track_in_flight(model):
+    IN_FLIGHT.inc(app=APP_NAME, model=model)
+    try:
+        yield
+    finally:
+        IN_FLIGHT.dec(app=APP_NAME, model=model)
+
+
+class MetricsExporter:
+    """
+    tracing 的导出器：从整体 span (带 model 属性) 记录调用结果和 Token 用量，
+    从各阶段 span 记录阶段耗时。
+    """
+    def export(self, spans):
+        *stages, root = spans
+        for span in stages:
+            STAGE_SECONDS.observe(span.duration, app=APP_NAME, stage=span.name)
+        model = root.attributes.get("model")
+        if model is not None:
+            record_request(model, root.attributes.get("status", "unknown"), root.duration,
+                           root.attributes.get("usage"))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """在后台线程中提供 /metrics (每个进程只启动一次)，端口被占用时只记录警告，不影响界面启动"""
+    global _server
+    with _server_lock:
+        if _server is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            logger.warning("指标服务启动失败 (%s:%s): %s", host, port, e)
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"Prometheus 指标: http://{host}:{_server.server_address[1]}/metrics")
+        return _server
@@ -1,83 +1,46 @@
 # from 官方文档 https://help.aliyun.com/zh/model-studio/vision#178c39c20b290
-import json
-import ast
 import os
 import requests
-import subprocess
 
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
-from PIL import ImageColor
+from PIL import Image, ImageDraw
 from openai import OpenAI
+from image_preprocess import DEFAULT_MIN_PIXELS, DEFAULT_MAX_PIXELS
+from detections import Detections, render_detections
+from image_writer import ANNOTATED_IMAGE_DIR, save_annotated_image
+from json_extract import IncrementalDetectionParser, extract_detections, scan_json
+from render_resources import BBOX_PALETTE, find_chinese_font, get_chinese_font, load_font
+from tracing import Trace
 
 QWEN_MODEL_NAME = 'qwen3-vl-plus-2025-09-23'
 
 from dotenv import load_dotenv
 load_dotenv() # 这会加载 .env 文件中的变量到 os.environ
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
+# OpenAI 兼容接口地址：未单独设置时由 DASHSCOPE_HTTP_BASE_URL 推出 (.../api/v1 -> .../compatible-mode/v1)，
+# 这样指向本地模拟服务 (benchmarks/mock_dashscope.py) 时所有调用方式只需要一个设置
+DASHSCOPE_COMPATIBLE_BASE_URL = os.getenv(
+    "DASHSCOPE_COMPATIBLE_BASE_URL",
+    os.getenv("DASHSCOPE_HTTP_BASE_URL", "https://dashscope.aliyuncs.com/api/v1").rstrip("/")
+    .removesuffix("/api/v1") + "/compatible-mode/v1"
+)
+
+SAVE_DIR = ANNOTATED_IMAGE_DIR
 
-SAVE_DIR = "detected_images"
-
-
-additional_colors = [colorname for (colorname, colorcode) in ImageColor.colormap.items()]
-
-def find_chinese_font():
-    """自动查找系统中的中文字体"""
-    # 常见的中文字体路径
-    chinese_font_paths = [
-        # Ubuntu/Debian
-        "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
-        "/usr/share/fonts/truetype/arphic/ukai.ttc",
-        "/usr/share/fonts/truetype/arphic/uming.ttc",
-        "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
-        "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
-        
-        # CentOS/RHEL
-        "/usr/share/fonts/cjkuni-ukai/ukai.ttc",
-        "/usr/share/fonts/cjkuni-uming/uming.ttc",
-        
-        # 通用路径
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-    ]
-    
-    for font_path in chinese_font_paths:
-        if os.path.exists(font_path):
-            return font_path
-    
-    # 如果以上都没有，尝试使用fc-list查找
-    try:
-        result = subprocess.run(['fc-list', ':lang=zh'], capture_output=True, text=True)
-        if result.returncode == 0 and result.stdout:
-            # 取第一个找到的中文字体
-            first_font = result.stdout.split('\n')[0].split(':')[0]
-            if first_font and os.path.exists(first_font):
-                return first_font
-    except:
-        pass
-    
-    return None
 
 def decode_json_points(text: str):
     """Parse coordinate points from text format"""
     try:
-        # 清理markdown标记
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0]
-
-        # 解析JSON
-        data = json.loads(text)
         points = []
         labels = []
 
-        for item in data:
-            if "point_2d" in item:
-                x, y = item["point_2d"]
+        for detection in extract_detections(text):
+            if detection.point is not None:
+                x, y = detection.point
                 points.append([x, y])
 
                 # 获取label，如果没有则使用默认值
-                label = item.get("label", f"point_{len(points)}")
-                labels.append(label)
+                labels.append(detection.label or f"point_{len(points)}")
 
         return points, labels
 
@@ -86,13 +49,61 @@ def decode_json_points(text: str):
         return [], []
 
 
-def plot_bounding_boxes(img_path, bounding_boxes):
+def to_pixel_boxes(detections, image_size, input_size=None):
+    """
+        把模型输出的检测框整体转换为原图上的像素坐标 (plot_bounding_boxes 和流式绘制共用)
+    Args:
+        detections: detections.Detections
+        image_size: 原图尺寸 (width, height)
+        input_size: 同 plot_bounding_boxes
+    """
+    if input_size is not None:
+        # 模型输出的是缩放后图像上的绝对坐标，按比例映射回原图
+        detections = detections.rescale(input_size, image_size)
+    else:
+        # 将标准化坐标映射到原图上，变为绝对坐标
+        detections = detections.denormalize(image_size)
+    return detections.truncate().sort_corners()
+
+
+class StreamingBoxPlotter:
+    """
+    流式输出时边接收边绘制检测框：每收到一段文本，只把新闭合的 bbox 画到同一张图上，
+    不必等整个 JSON 数组输出完毕。最终结果仍以 plot_bounding_boxes 的整体解析为准。
+    """
+    def __init__(self, img_path, input_size=None):
+        self.image = Image.open(img_path).convert("RGB")
+        self.input_size = input_size
+        self.parser = IncrementalDetectionParser()
+        self._font = get_chinese_font(25)
+        self._count = 0
+
+    def update(self, text):
+        """传入目前为止的完整输出，有新画上的框时返回 True"""
+        new_detections = self.parser.update(text)
+        boxes = Detections.from_detections(new_detections, start_index=self._count)
+        self._count += len(new_detections)
+        boxes = to_pixel_boxes(boxes, self.image.size, self.input_size)
+        return render_detections(self.image, boxes, BBOX_PALETTE, font=self._font) > 0
+
+
+def _report_saved(future):
+    try:
+        print(f"Image successfully saved to: {future.result()}")
+    except Exception as e:
+        print(f"Error saving annotated image: {e}")
+
+
+def plot_bounding_boxes(img_path, bounding_boxes, input_size=None):
 
     """
         在图像上绘制边界框，并标注名称
     Args:
         img_path: 图像的路径
         bounding_boxes: 包含对象名称的边界框列表，并且位置为标准化的[y1 x1 y2 x2]格式。
+        input_size: 可选，送入模型的 (缩放后) 图像尺寸 (width, height)。
+            传入时 bbox 按该图像上的绝对像素坐标处理，并映射回原图；
+            默认按 Qwen3-VL 的 0~1000 归一化坐标处理 (与上传前是否缩放无关)。
     """
 
     # 加载图像并创建绘图对象
@@ -100,99 +111,29 @@ def plot_bounding_boxes(img_path, bounding_boxes):
         img = Image.open(img_path).convert("RGB")
     else:
         img = img_path
-    width, height = img.size
     print(img.size)
+    trace = Trace("plot_bounding_boxes")
 
-    draw = ImageDraw.Draw(img)
-
-    # 定义颜色列表用于区分不同对象
-    colors = [
-                 'red',
-                 'green',
-                 'blue',
-                 'yellow',
-                 'orange',
-                 'pink',
-                 'purple',
-                 'brown',
-                 'gray',
-                 'beige',
-                 'turquoise',
-                 'cyan',
-                 'magenta',
-                 'lime',
-                 'navy',
-                 'maroon',
-                 'teal',
-                 'olive',
-                 'coral',
-                 'lavender',
-                 'violet',
-                 'gold',
-                 'silver',
-             ] + additional_colors
-
-    # 解析边界框信息
-    bounding_boxes = parse_json(bounding_boxes)
+    # 解析边界框信息 (代码块 / 夹在文字中的 JSON 都可以，截断的输出只丢弃最后一个不完整的框)
+    with trace.span("parse"):
+        detections = Detections.from_text(bounding_boxes)
 
     # font = ImageFont.truetype("NotoSansCJK-Regular.ttc", size=25)
-    # 查找中文字体
-    chinese_font_path = find_chinese_font()
-    if chinese_font_path:
-        try:
-            font = ImageFont.truetype(chinese_font_path, size=25)
-        except:
-            font = ImageFont.load_default()
-    else:
-        font = ImageFont.load_default()
+    # 中文字体每个进程只查找、加载一次
+    font = get_chinese_font(25)
 
-    try:
-        json_output = ast.literal_eval(bounding_boxes)
-    except Exception as e:
-        end_idx = bounding_boxes.rfind('"}') + len('"}')
-        truncated_text = bounding_boxes[:end_idx] + "]"
-        json_output = ast.literal_eval(truncated_text)
-
-    if not isinstance(json_output, list):
-        json_output = [json_output]
-
-    # 绘制每个边界框
-    for i, bounding_box in enumerate(json_output):
-        color = colors[i % len(colors)]
-
-        # 将标准化坐标映射到原图上，变为绝对坐标
-        abs_y1 = int(bounding_box["bbox_2d"][1] / 1000 * height)
-        abs_x1 = int(bounding_box["bbox_2d"][0] / 1000 * width)
-        abs_y2 = int(bounding_box["bbox_2d"][3] / 1000 * height)
-        abs_x2 = int(bounding_box["bbox_2d"][2] / 1000 * width)
-
-        if abs_x1 > abs_x2:
-            abs_x1, abs_x2 = abs_x2, abs_x1
-
-        if abs_y1 > abs_y2:
-            abs_y1, abs_y2 = abs_y2, abs_y1
-
-        # 绘制矩形框
-        draw.rectangle(
-            ((abs_x1, abs_y1), (abs_x2, abs_y2)), outline=color, width=5
-        )
-
-        # 添加标签文字
-        if "label" in bounding_box:
-            draw.text((abs_x1 + 8, abs_y1 + 6), bounding_box["label"], fill=color, font=font)
+    # 坐标整体换算为原图像素坐标，再一次绘制所有边界框 (颜色按原始序号选取)
+    with trace.span("render"):
+        detections = to_pixel_boxes(detections, img.size, input_size)
+        drawn = render_detections(img, detections, BBOX_PALETTE, font=font)
+    trace.finish(boxes=drawn)
 
     # 显示最终图像
     # img.show()
-    if not os.path.exists(SAVE_DIR):
-        os.makedirs(SAVE_DIR)
-    name, ext = os.path.splitext(os.path.basename(img_path) if isinstance(img_path, str) else "image.png")
-    save_filename = f"{name}_annotated{ext}"
-    save_path = os.path.join(SAVE_DIR, save_filename)
-    try:
-        img.save(save_path)
-        print(f"Image successfully saved to: {save_path}")
-    except Exception as e:
-        print(f"Error saving image to {save_path}: {e}")
+    # 标注图交给后台线程编码、写盘，界面直接拿到内存中的图像
+    name = os.path.splitext(os.path.basename(img_path) if isinstance(img_path, str) else "image.png")[0]
+    future = save_annotated_image(img, f"{name}_annotated")
+    future.add_done_callback(_report_saved)
     return img
 
 
@@ -200,11 +141,7 @@ def plot_points(im, text):
     img = im
     width, height = img.size
     draw = ImageDraw.Draw(img)
-    colors = [
-                 'red', 'green', 'blue', 'yellow', 'orange', 'pink', 'purple', 'brown', 'gray',
-                 'beige', 'turquoise', 'cyan', 'magenta', 'lime', 'navy', 'maroon', 'teal',
-                 'olive', 'coral', 'lavender', 'violet', 'gold', 'silver',
-             ] + additional_colors
+    colors = BBOX_PALETTE
 
     points, descriptions = decode_json_points(text)
     print("Parsed points: ", points)
@@ -213,7 +150,7 @@ def plot_points(im, text):
         img.show()
         return
 
-    font = ImageFont.truetype("NotoSansCJK-Regular.ttc", size=14)
+    font = load_font(("NotoSansCJK-Regular.ttc", find_chinese_font()), 14)
 
     for i, point in enumerate(points):
         color = colors[i % len(colors)]
@@ -230,19 +167,14 @@ def plot_points_json(im, text):
     img = im
     width, height = img.size
     draw = ImageDraw.Draw(img)
-    colors = [
-                 'red', 'green', 'blue', 'yellow', 'orange', 'pink', 'purple', 'brown', 'gray',
-                 'beige', 'turquoise', 'cyan', 'magenta', 'lime', 'navy', 'maroon', 'teal',
-                 'olive', 'coral', 'lavender', 'violet', 'gold', 'silver',
-             ] + additional_colors
-    font = ImageFont.truetype("NotoSansCJK-Regular.ttc", size=14)
-
-    text = text.replace('```json', '')
-    text = text.replace('```', '')
-    data = json.loads(text)
-    for item in data:
-        point_2d = item['point_2d']
-        label = item['label']
+    colors = BBOX_PALETTE
+    font = load_font(("NotoSansCJK-Regular.ttc", find_chinese_font()), 14)
+
+    for detection in extract_detections(text):
+        if detection.point is None:
+            continue
+        point_2d = detection.point
+        label = detection.label or ""
         x, y = int(point_2d[0] / 1000 * width), int(point_2d[1] / 1000 * height)
         radius = 2
         draw.ellipse([(x - radius, y - radius), (x + radius, y + radius)], fill=colors[0])
@@ -251,26 +183,20 @@ def plot_points_json(im, text):
     img.show()
 
 
-# 解析JSON输出
+# 解析JSON输出：返回模型输出中的 JSON 文本 (去掉代码块标记和说明文字，截断时已补齐括号)
 def parse_json(json_output):
-    # 移除Markdown代码块标记
-    lines = json_output.splitlines()
-    for i, line in enumerate(lines):
-        if line == "```json":
-            json_output = "\n".join(lines[i + 1:])  # 删除 "```json"之前的所有内容
-            json_output = json_output.split("```")[0]  # 删除 "```"之后的所有内容
-            break  # 找到"```json"后退出循环
-    return json_output
+    _, json_text = scan_json(json_output)
+    return json_text if json_text is not None else json_output
 
 
 
 # 调用Qwen3-VL的 API
 def inference_with_api(prompt, sys_prompt="You are a helpful assistant.", model_id=QWEN_MODEL_NAME,
-                       min_pixels=4 * 32 * 32, max_pixels=2560 * 32 * 32):
+                       min_pixels=DEFAULT_MIN_PIXELS, max_pixels=DEFAULT_MAX_PIXELS):
     client = OpenAI(
         # 若没有配置环境变量，请用阿里云百炼API Key将下行替换为：api_key="sk-xxx",
         api_key=DASHSCOPE_API_KEY,
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+        base_url=DASHSCOPE_COMPATIBLE_BASE_URL,
     )
 
     messages = [
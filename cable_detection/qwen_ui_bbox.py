@@ -6,8 +6,9 @@ import dashscope
 from dashscope import MultiModalConversation
 from utils import get_file_url, get_image_size, draw_bbox_on_image
 from history_manager import HistoryManager
-from qwen_requester import QwenRequester
-from qwen3_vl_2d import plot_bounding_boxes
+from qwen_requester import get_async_requester
+from metrics import start_metrics_server
+from qwen3_vl_2d import StreamingBoxPlotter, plot_bounding_boxes
 
 from dotenv import load_dotenv
 load_dotenv() # 这会加载 .env 文件中的变量到 os.environ
@@ -19,41 +20,52 @@ history_manager = HistoryManager()
 # --- Gradio 界面函数 ---
 
 # ❗️ 恢复 system_prompt 参数
-def gradio_qwen_call(api_key, input_image_path, question, system_prompt):
-    """Gradio 接口函数，用于连接 UI 输入和 QwenRequester 逻辑。"""
+async def gradio_qwen_call(api_key, input_image_path, question, system_prompt, bypass_cache=False):
+    """Gradio 接口函数，用于连接 UI 输入和 AsyncQwenRequester 逻辑 (流式输出，逐步刷新结果框)。"""
     
     if not api_key:
-        return "错误：请输入 Qwen API Key。", "Token 信息：API Key 缺失"
+        yield "错误：请输入 Qwen API Key。", "Token 信息：API Key 缺失", None, None, None, None
+        return
     
     if not input_image_path:
-        return "错误：请上传图像。", "Token 信息：图像缺失"
+        yield "错误：请上传图像。", "Token 信息：图像缺失", None, None, None, None
+        return
 
-    # 1. 初始化 Requester
+    # 1. 获取复用的异步 Requester (共享长连接和并发上限，API Key 按调用传入，不同用户互不覆盖)
     try:
-        requester = QwenRequester(api_key=api_key)
+        requester = get_async_requester()
     except Exception as e:
-        return f"错误：初始化 QwenRequester 失败。\n{e}", "Token 信息：初始化失败"
+        yield f"错误：初始化 AsyncQwenRequester 失败。\n{e}", "Token 信息：初始化失败", None, None, None, None
+        return
 
-    # 2. 调用请求函数 (传入 system_prompt)
-    response_text, token_info = requester.request_qwen(
+    # 2. 流式调用请求函数 (传入 system_prompt)，边生成边刷新输出框；
+    #    每个 bbox 对象一闭合就画到标注图上，没有新框时不刷新图片
+    try:
+        plotter = StreamingBoxPlotter(input_image_path)
+    except Exception as e:
+        yield f"错误：无法打开图像。\n{e}", "Token 信息：图像读取失败", None, None, None, None
+        return
+
+    response_text, usage = "", None
+    async for response_text, usage in requester.request_qwen_stream(
         question=question, 
         image_path=input_image_path,
-        system_prompt=system_prompt # 传递 UI 输入的 system_prompt
-    )
+        system_prompt=system_prompt, # 传递 UI 输入的 system_prompt
+        use_cache=not bypass_cache,
+        api_key=api_key
+    ):
+        annotated_image = plotter.image.copy() if plotter.update(response_text) else gr.update()
+        yield response_text, usage.format(), annotated_image, input_image_path, question, system_prompt
     
     # 3. 保存到历史记录
-    # history_manager.add_record(input_image_path, question, system_prompt, response_text, token_info)
-    
-    return response_text, token_info, input_image_path, question, system_prompt
+    # history_manager.add_record(input_image_path, question, system_prompt, response_text, usage)
 
 # main.py
 def save_history_record(original_image_path, question, system_prompt, model_response, token_info, saved_annotated_image_path):
     """
     负责将所有信息（包括保存的图片路径）保存到历史记录。
     """
-    # 假设 history_manager.add_record 已经更新，可以接受保存的图片路径
-    
-    # ⚠️ 你需要确保你的 history_manager.add_record 函数可以接受这个额外的参数
+    # history_manager.add_record 的最后一个参数 annotated_image_path 用于记录标注图路径
     history_manager.add_record(
         original_image_path, 
         question, 
@@ -124,6 +136,11 @@ with gr.Blocks(title="Qwen-VL 机器人技能决策") as demo:
                     autoscroll=True
                 )
 
+                bypass_cache_input = gr.Checkbox(
+                    label="跳过响应缓存 (强制重新调用模型)",
+                    value=False
+                )
+
                 submit_btn = gr.Button("🚀 执行技能决策 (调用 Qwen-VL)", variant="primary")
 
             # 右侧输出区域
@@ -169,6 +186,13 @@ with gr.Blocks(title="Qwen-VL 机器人技能决策") as demo:
                     interactive=False
                 )
         
+        # 分页控件：每页只读取和渲染 HISTORY_PAGE_SIZE 条记录
+        with gr.Row():
+            prev_page_btn = gr.Button("⬅️ 上一页", size="sm")
+            history_page = gr.Number(label="页码", value=1, precision=0, minimum=1)
+            next_page_btn = gr.Button("下一页 ➡️", size="sm")
+            history_page_info = gr.Markdown(value=lambda: history_manager.load_history_page(1)[2])
+
         history_output = gr.HTML(
             label="调用历史记录",
             value=history_manager.load_history_records
@@ -178,8 +202,9 @@ with gr.Blocks(title="Qwen-VL 机器人技能决策") as demo:
     submit_btn.click(
         fn=gradio_qwen_call,
         # ❗️ 恢复 system_prompt_input
-        inputs=[api_key_input, image_input, question_input, system_prompt_input],
-        outputs=[output_result, token_output, gr.State(value=None), gr.State(value=None), gr.State(value=None)]
+        inputs=[api_key_input, image_input, question_input, system_prompt_input, bypass_cache_input],
+        outputs=[output_result, token_output, annotated_image_output,
+                 gr.State(value=None), gr.State(value=None), gr.State(value=None)]
     ).then(
         fn=plot_bounding_boxes,
         inputs=[image_input, output_result],
@@ -194,14 +219,34 @@ with gr.Blocks(title="Qwen-VL 机器人技能决策") as demo:
     )
 
     # 历史记录页面按钮事件
+    history_page_outputs = [history_output, history_page, history_page_info]
     refresh_btn.click(
-        fn=history_manager.load_history_records,
-        outputs=history_output
+        fn=history_manager.load_history_page,
+        inputs=[history_page],
+        outputs=history_page_outputs
+    )
+    prev_page_btn.click(
+        fn=lambda page: history_manager.load_history_page(page - 1),
+        inputs=[history_page],
+        outputs=history_page_outputs
+    )
+    next_page_btn.click(
+        fn=lambda page: history_manager.load_history_page(page + 1),
+        inputs=[history_page],
+        outputs=history_page_outputs
+    )
+    history_page.submit(
+        fn=history_manager.load_history_page,
+        inputs=[history_page],
+        outputs=history_page_outputs
     )
     
     clear_btn.click(
         fn=history_manager.clear_history,
         outputs=[history_status, history_output]
+    ).then(
+        fn=lambda: history_manager.load_history_page(1),
+        outputs=history_page_outputs
     )
     
     # --- 示例 ---
@@ -223,5 +268,6 @@ with gr.Blocks(title="Qwen-VL 机器人技能决策") as demo:
 if __name__ == '__main__':
     DEFAULT_PORT = 7870
     print(f"Gradio App 正在启动，请在浏览器中访问 http://127.0.0.1:{DEFAULT_PORT}")
+    start_metrics_server()
     demo.launch(server_port=DEFAULT_PORT)
     # demo.launch(server_port=DEFAULT_PORT,share=True)    稳定后生成固定链接
\ No newline at end of file
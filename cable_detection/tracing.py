@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field
+
+# 设置后每个 span 追加一行 JSON 到该文件
+TRACE_FILE = os.getenv("QWEN_TRACE_FILE")
+# 进程内环形缓冲区保留的 span 数
+TRACE_BUFFER_SIZE = int(os.getenv("QWEN_TRACE_BUFFER_SIZE", 2000))
+
+# 用量统计 (UsageRecord.format) 中显示的阶段名称 (按调用顺序)
+STAGE_LABELS = {
+    "cache_lookup": "查缓存",
+    "prepare": "预处理",
+    "encode": "编码",
+    "queue": "排队",
+    "rate_limit": "限流等待",
+    "network": "模型/网络",
+    "retry_wait": "重试退避",
+    "parse": "解析",
+    "cache_store": "写缓存",
+    "render": "绘制",
+}
+# 属于模型和网络的阶段，其余都算本地开销
+REMOTE_STAGES = {"network"}
+
+
+@dataclass
+class Span:
+    """一个阶段的耗时：start 为开始时刻 (Unix 时间戳)，duration 为秒数"""
+    trace_id: str
+    name: str
+    start: float
+    duration: float
+    attributes: dict = field(default_factory=dict)
+
+
+class RingBufferExporter:
+    """在内存中保留最近的 span (线程安全)，用于界面或调试时查看"""
+    def __init__(self, maxlen=TRACE_BUFFER_SIZE):
+        self._spans = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        with self._lock:
+            self._spans.extend(spans)
+
+    def spans(self, trace_id=None):
+        with self._lock:
+            spans = list(self._spans)
+        return spans if trace_id is None else [span for span in spans if span.trace_id == trace_id]
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class JsonlExporter:
+    """每个 span 追加一行 JSON 到本地文件 (多线程共用一个文件句柄，按行加锁写入)"""
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(json.dumps(asdict(span), ensure_ascii=False) + "\n" for span in spans)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_ring_buffer = RingBufferExporter()
+_exporters = [_ring_buffer] + ([JsonlExporter(TRACE_FILE)] if TRACE_FILE else [])
+_exporters_lock = threading.Lock()
+
+
+def get_ring_buffer():
+    """进程内共享的环形缓冲区导出器"""
+    return _ring_buffer
+
+
+def add_exporter(exporter):
+    """注册额外的导出器 (任何带 export(spans) 方法的对象)"""
+    with _exporters_lock:
+        _exporters.append(exporter)
+
+
+def remove_exporter(exporter):
+    with _exporters_lock:
+        if exporter in _exporters:
+            _exporters.remove(exporter)
+
+
+class Trace:
+    """
+    一次调用的分阶段计时。用 span() 包住每个阶段，finish() 时记录整体 span 并交给所有导出器。
+
+    热路径上只有 perf_counter 和列表追加；同名阶段 (例如重试) 的耗时在 durations() 中累加。
+    """
+    def __init__(self, name, **attributes):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.spans = []
+        self._start = time.time()
+        self._start_perf = time.perf_counter()
+        self._finished = False
+
+    @contextmanager
+    def span(self, name, **attributes):
+        start, start_perf = time.time(), time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append(Span(self.trace_id, name, start, time.perf_counter() - start_perf, attributes))
+
+    def add(self, name, duration, **attributes):
+        """记录一个已经测好的阶段 (例如首 Token 耗时)"""
+        self.spans.append(Span(self.trace_id, name, time.time() - duration, duration, attributes))
+
+    def elapsed(self):
+        return time.perf_counter() - self._start_perf
+
+    def durations(self):
+        """{阶段名: 秒数}，同名阶段累加"""
+        totals = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        return totals
+
+    def finish(self, **attributes):
+        """记录整体 span 并导出 (只导出一次)"""
+        if self._finished:
+            return
+        self._finished = True
+        self.attributes.update(attributes)
+        root = Span(self.trace_id, self.name, self._start, self.elapsed(), self.attributes)
+        spans = self.spans + [root]
+        with _exporters_lock:
+            exporters = list(_exporters)
+        for exporter in exporters:
+            try:
+                exporter.export(spans)
+            except Exception as e:
+                print(f"导出 trace 失败 ({type(exporter).__name__}): {e}")
+
+
+def maybe_span(trace, name, **attributes):
+    """trace 为 None 时不计时 (供可选传入 trace 的函数使用)"""
+    return trace.span(name, **attributes) if trace is not None else nullcontext()
+
+
+def format_stage_breakdown(durations):
+    """用量统计中的阶段耗时，例如 "预处理 0.012 秒 | 模型/网络 1.203 秒"，以及本地 / 远端的总耗时"""
+    if not durations:
+        return []
+    names = [name for name in STAGE_LABELS if name in durations]
+    names += [name for name in durations if name not in STAGE_LABELS]
+    parts = [f"{STAGE_LABELS.get(name, name)} {durations[name]:.3f} 秒" for name in names]
+    remote = sum(seconds for name, seconds in durations.items() if name in REMOTE_STAGES)
+    local = sum(seconds for name, seconds in durations.items() if name not in REMOTE_STAGES)
+    return [
+        "阶段耗时: " + " | ".join(parts),
+        f"本地处理: {local:.3f} 秒, 模型/网络: {remote:.3f} 秒",
+    ]
@@ -0,0 +1,169 @@
+"""
+批量判断命令行工具：对整个图片目录 (或 glob) 并发调用 Qwen-VL，结果逐条写入 JSONL。
+
+用法示例:
+    python batch_judge.py "qwen_pictures/*.png" \
+        --question "这是某个角度工件实测和模型的点云投影图，请你从视觉理解判断这两个点云是否匹配上了。" \
+        --system-prompt-file prompt.txt \
+        --output results.jsonl --workers 8
+
+有多个 API Key 时用 --api-keys sk-a,sk-b (或环境变量 DASHSCOPE_API_KEYS) 组成 Key 池，
+请求分摊到最空闲的 Key 上，吞吐量随 Key 的数量线性扩展。
+
+进程中断后用同一个 --output 重新运行，已经成功的图片会被跳过。
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+from key_pool import ApiKeyPool
+from qwen_requester import QwenRequester, QWEN_MODEL_NAME
+from usage_record import UsageRecord
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+
+def collect_images(source):
+    """source 可以是目录，也可以是 glob 表达式"""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def load_finished(output_path):
+    """读取已有的 JSONL 结果，返回已经成功判断过的图片路径集合 (用于断点续跑)"""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 崩溃时最后一行可能只写了一半，直接忽略
+                continue
+            if record.get("status") == "ok":
+                finished.add(os.path.abspath(record["image_path"]))
+    return finished
+
+
+def judge_one(requester, image_path, question, system_prompt):
+    """单张图片的判断任务，在线程池中执行"""
+    start_time = time.time()
+    try:
+        response_text, usage = requester.request_qwen(
+            question=question,
+            image_path=image_path,
+            system_prompt=system_prompt
+        )
+    except Exception as e:
+        response_text, usage = f"调用异常: {e!r}", UsageRecord.failure("Exception")
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "image_path": image_path,
+        "status": "failed" if usage.failed else "ok",
+        "response": response_text,
+        "usage": usage.to_dict(),
+        "elapsed": round(time.time() - start_time, 3),
+    }
+
+
+def run_batch(images, requester, question, system_prompt, output_path, workers):
+    """
+    用有界线程池并发判断，每完成一张就追加写入 JSONL。
+    同时在途的任务数不超过 workers，避免一次性提交上千个任务。
+    """
+    ok_count = failed_count = 0
+    pending = set()
+    image_iter = iter(images)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            open(output_path, 'a', encoding='utf-8') as out:
+
+        def submit_next():
+            image_path = next(image_iter, None)
+            if image_path is not None:
+                pending.add(executor.submit(judge_one, requester, image_path, question, system_prompt))
+
+        for _ in range(workers):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+
+                if record["status"] == "ok":
+                    ok_count += 1
+                else:
+                    failed_count += 1
+                print(f"[{ok_count + failed_count}/{len(images)}] {record['status']}: {record['image_path']}")
+                submit_next()
+
+    return ok_count, failed_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量调用 Qwen-VL 判断目录中的图片")
+    parser.add_argument("source", help="图片目录或 glob 表达式，例如 'qwen_pictures/*.png'")
+    parser.add_argument("--question", required=True, help="VLM 提问/指令")
+    parser.add_argument("--system-prompt", default="", help="自定义 System Prompt (默认为空)")
+    parser.add_argument("--system-prompt-file", help="从文件读取 System Prompt，优先于 --system-prompt")
+    parser.add_argument("--output", default="batch_results.jsonl", help="结果 JSONL 文件 (同时用于断点续跑)")
+    parser.add_argument("--workers", type=int, default=8, help="并发线程数")
+    parser.add_argument("--api-key", default=os.getenv("DASHSCOPE_API_KEY"), help="默认读取环境变量 DASHSCOPE_API_KEY")
+    parser.add_argument("--api-keys", default=os.getenv("DASHSCOPE_API_KEYS"),
+                        help="逗号分隔的多个 API Key，组成 Key 池分摊请求，默认读取环境变量 DASHSCOPE_API_KEYS")
+    parser.add_argument("--model", default=QWEN_MODEL_NAME)
+    parser.add_argument("--no-cache", action="store_true", help="不使用响应缓存")
+    args = parser.parse_args()
+
+    if not args.api_key and not args.api_keys:
+        parser.error("未提供 API Key，请使用 --api-key / --api-keys 或设置 DASHSCOPE_API_KEY")
+
+    system_prompt = args.system_prompt
+    if args.system_prompt_file:
+        with open(args.system_prompt_file, 'r', encoding='utf-8') as f:
+            system_prompt = f.read()
+
+    images = collect_images(args.source)
+    finished = load_finished(args.output)
+    todo = [p for p in images if os.path.abspath(p) not in finished]
+    print(f"共找到 {len(images)} 张图片，已完成 {len(images) - len(todo)} 张，本次需要判断 {len(todo)} 张。")
+    if not todo:
+        return
+
+    key_pool = ApiKeyPool(args.api_keys.split(",")) if args.api_keys else None
+    requester = QwenRequester(api_key=args.api_key, model_name=args.model, cache=not args.no_cache,
+                              key_pool=key_pool)
+
+    start_time = time.time()
+    ok_count, failed_count = run_batch(todo, requester, args.question, system_prompt, args.output, args.workers)
+    elapsed = time.time() - start_time
+
+    throughput = (ok_count + failed_count) / elapsed * 60 if elapsed > 0 else 0.0
+    print("--- 批量判断统计 ---")
+    print(f"成功: {ok_count}，失败: {failed_count}")
+    print(f"总耗时: {elapsed:.2f} 秒")
+    print(f"吞吐量: {throughput:.1f} 张/分钟")
+    if key_pool is not None:
+        for stats in key_pool.stats():
+            print(f"Key {stats['key']}: 请求 {stats['requests']}，失败 {stats['failures']}，"
+                  f"Token {stats['tokens']}{'，已剔除' if stats['ejected'] else ''}")
+    print(f"结果已写入: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import numpy as np
+from PIL import ImageDraw
+
+from json_extract import extract_detections
+
+# Qwen3-VL 输出的相对坐标范围 (0~1000)
+NORMALIZED_RANGE = 1000.0
+
+
+class Detections:
+    """
+    一组检测框，坐标保存在 (N, 4) 的 float64 数组中，格式为 [x1, y1, x2, y2]。
+
+    坐标变换 (归一化 / 反归一化 / 缩放 / 裁剪 / 交换角点) 和过滤都是整体的数组运算，
+    返回新的 Detections，不修改原对象。index 记录每个框在原始输出中的序号，用于选择颜色，
+    过滤掉部分框后其余框的颜色不变。
+    """
+    def __init__(self, boxes, labels=None, confidences=None, index=None):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        count = len(self.boxes)
+        self.labels = np.asarray(labels if labels is not None else [None] * count, dtype=object)
+        # 缺失的置信度为 NaN
+        self.confidences = (np.full(count, np.nan) if confidences is None
+                            else np.asarray(confidences, dtype=np.float64))
+        self.index = np.arange(count) if index is None else np.asarray(index, dtype=np.int64)
+
+    @classmethod
+    def from_detections(cls, detections, start_index=0):
+        """由 json_extract.Detection 列表构建，只保留带 bbox 的目标 (序号仍按原列表计算)"""
+        rows = [(i, d) for i, d in enumerate(detections, start_index) if d.bbox is not None]
+        return cls(
+            boxes=[d.bbox for _, d in rows],
+            labels=[d.label for _, d in rows],
+            confidences=[np.nan if d.confidence is None else d.confidence for _, d in rows],
+            index=[i for i, _ in rows],
+        )
+
+    @classmethod
+    def from_text(cls, text):
+        """从模型输出文本 (或已解析的 JSON 值) 中提取检测框"""
+        return cls.from_detections(extract_detections(text))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, key):
+        """按布尔掩码、下标数组或切片选取部分检测框"""
+        return Detections(self.boxes[key], self.labels[key], self.confidences[key], self.index[key])
+
+    def __repr__(self):
+        return f"Detections(n={len(self)})"
+
+    def _with_boxes(self, boxes):
+        return Detections(boxes, self.labels, self.confidences, self.index)
+
+    def denormalize(self, image_size):
+        """0~1000 相对坐标 -> 图像 (width, height) 上的像素坐标"""
+        width, height = image_size
+        scale = np.array([width, height, width, height], dtype=np.float64) / NORMALIZED_RANGE
+        return self._with_boxes(self.boxes * scale)
+
+    def normalize(self, image_size):
+        """像素坐标 -> 0~1000 相对坐标"""
+        width, height = image_size
+        scale = NORMALIZED_RANGE / np.array([width, height, width, height], dtype=np.float64)
+        return self._with_boxes(self.boxes * scale)
+
+    def rescale(self, input_size, original_size):
+        """送入模型的 (缩放后) 图像上的像素坐标 -> 原图像素坐标 (同 image_preprocess.scale_bbox_to_original)"""
+        sx = original_size[0] / input_size[0]
+        sy = original_size[1] / input_size[1]
+        return self._with_boxes(self.boxes * np.array([sx, sy, sx, sy]))
+
+    def truncate(self):
+        """坐标向零取整 (与逐个 int() 的结果一致)"""
+        return self._with_boxes(np.trunc(self.boxes))
+
+    def sort_corners(self):
+        """交换反向的角点，保证 x1 <= x2、y1 <= y2"""
+        xs, ys = self.boxes[:, 0::2], self.boxes[:, 1::2]
+        return self._with_boxes(np.stack(
+            [xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1))
+
+    def clip(self, image_size):
+        """把坐标裁剪到图像范围 [0, width] x [0, height] 内"""
+        width, height = image_size
+        upper = np.array([width, height, width, height], dtype=np.float64)
+        return self._with_boxes(np.clip(self.boxes, 0, upper))
+
+    def valid_mask(self):
+        """宽和高都大于 0 的框"""
+        return (self.boxes[:, 2] > self.boxes[:, 0]) & (self.boxes[:, 3] > self.boxes[:, 1])
+
+    def filter(self, mask=None):
+        """按掩码过滤，默认去掉宽或高不大于 0 的框"""
+        return self[self.valid_mask() if mask is None else mask]
+
+    def areas(self):
+        return (self.boxes[:, 2] - self.boxes[:, 0]) * (self.boxes[:, 3] - self.boxes[:, 1])
+
+
+def render_detections(img, detections, palette, font=None, line_width=5,
+                      label_background=False, show_confidence=False, default_label=None):
+    """
+    在 img 上一次绘制所有检测框，返回实际绘制的数量。坐标应已是图像上的像素坐标。
+
+    - label_background=False：标签文字画在框内左上角，颜色与框相同 (plot_bounding_boxes 的样式)；
+    - label_background=True：标签画在框上方的色块中，白色文字 (draw_bbox_on_image 的样式)；
+    - show_confidence=True 时在标签后附加置信度，缺失的置信度按 1.0 显示。
+    """
+    if not len(detections):
+        return 0
+    draw = ImageDraw.Draw(img)
+    # 坐标、颜色一次性转换成 Python 数据，循环中只剩绘图调用
+    boxes = detections.boxes.tolist()
+    colors = [palette[i] for i in (detections.index % len(palette)).tolist()]
+    confidences = np.nan_to_num(detections.confidences, nan=1.0).tolist()
+
+    for (x1, y1, x2, y2), color, label, confidence in zip(
+            boxes, colors, detections.labels.tolist(), confidences):
+        draw.rectangle(((x1, y1), (x2, y2)), outline=color, width=line_width)
+
+        label = label if label is not None else default_label
+        if label is None:
+            continue
+        text = f"{label} {confidence:.2f}" if show_confidence else label
+        if not label_background:
+            draw.text((x1 + 8, y1 + 6), text, fill=color, font=font)
+            continue
+        try:
+            # 标签背景和文本
+            text_box = draw.textbbox((0, 0), text, font=font)
+            text_width = text_box[2] - text_box[0]
+            text_height = text_box[3] - text_box[1]
+            draw.rectangle([x1, y1 - text_height - 4, x1 + text_width + 4, y1], fill=color)
+            draw.text((x1 + 2, y1 - text_height - 2), text, fill="white", font=font)
+        except Exception:
+            # 如果字体渲染失败，使用简单文本
+            draw.text((x1, y1 - 15), text, fill=color)
+    return len(boxes)
@@ -1,34 +1,104 @@
 import os
-import json
 from datetime import datetime
+from threading import Lock
+
+from history_store import USAGE_TOTAL_FIELDS, HistoryStore
+from usage_record import UsageRecord
+from image_probe import describe_image
+from thumbnail_cache import ThumbnailCache
+
+# 历史记录页面每页显示的条数
+HISTORY_PAGE_SIZE = 20
+
+HISTORY_CSS = """
+    <style>
+        .history-record {
+            border: 1px solid #ddd;
+            border-radius: 8px;
+            padding: 15px;
+            margin: 10px 0;
+            background: #f9f9f9;
+        }
+        .history-header {
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+            margin-bottom: 10px;
+            padding-bottom: 5px;
+            border-bottom: 1px solid #eee;
+        }
+        .history-timestamp {
+            color: #666;
+            font-size: 0.9em;
+        }
+        .history-content {
+            display: grid;
+            grid-template-columns: 200px 1fr;
+            gap: 15px;
+        }
+        .history-image img {
+            max-width: 100%;
+            border-radius: 4px;
+            border: 1px solid #ccc;
+        }
+        .history-text {
+            display: flex;
+            flex-direction: column;
+            gap: 8px;
+        }
+        .history-question {
+            font-weight: bold;
+            color: #333;
+        }
+        .history-response {
+            background: white;
+            padding: 10px;
+            border-radius: 4px;
+            border-left: 4px solid #4CAF50;
+        }
+        .history-image-meta {
+            font-size: 11px;
+            color: #888;
+            margin-top: 4px;
+        }
+        .history-token-info {
+            font-size: 0.8em;
+            color: #666;
+            background: #f0f0f0;
+            padding: 5px;
+            border-radius: 3px;
+        }
+    </style>
+"""
 
 # --- 历史记录管理类 ---
 class HistoryManager:
-    # ... (这部分代码保持不变)
-    def __init__(self, history_file="call_history.json"):
+    # 底层存储为追加式 SQLite (见 history_store.py)，首次使用时自动导入旧的 call_history.json
+    # image_store: 可选的按内容寻址的图片存储 (diff_image_judge/image_store.py)，
+    # 记录引用的图片在清空历史记录时一并回收
+    def __init__(self, history_file="call_history.json", image_store=None):
         self.history_file = history_file
-        self.history = self.load_history()
-    
-    def load_history(self):
-        """加载历史记录"""
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return []
-        return []
+        self.image_store = image_store
+        db_path = os.path.splitext(history_file)[0] + ".sqlite"
+        self.store = HistoryStore(db_path)
+        self.thumbnails = ThumbnailCache()
+        imported = self.store.import_json(history_file)
+        if imported:
+            print(f"已从 {history_file} 导入 {imported} 条历史记录到 {db_path}")
+        # 历史页显示的用量合计，按 id 范围增量更新 (见 _usage_totals)
+        self._totals = None
+        self._totals_first_id = None
+        self._totals_lock = Lock()
+        # 翻页游标 {页码: 上一页最后一条记录的 (timestamp, id)}，记录有增删 (id 范围变化) 时作废
+        self._cursors = {}
+        self._cursors_key = None
+        self._cursors_lock = Lock()
     
-    def save_history(self):
-        """保存历史记录到文件"""
-        try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存历史记录失败: {e}")
-    
-    def add_record(self, image_path, question, system_prompt, response, token_info):
-        """添加新的调用记录"""
+    def add_record(self, image_path, question, system_prompt, response, usage, annotated_image_path=None):
+        """
+        添加新的调用记录 (追加写入，不再限制总条数)。
+        usage 为 requester 返回的 UsageRecord，按数值列保存；传入文字时按旧版 token_info 保存。
+        """
         record = {
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "image_path": image_path,
@@ -36,20 +106,46 @@ class HistoryManager:
             # 记录 system_prompt 预览，即使它为空
             "system_prompt_preview": system_prompt[:100] + "..." if len(system_prompt) > 100 else system_prompt,
             "response": response,
-            "token_info": token_info
+            "token_info": usage if isinstance(usage, str) else None,
+            "annotated_image_path": annotated_image_path
         }
-        self.history.insert(0, record)  # 新的记录放在最前面
-        # 只保留最近50条记录
-        if len(self.history) > 50:
-            self.history = self.history[:50]
-        self.save_history()
+        if isinstance(usage, UsageRecord):
+            record.update(usage.to_row())
+        self.store.append(record)
+        if self.image_store is not None:
+            self.image_store.acquire(image_path)
+
+    def _usage_totals(self):
+        """
+        全部历史记录的用量合计。其他 worker / 进程也会写入同一个数据库，因此每次先按主键取 id 范围：
+        最小 id 变了说明记录被清空过，重新聚合；只有最大 id 变了时只聚合新增的记录。
+        """
+        with self._totals_lock:
+            first_id, last_id = self.store.id_range()
+            if self._totals is None or first_id != self._totals_first_id:
+                self._totals = self.store.usage_totals()
+                self._totals_first_id = first_id
+            elif last_id != self._totals["max_id"]:
+                delta = self.store.usage_totals(after_id=self._totals["max_id"])
+                for name in USAGE_TOTAL_FIELDS:
+                    self._totals[name] += delta[name]
+                self._totals["max_id"] = delta["max_id"] or self._totals["max_id"]
+            return dict(self._totals)
     
-    def get_history(self):
-        """获取所有历史记录"""
-        return self.history
+    @staticmethod
+    def format_usage(record):
+        """历史记录中的用量文字：旧版记录直接显示保存的 token_info，新记录由数值列生成"""
+        if record.get('token_info'):
+            return record['token_info']
+        usage = UsageRecord.from_row(record)
+        return usage.format() if usage is not None else ''
+
+    def get_history(self, limit=None, before=None, before_id=None):
+        """按时间倒序获取历史记录 (最新的在前)，limit/before 用于分页"""
+        return self.store.page(limit=limit, before=before, before_id=before_id)
     
     def load_history_records_for_gradio(self):
-        history = self.get_history()
+        history = self.get_history(limit=HISTORY_PAGE_SIZE)
         if not history:
             return [], []
         
@@ -62,7 +158,7 @@ class HistoryManager:
                 record['question'],
                 record['system_prompt_preview'],
                 record['response'],
-                record['token_info']
+                self.format_usage(record)
             ])
 
             if os.path.exists(record['image_path']):
@@ -71,80 +167,51 @@ class HistoryManager:
                 image_paths.append(None)  # 图像文件不存在时使用 None
         return data_for_df, image_paths
     
-    def load_history_records(self):
-        # ... (这部分代码保持不变)
-        """加载历史记录用于显示"""
-        history = self.get_history()
+    def _read_page(self, page, page_size):
+        """
+        读取一页记录。翻页时记下每页最后一条记录作为下一页的游标，
+        之后按 (timestamp, id) 索引定位，代价与页码无关；没有游标的页码 (直接跳页) 才用 OFFSET。
+        """
+        key = (self.store.id_range(), page_size)
+        with self._cursors_lock:
+            if self._cursors_key != key:
+                self._cursors = {}
+                self._cursors_key = key
+            cursor = self._cursors.get(page)
+        if page == 1:
+            records = self.store.page(limit=page_size)
+        elif cursor is not None:
+            records = self.store.page(limit=page_size, before=cursor[0], before_id=cursor[1])
+        else:
+            records = self.store.page(limit=page_size, offset=(page - 1) * page_size)
+        if records:
+            with self._cursors_lock:
+                if self._cursors_key == key:
+                    self._cursors[page + 1] = (records[-1]['timestamp'], records[-1]['id'])
+        return records
+
+    def load_history_records(self, page=1, page_size=HISTORY_PAGE_SIZE):
+        """
+        加载一页历史记录用于显示。
+        只读取并渲染当前页的记录，图片使用缓存的缩略图 (点击可打开原图)。
+        """
+        history = self._read_page(max(int(page), 1), page_size)
         
         if not history:
             return "暂无历史记录"
         
-        history_html = """
-        <style>
-            .history-record {
-                border: 1px solid #ddd;
-                border-radius: 8px;
-                padding: 15px;
-                margin: 10px 0;
-                background: #f9f9f9;
-            }
-            .history-header {
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                margin-bottom: 10px;
-                padding-bottom: 5px;
-                border-bottom: 1px solid #eee;
-            }
-            .history-timestamp {
-                color: #666;
-                font-size: 0.9em;
-            }
-            .history-content {
-                display: grid;
-                grid-template-columns: 200px 1fr;
-                gap: 15px;
-            }
-            .history-image img {
-                max-width: 100%;
-                border-radius: 4px;
-                border: 1px solid #ccc;
-            }
-            .history-text {
-                display: flex;
-                flex-direction: column;
-                gap: 8px;
-            }
-            .history-question {
-                font-weight: bold;
-                color: #333;
-            }
-            .history-response {
-                background: white;
-                padding: 10px;
-                border-radius: 4px;
-                border-left: 4px solid #4CAF50;
-            }
-            .history-token-info {
-                font-size: 0.8em;
-                color: #666;
-                background: #f0f0f0;
-                padding: 5px;
-                border-radius: 3px;
-            }
-        </style>
-        """
-        
+        parts = [HISTORY_CSS]
         for record in history:
-            # 检查图片文件是否存在
-            image_html = ""
-            image_filename = os.path.basename(record['image_path'])
-            if os.path.exists(record['image_path']):
-                image_html = f'<img src="file/IMAGES/{image_filename}" alt="输入图像">'
+            # 缩略图不存在说明图片文件已被删除或无法读取
+            thumbnail = self.thumbnails.get_data_uri(record['image_path'])
+            full_src = f"file/{record['image_path']}"
+            if thumbnail:
+                image_html = f'<a href="{full_src}" target="_blank"><img src="{thumbnail}" alt="输入图像"></a>'
+                image_html += f'<div class="history-image-meta">{describe_image(record["image_path"])}</div>'
             else:
                 image_html = f'<div style="color: #999; text-align: center;">图像文件不存在<br>{record["image_path"]}</div>'
             
-            history_html += f"""
+            parts.append(f"""
             <div class="history-record">
                 <div class="history-header">
                     <strong>调用记录</strong>
@@ -157,16 +224,37 @@ class HistoryManager:
                     <div class="history-text">
                         <div class="history-question">📝 问题: {record['question']}</div>
                         <div class="history-response">🤖 决策结果: {record['response']}</div>
-                        <div class="history-token-info">{record['token_info'].replace(chr(10), '<br>')}</div>
+                        <div class="history-token-info">{self.format_usage(record).replace(chr(10), '<br>')}</div>
                     </div>
                 </div>
             </div>
-            """
+            """)
         
-        return history_html
+        return "".join(parts)
+
+    def load_history_page(self, page=1):
+        """
+        供历史记录页的翻页控件使用，返回 (HTML, 修正后的页码, 页码信息)。
+        页码超出范围时自动收敛到第一页 / 最后一页。
+        """
+        # 记录总数取自用量合计 (按 id 范围增量维护)，不再每次 COUNT(*)
+        totals = self._usage_totals()
+        total = totals["calls"]
+        total_pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+        page = min(max(int(page or 1), 1), total_pages)
+        page_info = f"第 {page} / {total_pages} 页，共 {total} 条记录"
+        if total:
+            page_info += f"，成功 {totals['ok']} 次 (缓存命中 {totals['cache_hits']} 次)，消耗 Token {totals['total_tokens']}"
+            if totals["latency_count"]:
+                page_info += f"，平均耗时 {totals['latency_sum'] / totals['latency_count']:.2f} 秒"
+        return self.load_history_records(page), page, page_info
     
     def clear_history(self):
-        """清空历史记录"""
-        self.history = []
-        self.save_history()
-        return "历史记录已清空", self.load_history_records()
+        """清空历史记录，并回收不再被引用的图片"""
+        image_counts = self.store.clear()
+        message = "历史记录已清空"
+        if self.image_store is not None:
+            self.image_store.release(image_counts)
+            removed, freed = self.image_store.collect_garbage()
+            message += f"，回收图片 {removed} 张 ({freed / 1024 / 1024:.1f} MB)"
+        return message, self.load_history_records()
@@ -0,0 +1,102 @@
+import hashlib
+import math
+import os
+from dataclasses import dataclass
+from threading import get_ident
+
+from PIL import Image
+
+# 与 qwen3_vl_2d.inference_with_api 默认的 min_pixels / max_pixels 保持一致
+IMAGE_FACTOR = 32
+DEFAULT_MIN_PIXELS = 4 * 32 * 32
+DEFAULT_MAX_PIXELS = 2560 * 32 * 32
+MAX_ASPECT_RATIO = 200
+
+DEFAULT_IMAGE_FORMAT = "JPEG"
+DEFAULT_IMAGE_QUALITY = 90
+
+# 缩放后的图片缓存目录 (同一张图同一组参数只处理一次)
+RESIZED_CACHE_DIR = os.getenv(
+    "QWEN_RESIZED_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "qwen_vlm", "resized")
+)
+
+_FORMAT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+
+def smart_resize(height, width, factor=IMAGE_FACTOR, min_pixels=DEFAULT_MIN_PIXELS, max_pixels=DEFAULT_MAX_PIXELS):
+    """
+    Qwen-VL 的缩放规则：
+    1. 宽高都是 factor (32 px patch) 的整数倍；
+    2. 总像素数落在 [min_pixels, max_pixels] 之间；
+    3. 尽量保持原始宽高比。
+    返回 (h_bar, w_bar)。
+    """
+    if max(height, width) / min(height, width) > MAX_ASPECT_RATIO:
+        raise ValueError(f"图像宽高比必须小于 {MAX_ASPECT_RATIO}，当前为 {max(height, width) / min(height, width)}")
+    h_bar = max(factor, round(height / factor) * factor)
+    w_bar = max(factor, round(width / factor) * factor)
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        h_bar = max(factor, math.floor(height / beta / factor) * factor)
+        w_bar = max(factor, math.floor(width / beta / factor) * factor)
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = math.ceil(height * beta / factor) * factor
+        w_bar = math.ceil(width * beta / factor) * factor
+    return h_bar, w_bar
+
+
+@dataclass
+class PreparedImage:
+    """预处理后的图片：path 是实际上传的文件，size 均为 (width, height)"""
+    path: str
+    original_size: tuple
+    input_size: tuple
+    resized: bool
+
+
+def prepare_image(image_path, max_pixels=DEFAULT_MAX_PIXELS, min_pixels=DEFAULT_MIN_PIXELS,
+                  image_format=DEFAULT_IMAGE_FORMAT, quality=DEFAULT_IMAGE_QUALITY):
+    """
+    按像素预算缩放图片并重新编码，减少上传字节数和图像 Token。
+    像素数已经在 [min_pixels, max_pixels] 之内的图片原样返回，不做重新编码；
+    max_pixels 为 None 时关闭预处理。
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size
+        if max_pixels is None or min_pixels <= width * height <= max_pixels:
+            return PreparedImage(image_path, (width, height), (width, height), False)
+
+        h_bar, w_bar = smart_resize(height, width, min_pixels=min_pixels, max_pixels=max_pixels)
+        image_format = image_format.upper()
+        save_path = _resized_cache_path(image_path, w_bar, h_bar, image_format, quality)
+        if not os.path.exists(save_path):
+            resized = img.convert("RGB").resize((w_bar, h_bar), Image.BICUBIC)
+            # 先写临时文件再改名，避免并发请求读到写了一半的图片 (文件名带线程号，同一张图并发处理时互不覆盖)
+            tmp_path = f"{save_path}.{os.getpid()}.{get_ident()}.tmp"
+            resized.save(tmp_path, format=image_format, quality=quality)
+            os.replace(tmp_path, save_path)
+
+    return PreparedImage(save_path, (width, height), (w_bar, h_bar), True)
+
+
+def _resized_cache_path(image_path, width, height, image_format, quality):
+    """缓存文件名由源文件 (路径 + mtime + 大小) 和预处理参数决定"""
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}|{width}x{height}|{image_format}|{quality}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    if not os.path.exists(RESIZED_CACHE_DIR):
+        os.makedirs(RESIZED_CACHE_DIR, exist_ok=True)
+    return os.path.join(RESIZED_CACHE_DIR, digest + _FORMAT_EXTENSIONS.get(image_format, ".img"))
+
+
+def scale_bbox_to_original(bbox, input_size, original_size):
+    """
+    把送入模型的 (缩放后) 图像上的绝对像素坐标 [x1, y1, x2, y2] 映射回原图坐标。
+    Qwen3-VL 默认输出 0~1000 的归一化坐标，与分辨率无关，不需要这一步。
+    """
+    sx = original_size[0] / input_size[0]
+    sy = original_size[1] / input_size[1]
+    x1, y1, x2, y2 = bbox
+    return [x1 * sx, y1 * sy, x2 * sx, y2 * sy]
@@ -0,0 +1,293 @@
+import ast
+import json
+import re
+from dataclasses import dataclass, field
+
+# 检测框坐标可能使用的键名 (按优先级)
+BBOX_KEYS = ("bbox_2d", "bbox", "box", "coordinates")
+POINT_KEYS = ("point_2d", "point")
+LABEL_KEYS = ("label", "name", "class")
+CONFIDENCE_KEYS = ("confidence", "score")
+# 顶层为对象时，检测列表可能放在这些键下
+DETECTION_LIST_KEYS = ("detections", "boxes", "predictions", "objects", "results")
+_KNOWN_KEYS = frozenset(BBOX_KEYS + POINT_KEYS + LABEL_KEYS + CONFIDENCE_KEYS)
+
+_OPENERS = {"{": "}", "[": "]"}
+_CLOSERS = {"}", "]"}
+_DECODER = json.JSONDecoder()
+_OPENER_RE = re.compile(r"[\[{]")
+# 完整的字符串整体作为一个 token 跳过；单独的 " 说明字符串没有闭合 (输出被截断)
+_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]|"')
+
+
+@dataclass
+class Detection:
+    """从模型输出中解析出的一个目标：bbox 为 (x1, y1, x2, y2)，point 为 (x, y)，坐标保持模型原始值"""
+    label: str = None
+    bbox: tuple = None
+    point: tuple = None
+    confidence: float = None
+    extra: dict = field(default_factory=dict)
+
+
+def _loads(candidate):
+    try:
+        return json.loads(candidate)
+    except (ValueError, RecursionError):
+        pass
+    # 模型偶尔输出 Python 风格的字面量 (单引号、True/None)；其余情况 (说明文字里的括号) 不必再试
+    if "'" not in candidate and not any(word in candidate for word in ("True", "False", "None")):
+        return None
+    try:
+        return ast.literal_eval(candidate)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def _is_structured(value):
+    """对象，或包含对象 / 数组的数组；纯标量数组 (例如说明文字里的 "[1]") 只作为备选"""
+    if isinstance(value, dict):
+        return True
+    return isinstance(value, list) and (not value or any(isinstance(v, (dict, list)) for v in value))
+
+
+def _fenced_region(text):
+    """优先使用 ```json 代码块中的内容；代码块未闭合 (输出被截断) 时取到文本末尾"""
+    fence = text.find("```json")
+    if fence < 0:
+        return 0, len(text)
+    start = text.find("\n", fence)
+    start = fence + len("```json") if start < 0 else start + 1
+    end = text.find("```", start)
+    return start, (len(text) if end < 0 else end)
+
+
+def scan_json(text, repair=True):
+    """
+    单遍扫描文本，返回 (JSON 值, 对应的 JSON 文本)，找不到时返回 (None, None)。
+
+    - 支持 ```json 代码块和夹在说明文字中的裸 JSON 数组 / 对象；
+    - 跳过无法解析的括号片段 (例如说明文字里的 "{note}")，从片段之后继续扫描，整体仍是线性时间；
+      纯标量数组 (例如 "图[1]") 只在找不到其他 JSON 时返回；
+    - repair=True 时，被截断的输出会丢弃最后一个不完整的元素并补齐括号；
+      补齐后仍无法解析时跳过未闭合的括号继续扫描。
+    """
+    if not text:
+        return None, None
+    start, end = _fenced_region(text)
+    fallback = (None, None)
+
+    i = start
+    while i < end:
+        # 1. 找到下一个 JSON 容器的起点
+        match = _OPENER_RE.search(text, i, end)
+        if match is None:
+            break
+        value_start = match.start()
+
+        # 2. 完整合法的 JSON 直接交给 C 实现的解码器，绝大多数输出在这一步返回
+        try:
+            value, value_end = _DECODER.raw_decode(text, value_start)
+        except (ValueError, RecursionError):
+            value = None
+        if value is not None and value_end <= end:
+            if _is_structured(value):
+                return value, text[value_start:value_end]
+            if fallback[0] is None:
+                fallback = (value, text[value_start:value_end])
+            i = value_end
+            continue
+
+        # 3. 不是合法 JSON (说明文字中的括号、Python 字面量) 或被截断：逐个匹配括号直到容器闭合
+        #    (字符串整体跳过)。cuts[d] 记录第 d 层容器中最后一个完整子容器结束的位置，用于截断时回退；
+        #    开始一个新的子容器时，更深层的旧记录 (属于已结束的兄弟元素) 作废
+        stack = []
+        starts = []
+        cuts = []
+        i = value_start
+        mismatched = False
+        for token in _TOKEN_RE.finditer(text, value_start, end):
+            char = token.group()
+            i = token.end()
+            if char in _OPENERS:
+                del cuts[len(stack):]
+                stack.append(_OPENERS[char])
+                starts.append(token.start())
+            elif char in _CLOSERS:
+                if char != stack[-1]:
+                    # 括号不匹配，说明这不是 JSON，放弃这一段
+                    mismatched = True
+                    break
+                stack.pop()
+                starts.pop()
+                if not stack:
+                    break
+                depth = len(stack) - 1
+                cuts.extend([None] * (depth + 1 - len(cuts)))
+                cuts[depth] = (i, tuple(stack))
+            elif char == '"':
+                # 未闭合的字符串：输出在字符串中间被截断
+                i = end
+                break
+        else:
+            i = end
+
+        if mismatched:
+            # 从出错的位置继续找下一个候选
+            continue
+
+        if not stack:
+            candidate = text[value_start:i]
+            value = _loads(candidate)
+            if value is not None:
+                if _is_structured(value):
+                    return value, candidate
+                if fallback[0] is None:
+                    fallback = (value, candidate)
+            continue
+
+        if not repair:
+            break
+        # 4. 文本在容器内部结束 (输出被截断)：回退到最外层最后一个完整的子元素并补齐括号，
+        #    不完整的尾部元素整个丢弃
+        cut, open_stack = next((c for c in cuts if c is not None), (value_start + 1, (stack[0],)))
+        candidate = text[value_start:cut].rstrip().rstrip(",") + "".join(reversed(open_stack))
+        value = _loads(candidate)
+        if value is not None:
+            return value, candidate
+        # 补齐后仍无法解析 (例如失控输出的成千上万层括号)：跳过这些未闭合的括号，
+        # 从最内层未闭合括号之后继续扫描，其中完整的 JSON 仍然可以取出
+        i = starts[-1] + 1
+    return fallback
+
+
+def extract_json(text, repair=True):
+    """从模型输出中提取第一个 JSON 数组 / 对象，找不到时返回 None"""
+    return scan_json(text, repair=repair)[0]
+
+
+def _first(item, keys):
+    for key in keys:
+        if key in item:
+            return item[key]
+    return None
+
+
+def _numbers(value, count):
+    if not isinstance(value, (list, tuple)) or len(value) != count:
+        return None
+    try:
+        return tuple(map(float, value))
+    except (TypeError, ValueError):
+        return None
+
+
+def detections_from_data(data):
+    """把解析出的 JSON 值转换为 Detection 列表 (兼容列表、{"detections": [...]} 和单个对象)"""
+    if isinstance(data, dict):
+        for key in DETECTION_LIST_KEYS:
+            if isinstance(data.get(key), list):
+                data = data[key]
+                break
+        else:
+            data = [data]
+    if not isinstance(data, list):
+        return []
+
+    detections = []
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        bbox = _numbers(_first(item, BBOX_KEYS), 4)
+        point = _numbers(_first(item, POINT_KEYS), 2)
+        if bbox is None and point is None:
+            continue
+        label = _first(item, LABEL_KEYS)
+        confidence = _first(item, CONFIDENCE_KEYS)
+        try:
+            confidence = float(confidence) if confidence is not None else None
+        except (TypeError, ValueError):
+            confidence = None
+        detections.append(Detection(
+            label=str(label) if label is not None else None,
+            bbox=bbox,
+            point=point,
+            confidence=confidence,
+            extra={key: value for key, value in item.items() if key not in _KNOWN_KEYS},
+        ))
+    return detections
+
+
+def extract_detections(text, repair=True):
+    """从模型输出文本中提取检测结果 (bbox / point)，截断的输出只丢弃最后一个不完整的目标"""
+    if isinstance(text, (list, dict)):
+        return detections_from_data(text)
+    return detections_from_data(extract_json(text, repair=repair))
+
+
+class IncrementalDetectionParser:
+    """
+    流式输出时增量解析检测结果。每次传入目前为止的完整文本，返回新完成的 Detection 列表。
+
+    只扫描上次之后新增的部分：数组中的对象一闭合就立即解析，不必等整个 JSON 数组结束；
+    停在未闭合的字符串上，等下一段文本到达后继续。文本不是上一次的延续时 (例如重新生成) 从头开始。
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.detections = []
+        self._text = ""
+        self._pos = 0
+        self._stack = []
+        self._starts = []
+
+    def update(self, text):
+        if not text.startswith(self._text):
+            self.reset()
+        self._text = text
+
+        new_detections = []
+        i, end = self._pos, len(text)
+        stack, starts = self._stack, self._starts
+        while i < end:
+            if not stack:
+                # 容器之外是说明文字，只找下一个 JSON 容器的起点
+                match = _OPENER_RE.search(text, i)
+                if match is None:
+                    i = end
+                    break
+                stack.append(_OPENERS[match.group()])
+                starts.append(match.start())
+                i = match.end()
+                continue
+
+            match = _TOKEN_RE.search(text, i)
+            if match is None:
+                i = end
+                break
+            char = match.group()
+            if char == '"':
+                # 字符串还没有传输完整，下次从引号处继续
+                i = match.start()
+                break
+            i = match.end()
+            if char in _OPENERS:
+                stack.append(_OPENERS[char])
+                starts.append(match.start())
+            elif char in _CLOSERS:
+                if char != stack[-1]:
+                    # 括号不匹配，说明这不是 JSON，丢弃当前状态
+                    stack.clear()
+                    starts.clear()
+                    continue
+                stack.pop()
+                start = starts.pop()
+                # 数组中的对象闭合：这是一个完整的目标
+                if char == "}" and stack and stack[-1] == "]":
+                    item = _loads(text[start:i])
+                    if isinstance(item, dict):
+                        new_detections.extend(detections_from_data([item]))
+        self._pos = i
+        self.detections.extend(new_detections)
+        return new_detections
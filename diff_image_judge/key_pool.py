@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+from rate_limiter import get_rate_limiter
+
+# 出现这些错误码说明该 Key 暂时不可用 (额度用尽、欠费、失效)，需要临时剔除
+KEY_EJECT_CODES = {
+    "AllocationQuota.FreeTierOnly",
+    "Throttling.AllocationQuota",
+    "Arrearage",
+    "InvalidApiKey",
+    "AccessDenied",
+}
+DEFAULT_EJECT_SECONDS = float(os.getenv("QWEN_KEY_EJECT_SECONDS", 300))
+
+
+def mask_key(api_key):
+    """日志和统计中只显示 Key 的首尾几位"""
+    if not api_key or len(api_key) <= 10:
+        return "***"
+    return f"{api_key[:5]}...{api_key[-4:]}"
+
+
+class KeyStats:
+    """单个 Key 的使用计数"""
+    __slots__ = ("in_flight", "requests", "failures", "tokens", "ejected_until", "last_error")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.tokens = 0
+        self.ejected_until = 0.0
+        self.last_error = None
+
+
+class ApiKeyPool:
+    """
+    多个 API Key 组成的 Key 池，按调用显式传入 Requester，不再依赖全局 dashscope.api_key。
+
+    acquire() 选择剩余限流额度 (见 rate_limiter.RateLimiter.headroom) 最多、在途请求最少的 Key；
+    release() 归还 Key 并记录用量，遇到额度 / 鉴权类错误时把 Key 临时剔除 eject_seconds 秒。
+    吞吐量随 Key 的数量线性扩展。
+    """
+    def __init__(self, api_keys, eject_seconds=DEFAULT_EJECT_SECONDS, use_rate_limiter=True):
+        keys = [key.strip() for key in api_keys if key and key.strip()]
+        if not keys:
+            raise ValueError("ApiKeyPool 至少需要一个 API Key")
+        # 保持顺序并去重
+        self.api_keys = list(dict.fromkeys(keys))
+        self.eject_seconds = eject_seconds
+        self.use_rate_limiter = use_rate_limiter
+        self._stats = {key: KeyStats() for key in self.api_keys}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, var_name="DASHSCOPE_API_KEYS", **kwargs):
+        """从逗号分隔的环境变量创建 Key 池，例如 DASHSCOPE_API_KEYS=sk-a,sk-b"""
+        return cls(os.getenv(var_name, "").split(","), **kwargs)
+
+    def _headroom(self, api_key):
+        if not self.use_rate_limiter:
+            return 1.0
+        return get_rate_limiter(api_key).headroom()
+
+    def acquire(self):
+        """选出当前最空闲的 Key 并占用 (in_flight + 1)"""
+        now = time.time()
+        with self._lock:
+            candidates = [key for key in self.api_keys if self._stats[key].ejected_until <= now]
+            if not candidates:
+                # 全部被剔除时选最早恢复的那个，让调用按原样失败或重试
+                candidates = [min(self.api_keys, key=lambda key: self._stats[key].ejected_until)]
+            in_flight = {key: self._stats[key].in_flight for key in candidates}
+
+        # headroom 需要读 SQLite，放在锁外面做
+        scores = {key: self._headroom(key) / (1 + in_flight[key]) for key in candidates}
+        best = max(candidates, key=lambda key: scores[key])
+
+        with self._lock:
+            stats = self._stats[best]
+            stats.in_flight += 1
+            stats.requests += 1
+        return best
+
+    def release(self, api_key, tokens=0, error_code=None):
+        """归还 Key；error_code 属于 KEY_EJECT_CODES 时临时剔除该 Key"""
+        with self._lock:
+            stats = self._stats.get(api_key)
+            if stats is None:
+                return
+            stats.in_flight = max(0, stats.in_flight - 1)
+            stats.tokens += tokens or 0
+            if error_code:
+                stats.failures += 1
+                stats.last_error = error_code
+                if error_code in KEY_EJECT_CODES:
+                    stats.ejected_until = time.time() + self.eject_seconds
+                    print(f"API Key {mask_key(api_key)} 因 {error_code} 被临时剔除 {self.eject_seconds:.0f} 秒")
+
+    def has_available_key(self):
+        now = time.time()
+        with self._lock:
+            return any(stats.ejected_until <= now for stats in self._stats.values())
+
+    def stats(self):
+        """每个 Key 的使用计数 (Key 已脱敏)"""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "key": mask_key(key),
+                    "in_flight": stats.in_flight,
+                    "requests": stats.requests,
+                    "failures": stats.failures,
+                    "tokens": stats.tokens,
+                    "ejected": stats.ejected_until > now,
+                    "last_error": stats.last_error,
+                }
+                for key, stats in self._stats.items()
+            ]
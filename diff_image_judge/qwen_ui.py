@@ -1,64 +1,62 @@
 import gradio as gr
 import os
-import time
 # 导入你的 QwenRequester 类和相关的 dashscope 库
 import dashscope
 from dashscope import MultiModalConversation
 from utils import get_file_url, get_image_size
 from history_manager import HistoryManager
-from qwen_requester import QwenRequester
-import shutil
+from qwen_requester import get_async_requester
+from metrics import start_metrics_server
+from image_store import ImageStore
 
-# --- 初始化历史管理器 ---
-history_manager = HistoryManager()
-
-# ---图片文件夹路径---
+# ---图片文件夹路径 (按内容寻址，重复上传的图片只保存一份)---
 IMAGE_FOLDER = "qwen_pictures/"
-if not os.path.exists(IMAGE_FOLDER):
-    os.makedirs(IMAGE_FOLDER)
-    print(f"已创建图片文件夹: {IMAGE_FOLDER}")
+image_store = ImageStore(IMAGE_FOLDER)
+
+# --- 初始化历史管理器 (清空历史记录时回收不再被引用的图片) ---
+history_manager = HistoryManager(image_store=image_store)
 
 # --- Gradio 界面函数 ---
 
 # ❗️ 恢复 system_prompt 参数
-def gradio_qwen_call(api_key, input_image_path, question, system_prompt):
-    """Gradio 接口函数，用于连接 UI 输入和 QwenRequester 逻辑。"""
+async def gradio_qwen_call(api_key, input_image_path, question, system_prompt, bypass_cache=False):
+    """Gradio 接口函数，用于连接 UI 输入和 AsyncQwenRequester 逻辑 (流式输出，逐步刷新结果框)。"""
     
     if not api_key:
-        return "错误：请输入 Qwen API Key。", "Token 信息：API Key 缺失"
+        yield "错误：请输入 Qwen API Key。", "Token 信息：API Key 缺失"
+        return
     
     if not input_image_path:
-        return "错误：请上传图像。", "Token 信息：图像缺失"
+        yield "错误：请上传图像。", "Token 信息：图像缺失"
+        return
     
     try:
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        _, file_ext = os.path.splitext(input_image_path)
-        new_filename = f"{timestamp}{file_ext}"
-        save_path = os.path.join(IMAGE_FOLDER, new_filename)
-
-        shutil.copy(input_image_path, save_path)
-        print(f"图像已保存到: {save_path}")
-        input_image_path = save_path
+        input_image_path = image_store.put(input_image_path)
     except Exception as e:
-        return f"错误：保存上传图像失败。\n{e}", "Token 信息：图像保存失败"
+        yield f"错误：保存上传图像失败。\n{e}", "Token 信息：图像保存失败"
+        return
 
-    # 1. 初始化 Requester
+    # 1. 获取复用的异步 Requester (共享长连接和并发上限，API Key 按调用传入，不同用户互不覆盖)
     try:
-        requester = QwenRequester(api_key=api_key)
+        requester = get_async_requester()
     except Exception as e:
-        return f"错误：初始化 QwenRequester 失败。\n{e}", "Token 信息：初始化失败"
+        yield f"错误：初始化 AsyncQwenRequester 失败。\n{e}", "Token 信息：初始化失败"
+        return
 
-    # 2. 调用请求函数 (传入 system_prompt)
-    response_text, token_info = requester.request_qwen(
+    # 2. 流式调用请求函数 (传入 system_prompt)，边生成边刷新输出框
+    response_text, usage = "", None
+    async for response_text, usage in requester.request_qwen_stream(
         question=question, 
         image_path=input_image_path,
-        system_prompt=system_prompt # 传递 UI 输入的 system_prompt
-    )
+        system_prompt=system_prompt, # 传递 UI 输入的 system_prompt
+        use_cache=not bypass_cache,
+        api_key=api_key
+    ):
+        yield response_text, usage.format()
     
     # 3. 保存到历史记录
-    history_manager.add_record(input_image_path, question, system_prompt, response_text, token_info)
-    
-    return response_text, token_info
+    history_manager.add_record(input_image_path, question, system_prompt, response_text, usage)
+
 
 # --- Gradio 界面定义 (恢复 System Prompt 输入框，默认值为空) ---
 
@@ -125,6 +123,11 @@ Prompt: 你是一位工业 3D 视觉专家。请分析这张点云匹配结果
                     autoscroll=True
                 )
 
+                bypass_cache_input = gr.Checkbox(
+                    label="跳过响应缓存 (强制重新调用模型)",
+                    value=False
+                )
+
                 submit_btn = gr.Button("🚀 执行技能决策 (调用 Qwen-VL)", variant="primary")
 
             # 右侧输出区域
@@ -156,6 +159,13 @@ Prompt: 你是一位工业 3D 视觉专家。请分析这张点云匹配结果
                     interactive=False
                 )
         
+        # 分页控件：每页只读取和渲染 HISTORY_PAGE_SIZE 条记录
+        with gr.Row():
+            prev_page_btn = gr.Button("⬅️ 上一页", size="sm")
+            history_page = gr.Number(label="页码", value=1, precision=0, minimum=1)
+            next_page_btn = gr.Button("下一页 ➡️", size="sm")
+            history_page_info = gr.Markdown(value=lambda: history_manager.load_history_page(1)[2])
+
         history_output = gr.HTML(
             label="调用历史记录",
             value=history_manager.load_history_records
@@ -165,7 +175,7 @@ Prompt: 你是一位工业 3D 视觉专家。请分析这张点云匹配结果
     submit_btn.click(
         fn=gradio_qwen_call,
         # ❗️ 恢复 system_prompt_input
-        inputs=[api_key_input, image_input, question_input, system_prompt_input],
+        inputs=[api_key_input, image_input, question_input, system_prompt_input, bypass_cache_input],
         outputs=[output_result, token_output]
     )
     
@@ -177,14 +187,34 @@ Prompt: 你是一位工业 3D 视觉专家。请分析这张点云匹配结果
     )
 
     # 历史记录页面按钮事件
+    history_page_outputs = [history_output, history_page, history_page_info]
     refresh_btn.click(
-        fn=history_manager.load_history_records,
-        outputs=history_output
+        fn=history_manager.load_history_page,
+        inputs=[history_page],
+        outputs=history_page_outputs
+    )
+    prev_page_btn.click(
+        fn=lambda page: history_manager.load_history_page(page - 1),
+        inputs=[history_page],
+        outputs=history_page_outputs
+    )
+    next_page_btn.click(
+        fn=lambda page: history_manager.load_history_page(page + 1),
+        inputs=[history_page],
+        outputs=history_page_outputs
+    )
+    history_page.submit(
+        fn=history_manager.load_history_page,
+        inputs=[history_page],
+        outputs=history_page_outputs
     )
     
     clear_btn.click(
         fn=history_manager.clear_history,
         outputs=[history_status, history_output]
+    ).then(
+        fn=lambda: history_manager.load_history_page(1),
+        outputs=history_page_outputs
     )
     
     # --- 示例 ---
@@ -206,6 +236,7 @@ Prompt: 你是一位工业 3D 视觉专家。请分析这张点云匹配结果
 if __name__ == '__main__':
     DEFAULT_PORT = 7870
     print(f"Gradio App 正在启动，请在浏览器中访问 http://127.0.0.1:{DEFAULT_PORT}")
+    start_metrics_server()
     demo.launch(
         server_port=DEFAULT_PORT)
     # demo.launch(server_port=DEFAULT_PORT,share=True)    稳定后生成固定链接
\ No newline at end of file
@@ -0,0 +1,144 @@
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from usage_record import UsageRecord
+
+# 可以重试的 HTTP 状态码 (限流和服务端错误)
+RETRYABLE_HTTP_STATUS = {429, 500, 502, 503, 504}
+
+# 直接失败、不重试的错误码：鉴权、欠费、免费额度用尽、内容审核、参数错误等，重试也不会成功
+NON_RETRYABLE_CODES = {
+    "InvalidApiKey",
+    "AccessDenied",
+    "AccessDenied.Unpurchased",
+    "Arrearage",
+    "AllocationQuota.FreeTierOnly",
+    "DataInspectionFailed",
+    "InvalidParameter",
+    "InvalidParameter.DataInspection",
+    "ModelNotFound",
+}
+
+
+def is_retryable(status_code, code):
+    """
+    判断一次失败是否值得重试。
+    status_code 为 None 表示网络层错误 (连接失败、超时)，按可重试处理。
+    """
+    if code in NON_RETRYABLE_CODES:
+        return False
+    if code and str(code).startswith("Throttling"):
+        # Throttling / Throttling.RateQuota / Throttling.AllocationQuota 都是限流
+        return True
+    if status_code is None:
+        return True
+    return status_code in RETRYABLE_HTTP_STATUS
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+@dataclass
+class RetryPolicy:
+    """
+    指数退避 + 抖动 (full jitter) 的重试策略。
+    max_attempts 为总尝试次数 (包含第一次调用)。默认值可以用环境变量覆盖。
+    """
+    max_attempts: int = int(os.getenv("QWEN_RETRY_MAX_ATTEMPTS", 4))
+    base_delay: float = _env_float("QWEN_RETRY_BASE_DELAY", 0.5)
+    max_delay: float = _env_float("QWEN_RETRY_MAX_DELAY", 8.0)
+
+    def backoff(self, retry_index):
+        """第 retry_index 次重试 (从 0 开始) 前的等待秒数"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry_index)))
+
+
+class CircuitBreaker:
+    """
+    简单的熔断器 (closed -> open -> half_open)。
+
+    连续 failure_threshold 次可重试类失败 (限流 / 5xx / 网络错误) 后进入 open 状态，
+    reset_timeout 秒内直接拒绝请求，避免在服务故障时继续堆积请求；
+    之后放行一个探测请求 (half_open)，成功则恢复，失败则重新计时。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=int(os.getenv("QWEN_BREAKER_FAILURE_THRESHOLD", 5)),
+                 reset_timeout=_env_float("QWEN_BREAKER_RESET_TIMEOUT", 30.0)):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """是否放行本次请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release_probe(self):
+        """
+        探测请求既没有成功也没有可重试类失败 (不可重试的错误码、意外异常) 时调用：
+        保持半开状态并释放探测名额，让下一个请求继续探测。
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def remaining_open_time(self):
+        """熔断剩余秒数 (用于错误提示)"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+
+# 每个服务端点共用一个熔断器
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(endpoint):
+    """获取 (或创建) 指定端点的熔断器"""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            _breakers[endpoint] = breaker
+        return breaker
+
+
+def circuit_open_result(breaker):
+    """熔断期间直接返回的 (response_text, UsageRecord)"""
+    error_message = f"DashScope 服务熔断中，请 {breaker.remaining_open_time():.0f} 秒后重试。"
+    print(error_message)
+    return error_message, UsageRecord.circuit_open()
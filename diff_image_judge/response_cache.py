@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from usage_record import UsageRecord
+
+# 三个应用 (cable_detection / diff_image_judge / one_image_judge) 默认共用同一个缓存文件
+DEFAULT_CACHE_PATH = os.getenv(
+    "QWEN_RESPONSE_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "qwen_vlm", "response_cache.sqlite")
+)
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """分块计算文件内容的 sha256，避免一次性读入大图"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    基于内容寻址的 VLM 响应缓存 (SQLite 存储，多进程安全)。
+
+    缓存键 = sha256(图片字节 + question + system_prompt + model_name)，
+    支持 TTL 过期，以及按总字节数 / 条目数的 LRU 淘汰。
+    只缓存调用成功的结果。
+    """
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_bytes=DEFAULT_MAX_BYTES, max_entries=None):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                       key TEXT PRIMARY KEY,
+                       response TEXT NOT NULL,
+                       usage TEXT NOT NULL,
+                       created_at REAL NOT NULL,
+                       last_access REAL NOT NULL,
+                       size INTEGER NOT NULL
+                   )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+            # 旧版缓存的 token_info 列保存的是格式化后的文字，改名后这些条目按未命中处理
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(responses)")}
+            if "token_info" in columns:
+                conn.execute("ALTER TABLE responses RENAME COLUMN token_info TO usage")
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作单独连接：线程 / 进程之间无需共享连接对象
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(image_path, question, system_prompt, model_name, variant=None):
+        """
+        根据图片内容和请求参数生成缓存键。
+        variant 用于区分同一张图的不同上传方式 (例如缩放预算)，需要可 JSON 序列化。
+        """
+        digest = hashlib.sha256()
+        digest.update(hash_file(image_path).encode("ascii"))
+        # 用 JSON 编码文本字段，避免不同字段拼接后产生歧义
+        fields = [question or "", system_prompt or "", model_name, variant]
+        digest.update(json.dumps(fields, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """命中返回 (response_text, UsageRecord)，未命中或已过期返回 None"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, usage, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response_text, usage, created_at = row
+            try:
+                usage = UsageRecord.from_dict(json.loads(usage))
+            except (ValueError, TypeError, AttributeError):
+                usage = None
+            if usage is None or (self.ttl_seconds is not None and now - created_at > self.ttl_seconds):
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return response_text, usage
+
+    def put(self, key, response_text, usage):
+        """写入一条缓存 (usage 为 UsageRecord)，并按 TTL 和容量上限淘汰旧条目"""
+        now = time.time()
+        usage = json.dumps(usage.to_dict(), ensure_ascii=False)
+        size = len(response_text.encode("utf-8")) + len(usage.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, usage, created_at, last_access, size) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response_text, usage, now, now, size)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        if self.ttl_seconds is not None:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+
+        total_bytes, total_entries = conn.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses"
+        ).fetchone()
+
+        def over_limit():
+            return ((self.max_bytes is not None and total_bytes > self.max_bytes) or
+                    (self.max_entries is not None and total_entries > self.max_entries))
+
+        if not over_limit():
+            return
+        # 按最近访问时间从旧到新淘汰 (LRU)
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+            if not over_limit():
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_bytes -= size
+            total_entries -= 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+
+
+_default_cache = None
+
+def get_default_response_cache():
+    """进程内共享的默认缓存实例"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
+
+
+def mark_cache_hit(usage, lookup_seconds):
+    """标记为缓存命中 (显示时在统计信息末尾追加命中标记)"""
+    return usage.as_cache_hit(lookup_seconds)
@@ -0,0 +1,203 @@
+import json
+import re
+from dataclasses import asdict, dataclass, fields, replace
+
+from tracing import format_stage_breakdown
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_PARSE_ERROR = "parse_error"
+# 流式生成过程中的进度 (最后一次产出才是最终结果)
+STATUS_STREAMING = "streaming"
+CIRCUIT_OPEN_CODE = "CircuitOpen"
+
+# 历史记录表中保存用量的列 (与 UsageRecord 的字段一致)
+USAGE_COLUMNS = (
+    "status",
+    "error_code",
+    "execution_time",
+    "first_token_time",
+    "retries",
+    "image_tokens",
+    "text_tokens",
+    "output_tokens",
+    "total_tokens",
+    "cache_hit",
+    "cache_lookup_time",
+    "stages",
+)
+USAGE_COLUMN_TYPES = {
+    "status": "TEXT",
+    "error_code": "TEXT",
+    "execution_time": "REAL",
+    "first_token_time": "REAL",
+    "retries": "INTEGER",
+    "image_tokens": "INTEGER",
+    "text_tokens": "INTEGER",
+    "output_tokens": "INTEGER",
+    "total_tokens": "INTEGER",
+    "cache_hit": "INTEGER",
+    "cache_lookup_time": "REAL",
+    "stages": "TEXT",
+}
+
+
+@dataclass(slots=True)
+class UsageRecord:
+    """
+    一次调用的 Token 用量和耗时。requester 只返回这个结构，
+    显示用的文字由 format() 在界面上生成，历史记录按数值列保存。
+    """
+    status: str = STATUS_OK
+    error_code: str = None
+    execution_time: float = 0.0
+    first_token_time: float = None
+    retries: int = 0
+    image_tokens: int = 0
+    text_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+    cache_hit: bool = False
+    cache_lookup_time: float = None
+    stages: dict = None
+
+    @classmethod
+    def from_usage(cls, usage, execution_time, first_token_time=None, retries=0, stages=None):
+        """根据 DashScope 返回的 usage 字段构造 (流式调用时传入 first_token_time)"""
+        usage = usage or {}
+        return cls(
+            execution_time=execution_time,
+            first_token_time=first_token_time,
+            retries=retries,
+            image_tokens=usage.get('image_tokens', 0),
+            text_tokens=(usage.get('input_tokens_details') or {}).get('text_tokens', 0),
+            output_tokens=(usage.get('output_tokens_details') or {}).get('text_tokens', usage.get('output_tokens', 0)),
+            total_tokens=usage.get('total_tokens', 0),
+            stages=stages or None,
+        )
+
+    @classmethod
+    def failure(cls, code, retries=0):
+        return cls(status=STATUS_FAILED, error_code=code, retries=retries)
+
+    @classmethod
+    def circuit_open(cls):
+        return cls(status=STATUS_FAILED, error_code=CIRCUIT_OPEN_CODE)
+
+    @classmethod
+    def parse_error(cls, retries=0):
+        return cls(status=STATUS_PARSE_ERROR, retries=retries)
+
+    @classmethod
+    def progress(cls, first_token_time):
+        return cls(status=STATUS_STREAMING, first_token_time=first_token_time)
+
+    @property
+    def ok(self):
+        return self.status == STATUS_OK
+
+    @property
+    def failed(self):
+        return self.status in (STATUS_FAILED, STATUS_PARSE_ERROR)
+
+    @property
+    def tokens_per_second(self):
+        if self.first_token_time is None:
+            return None
+        generation_time = self.execution_time - self.first_token_time
+        return self.output_tokens / generation_time if generation_time > 0 else 0.0
+
+    def as_cache_hit(self, lookup_seconds):
+        return replace(self, cache_hit=True, cache_lookup_time=lookup_seconds)
+
+    def format(self):
+        """显示用的多行文字 (失败时以 "Status: Failed" 开头)"""
+        if self.status == STATUS_STREAMING:
+            return f"生成中... 首 Token 耗时: {self.first_token_time:.2f} 秒"
+        if self.status == STATUS_PARSE_ERROR:
+            return "Status: Failed to parse response"
+        if self.status == STATUS_FAILED:
+            if self.error_code == CIRCUIT_OPEN_CODE:
+                return "Status: Failed (Circuit open)"
+            return f"Status: Failed (Code {self.error_code})\n重试次数: {self.retries}"
+
+        lines = [
+            "--- Token 和时间统计 ---",
+            f"总耗时: {self.execution_time:.2f} 秒",
+        ]
+        if self.first_token_time is not None:
+            lines.append(f"首 Token 耗时: {self.first_token_time:.2f} 秒")
+            lines.append(f"输出速度: {self.tokens_per_second:.1f} Token/秒")
+        lines.append(f"重试次数: {self.retries}")
+        lines += [
+            f"输入图像的 Token 数: {self.image_tokens}",
+            f"输入文本的 Token 数: {self.text_tokens}",
+            f"输出文本的 Token 数: {self.output_tokens}",
+            f"总 Token 数: {self.total_tokens}",
+        ]
+        lines += format_stage_breakdown(self.stages)
+        if self.cache_hit:
+            lines.append(f"缓存命中: 是 (查询耗时 {(self.cache_lookup_time or 0) * 1000:.1f} 毫秒，未消耗 Token)")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        names = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in names})
+
+    def to_row(self):
+        """历史记录表中的列值 {列名: 值}"""
+        row = self.to_dict()
+        row["cache_hit"] = int(self.cache_hit)
+        row["stages"] = json.dumps(self.stages) if self.stages else None
+        return row
+
+    @classmethod
+    def from_row(cls, row):
+        """从历史记录行还原，没有用量列的旧记录返回 None"""
+        if row.get("status") is None:
+            return None
+        data = {name: row.get(name) for name in USAGE_COLUMNS}
+        data["cache_hit"] = bool(data["cache_hit"])
+        data["stages"] = json.loads(data["stages"]) if data["stages"] else None
+        return cls.from_dict({key: value for key, value in data.items() if value is not None})
+
+
+# 旧版 token_info 文字中的字段，只在迁移旧历史记录时解析一次
+_LEGACY_FIELDS = {
+    "execution_time": (re.compile(r"总耗时: ([\d.]+) 秒"), float),
+    "first_token_time": (re.compile(r"首 Token 耗时: ([\d.]+) 秒"), float),
+    "retries": (re.compile(r"重试次数: (\d+)"), int),
+    "image_tokens": (re.compile(r"输入图像的 Token 数: (\d+)"), int),
+    "text_tokens": (re.compile(r"输入文本的 Token 数: (\d+)"), int),
+    "output_tokens": (re.compile(r"输出文本的 Token 数: (\d+)"), int),
+    "total_tokens": (re.compile(r"总 Token 数: (\d+)"), int),
+}
+_LEGACY_FAILURE_CODE = re.compile(r"Status: Failed \(Code (.*?)\)")
+
+
+def parse_legacy_token_info(text):
+    """把旧版历史记录中的 token_info 文字转换为 UsageRecord"""
+    text = text or ""
+    if text.startswith("生成中"):
+        status = STATUS_STREAMING
+    elif text.startswith("Status: Failed to parse"):
+        status = STATUS_PARSE_ERROR
+    elif text.startswith("Status:"):
+        status = STATUS_FAILED
+    else:
+        status = STATUS_OK
+    record = UsageRecord(status=status, cache_hit="缓存命中: 是" in text)
+    for name, (pattern, convert) in _LEGACY_FIELDS.items():
+        match = pattern.search(text)
+        if match:
+            setattr(record, name, convert(match.group(1)))
+    match = _LEGACY_FAILURE_CODE.search(text)
+    if match:
+        record.error_code = match.group(1)
+    elif "Circuit open" in text:
+        record.error_code = CIRCUIT_OPEN_CODE
+    return record
@@ -0,0 +1,167 @@
+import hashlib
+import math
+import os
+from dataclasses import dataclass, field
+from threading import get_ident
+
+from PIL import Image, ImageDraw, ImageFont
+
+# 拼图的总像素预算 (与单图默认的 max_pixels 一致)，四个视角平分
+DEFAULT_MOSAIC_MAX_PIXELS = int(os.getenv("QWEN_MOSAIC_MAX_PIXELS", 2560 * 32 * 32))
+# 拼图输出目录 (按输入内容和参数命名，相同输入只生成一次)
+DEFAULT_MOSAIC_DIR = os.getenv(
+    "QWEN_MOSAIC_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "qwen_vlm", "mosaic")
+)
+# 视角标签画在每个格子上方的标签条里，使用英文避免依赖中文字体
+DEFAULT_TILE_LABELS = ["1 LEFT", "2 RIGHT", "3 PANORAMA", "4 BOTTOM"]
+MOSAIC_BACKGROUND = (0, 0, 0)
+LABEL_COLOR = (255, 255, 0)
+
+
+@dataclass
+class Tile:
+    """拼图中的一个格子：源图片在拼图中的位置 (像素) 和缩放比例"""
+    label: str
+    source_path: str
+    x: int
+    y: int
+    width: int
+    height: int
+    source_size: tuple
+
+    def contains(self, x, y):
+        return self.x <= x < self.x + self.width and self.y <= y < self.y + self.height
+
+    def to_source(self, x, y):
+        """拼图坐标 -> 源图片坐标 (像素)"""
+        source_width, source_height = self.source_size
+        sx = (x - self.x) * source_width / self.width
+        sy = (y - self.y) * source_height / self.height
+        return (min(max(sx, 0), source_width), min(max(sy, 0), source_height))
+
+
+@dataclass
+class MosaicLayout:
+    """拼图文件路径、尺寸和各格子的布局，用来把模型返回的坐标映射回源视角"""
+    path: str
+    size: tuple
+    tiles: list = field(default_factory=list)
+
+    def locate(self, x, y, normalized=False):
+        """
+        返回坐标所在的 (Tile, 源图片坐标)，落在标签条或空白处时返回 (None, None)。
+        normalized=True 表示坐标是 Qwen3-VL 的 0~1000 相对坐标。
+        """
+        if normalized:
+            x, y = x * self.size[0] / 1000, y * self.size[1] / 1000
+        for tile in self.tiles:
+            if tile.contains(x, y):
+                return tile, tile.to_source(x, y)
+        return None, None
+
+    def map_bbox(self, bbox, normalized=False):
+        """
+        把拼图上的 [x1, y1, x2, y2] 映射到源视角，返回 (Tile, 源图片上的 bbox)。
+        以框的中心点判断所属视角，超出该视角的部分被裁剪掉。
+        """
+        x1, y1, x2, y2 = bbox
+        if normalized:
+            scale_x, scale_y = self.size[0] / 1000, self.size[1] / 1000
+            x1, x2 = x1 * scale_x, x2 * scale_x
+            y1, y2 = y1 * scale_y, y2 * scale_y
+        tile, _ = self.locate((x1 + x2) / 2, (y1 + y2) / 2)
+        if tile is None:
+            return None, None
+        sx1, sy1 = tile.to_source(x1, y1)
+        sx2, sy2 = tile.to_source(x2, y2)
+        return tile, [sx1, sy1, sx2, sy2]
+
+    def describe(self):
+        """布局的文字说明 (提示词和界面中使用)"""
+        return "\n".join(
+            f"{tile.label}: 拼图区域 ({tile.x}, {tile.y}) - ({tile.x + tile.width}, {tile.y + tile.height})，"
+            f"原图尺寸 {tile.source_size[0]}x{tile.source_size[1]}"
+            for tile in self.tiles
+        )
+
+
+def _load_label_font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 的默认字体不支持指定字号
+        return ImageFont.load_default()
+
+
+def _mosaic_path(image_paths, labels, max_pixels, output_dir):
+    digest = hashlib.sha1()
+    for path in image_paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}\n".encode("utf-8"))
+    digest.update(f"{labels}|{max_pixels}".encode("utf-8"))
+    return os.path.join(output_dir, f"{digest.hexdigest()}.jpg")
+
+
+def build_mosaic(image_paths, labels=None, max_pixels=DEFAULT_MOSAIC_MAX_PIXELS,
+                 output_dir=DEFAULT_MOSAIC_DIR, quality=90):
+    """
+    把 (最多四张) 视角图片按 2x2 排成一张带标签的拼图，总像素不超过 max_pixels。
+
+    每个格子 = 标签条 + 按比例缩放后的图片，格子的宽高比取各视角宽高比的平均值。
+    返回 MosaicLayout，拼图已写入 output_dir。
+    """
+    labels = list(labels or DEFAULT_TILE_LABELS[:len(image_paths)])
+    if len(labels) != len(image_paths):
+        raise ValueError("labels 与 image_paths 数量不一致")
+
+    path = _mosaic_path(image_paths, labels, max_pixels, output_dir)
+    sizes = []
+    for image_path in image_paths:
+        with Image.open(image_path) as img:
+            sizes.append(img.size)
+
+    columns = 2 if len(image_paths) > 1 else 1
+    rows = math.ceil(len(image_paths) / columns)
+    aspect = sum(width / height for width, height in sizes) / len(sizes)
+    cell_pixels = max_pixels / (rows * columns)
+    cell_width = int(math.sqrt(cell_pixels * aspect))
+    cell_height = int(cell_pixels / cell_width)
+    label_height = max(16, cell_height // 16)
+    image_height = cell_height - label_height
+
+    tiles = []
+    for index, (image_path, label, (width, height)) in enumerate(zip(image_paths, labels, sizes)):
+        scale = min(cell_width / width, image_height / height)
+        tile_width, tile_height = max(1, int(width * scale)), max(1, int(height * scale))
+        cell_x, cell_y = (index % columns) * cell_width, (index // columns) * cell_height
+        tiles.append(Tile(
+            label=label,
+            source_path=image_path,
+            x=cell_x + (cell_width - tile_width) // 2,
+            y=cell_y + label_height,
+            width=tile_width,
+            height=tile_height,
+            source_size=(width, height),
+        ))
+    layout = MosaicLayout(path=path, size=(cell_width * columns, cell_height * rows), tiles=tiles)
+
+    if os.path.exists(path):
+        return layout
+
+    mosaic = Image.new("RGB", layout.size, MOSAIC_BACKGROUND)
+    draw = ImageDraw.Draw(mosaic)
+    font = _load_label_font(int(label_height * 0.8))
+    for tile in tiles:
+        with Image.open(tile.source_path) as img:
+            img = img.convert("RGB").resize((tile.width, tile.height), Image.Resampling.BICUBIC)
+            mosaic.paste(img, (tile.x, tile.y))
+        cell_x = tile.x - (tile.x % cell_width)
+        draw.text((cell_x + 4, tile.y - label_height), tile.label, fill=LABEL_COLOR, font=font)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+    mosaic.save(tmp_path, format="JPEG", quality=quality)
+    os.replace(tmp_path, path)
+    return layout
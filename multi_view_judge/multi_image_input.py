@@ -1,8 +1,13 @@
 import gradio as gr
 import dashscope
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from metrics import record_error, record_request, start_metrics_server, track_in_flight
+from mosaic import DEFAULT_MOSAIC_MAX_PIXELS, DEFAULT_TILE_LABELS, build_mosaic
+
 # 加载环境变量 (确保你的 .env 文件中有 DASHSCOPE_API_KEY)
 load_dotenv() 
 
@@ -17,30 +22,92 @@ DASHSCOPE_API_KEY = os.getenv('DASHSCOPE_API_KEY')
 # 默认的分析指令
 DEFAULT_PROMPT = "请结合四张图片，详细描述目标物体的当前状态和所有可见的细节。如果物体有运动，请说明运动趋势。"
 
+# 四个相机视角的名称 (顺序与界面上的四个图片输入一致)
+VIEW_LABELS = ["左视图", "右视图", "全景图", "底部视图"]
+
+# 调用模式
+MODE_SINGLE = "单次调用 (四图合并)"
+MODE_FANOUT = "分视角并发 + 融合"
+MODE_MOSAIC = "拼图单图 (省 Token)"
+ALL_MODES = [MODE_SINGLE, MODE_FANOUT, MODE_MOSAIC]
+
+# 每种模式、每个指令最近一次的 (耗时秒数, Token 用量)，用于对比各模式
+_last_runs = {}
+
 def format_image_for_dashscope(image_path: str) -> str:
     """将本地文件路径格式化为 DashScope API 要求的 file:// 格式"""
     # 确保路径是绝对路径
     absolute_path = os.path.abspath(image_path)
     return f"file://{absolute_path}"
 
+def add_usage(total, usage):
+    """把一次调用的 usage 累加到 total (分视角模式会有多次调用)"""
+    usage = usage or {}
+    total["image_tokens"] = total.get("image_tokens", 0) + (usage.get("image_tokens") or 0)
+    total["input_tokens"] = total.get("input_tokens", 0) + (usage.get("input_tokens") or 0)
+    total["output_tokens"] = total.get("output_tokens", 0) + (usage.get("output_tokens") or 0)
+    total["total_tokens"] = total.get("total_tokens", 0) + (usage.get("total_tokens") or 0)
+    return total
+
+def call_qwen(messages):
+    """调用 DashScope API，返回 (文本, usage, 错误信息)，成功时错误信息为 None"""
+    start_time = time.time()
+    try:
+        with track_in_flight(QWEN_MODEL_NAME):
+            response = dashscope.MultiModalConversation.call(
+                api_key=DASHSCOPE_API_KEY,
+                model=QWEN_MODEL_NAME,
+                messages=messages
+            )
+        if response.status_code == 200:
+            record_request(QWEN_MODEL_NAME, "ok", time.time() - start_time, response.usage)
+            return response.output.choices[0].message.content[0]["text"], response.usage, None
+        record_error(QWEN_MODEL_NAME, response.code)
+        record_request(QWEN_MODEL_NAME, "failed", time.time() - start_time)
+        error_msg = f"DashScope API 调用失败。状态码: {response.status_code}\n"
+        error_msg += f"错误信息: {response.code} - {response.message}"
+        return None, None, error_msg
+    except Exception as e:
+        record_error(QWEN_MODEL_NAME, "NetworkError")
+        record_request(QWEN_MODEL_NAME, "failed", time.time() - start_time)
+        return None, None, f"API 调用或网络错误：{e}"
+
+def format_run_stats(mode, prompt_text, elapsed, usage):
+    """记录本次耗时和 Token 用量，并与同一指令下其他模式最近一次的结果并列对比"""
+    _last_runs[(mode, prompt_text)] = (elapsed, usage)
+    lines = ["模式 | 耗时 | 图像 Token | 总 Token"]
+    for run_mode in ALL_MODES:
+        run = _last_runs.get((run_mode, prompt_text))
+        marker = " (本次)" if run_mode == mode else ""
+        if run is None:
+            lines.append(f"{run_mode} | 未运行 | - | -")
+            continue
+        run_elapsed, run_usage = run
+        lines.append(
+            f"{run_mode}{marker} | {run_elapsed:.2f} 秒 | "
+            f"{run_usage.get('image_tokens', 0)} | {run_usage.get('total_tokens', 0)}"
+        )
+    return "\n".join(lines)
+
 def multi_camera_analysis_four_views(
     left_image_file: str, 
     right_image_file: str, 
     pano_image_file: str, # 新增
     bottom_image_file: str, # 新增
     prompt_text: str
-) -> str:
+):
     """
     接收四张图片的文件路径和文本，调用 DashScope Qwen-VLM API 进行分析。
+    返回 (分析结果, usage)。
     """
     
     # 1. 检查 API Key
     if not DASHSCOPE_API_KEY:
-        return "错误：未找到 'DASHSCOPE_API_KEY' 环境变量。请在 .env 文件中配置。"
+        return "错误：未找到 'DASHSCOPE_API_KEY' 环境变量。请在 .env 文件中配置。", {}
 
     # 2. 检查输入文件
     if not all([left_image_file, right_image_file, pano_image_file, bottom_image_file]):
-        return "错误：请上传所有四个相机（左侧、右侧、全景、底部）的图片。"
+        return "错误：请上传所有四个相机（左侧、右侧、全景、底部）的图片。", {}
 
     # 3. 格式化图片路径为 DashScope 要求的 'file://' 格式
     try:
@@ -51,7 +118,7 @@ def multi_camera_analysis_four_views(
             format_image_for_dashscope(bottom_image_file),
         ]
     except Exception as e:
-        return f"文件路径处理错误：{e}"
+        return f"文件路径处理错误：{e}", {}
 
     # 4. 构造 DashScope API 的 messages 结构
     # 使用交错的方式描述图片，以提供上下文
@@ -74,24 +141,150 @@ def multi_camera_analysis_four_views(
 
     print(f"正在调用 DashScope API，模型：{QWEN_MODEL_NAME}...")
 
-    # 5. 调用 DashScope API
+    # 5. 调用 DashScope API 并返回结果
+    text, usage, error_msg = call_qwen(messages)
+    return (text if error_msg is None else error_msg), add_usage({}, usage)
+
+def multi_camera_analysis_mosaic(
+    left_image_file: str,
+    right_image_file: str,
+    pano_image_file: str,
+    bottom_image_file: str,
+    prompt_text: str,
+    max_pixels: int = DEFAULT_MOSAIC_MAX_PIXELS
+):
+    """
+    拼图模式：四个视角拼成一张带标签的 2x2 图片后只发送一张图，总像素不超过 max_pixels，
+    图像 Token 只占一张图的预算。返回 (分析结果, usage, MosaicLayout)；
+    模型返回的坐标可以用 MosaicLayout.map_bbox 映射回对应的源视角。
+    """
+    if not DASHSCOPE_API_KEY:
+        return "错误：未找到 'DASHSCOPE_API_KEY' 环境变量。请在 .env 文件中配置。", {}, None
+
+    image_files = [left_image_file, right_image_file, pano_image_file, bottom_image_file]
+    if not all(image_files):
+        return "错误：请上传所有四个相机（左侧、右侧、全景、底部）的图片。", {}, None
+
     try:
-        response = dashscope.MultiModalConversation.call(
-            api_key=DASHSCOPE_API_KEY,
-            model=QWEN_MODEL_NAME,
-            messages=messages
-        )
-        
-        # 6. 处理并返回结果
-        if response.status_code == 200:
-            return response.output.choices[0].message.content[0]["text"]
-        else:
-            error_msg = f"DashScope API 调用失败。状态码: {response.status_code}\n"
-            error_msg += f"错误信息: {response.code} - {response.message}"
-            return error_msg
-            
+        layout = build_mosaic(image_files, max_pixels=int(max_pixels))
     except Exception as e:
-        return f"API 调用或网络错误：{e}"
+        return f"拼图生成错误：{e}", {}, None
+
+    label_hint = "，".join(f"标签 {tag} 的格子是{label}" for tag, label in zip(DEFAULT_TILE_LABELS, VIEW_LABELS))
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"image": format_image_for_dashscope(layout.path)},
+                {"text": f"这张图由四个相机视角拼接而成 (2x2)，{label_hint}。"
+                         f"请结合这四个视角提供的信息，回答以下问题：{prompt_text}"}
+            ]
+        }
+    ]
+
+    print(f"正在以拼图方式调用 DashScope API，模型：{QWEN_MODEL_NAME}，拼图尺寸：{layout.size}...")
+    text, usage, error_msg = call_qwen(messages)
+    return (text if error_msg is None else error_msg), add_usage({}, usage), layout
+
+def render_fanout_progress(view_results, fusion_text=None):
+    """按固定的视角顺序拼接已经返回的分视角结果 (未返回的显示为等待中)"""
+    sections = []
+    for label in VIEW_LABELS:
+        sections.append(f"【{label}】\n{view_results.get(label, '分析中...')}")
+    if fusion_text is not None:
+        sections.append(f"【综合结论】\n{fusion_text}")
+    return "\n\n".join(sections)
+
+def multi_camera_analysis_fanout(
+    left_image_file: str,
+    right_image_file: str,
+    pano_image_file: str,
+    bottom_image_file: str,
+    prompt_text: str
+):
+    """
+    分视角并发模式：四个视角各自发起一次子查询，结果按返回顺序逐个推送到界面；
+    全部返回后再用一次纯文本的融合调用综合四个视角的结论。
+    逐步产出 (界面上显示的文本, 累计 usage)。
+    """
+    usage_total = {}
+    if not DASHSCOPE_API_KEY:
+        yield "错误：未找到 'DASHSCOPE_API_KEY' 环境变量。请在 .env 文件中配置。", usage_total
+        return
+
+    image_files = [left_image_file, right_image_file, pano_image_file, bottom_image_file]
+    if not all(image_files):
+        yield "错误：请上传所有四个相机（左侧、右侧、全景、底部）的图片。", usage_total
+        return
+
+    print(f"正在分视角并发调用 DashScope API，模型：{QWEN_MODEL_NAME}...")
+
+    view_results = {}
+    yield render_fanout_progress(view_results), usage_total
+
+    # 1. 四个视角的子查询并发执行，哪个先返回就先显示哪个
+    with ThreadPoolExecutor(max_workers=len(VIEW_LABELS)) as executor:
+        futures = {}
+        for label, image_file in zip(VIEW_LABELS, image_files):
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        {"image": format_image_for_dashscope(image_file)},
+                        {"text": f"这是{label}。请只根据这张图片，简要总结与以下问题相关的观察结果：{prompt_text}"}
+                    ]
+                }
+            ]
+            futures[executor.submit(call_qwen, messages)] = label
+
+        for future in as_completed(futures):
+            label = futures[future]
+            text, usage, error_msg = future.result()
+            add_usage(usage_total, usage)
+            view_results[label] = text if error_msg is None else f"(该视角分析失败) {error_msg}"
+            yield render_fanout_progress(view_results), usage_total
+
+    # 2. 融合调用：只发送各视角的文字结论，不再重复上传图片
+    summaries = "\n".join(f"【{label}】{view_results[label]}" for label in VIEW_LABELS)
+    fusion_messages = [
+        {
+            "role": "user",
+            "content": [
+                {"text": f"以下是同一目标在四个相机视角下分别得到的观察结果：\n{summaries}\n\n"
+                         f"请综合这些信息，回答以下问题：{prompt_text}"}
+            ]
+        }
+    ]
+    yield render_fanout_progress(view_results, "综合中..."), usage_total
+    text, usage, error_msg = call_qwen(fusion_messages)
+    add_usage(usage_total, usage)
+    yield render_fanout_progress(view_results, text if error_msg is None else error_msg), usage_total
+
+def run_analysis(
+    left_image_file: str,
+    right_image_file: str,
+    pano_image_file: str,
+    bottom_image_file: str,
+    prompt_text: str,
+    mode: str,
+    mosaic_max_pixels: int = DEFAULT_MOSAIC_MAX_PIXELS
+):
+    """按选择的模式调用，逐步产出 (分析结果, 耗时和 Token 对比)"""
+    start_time = time.time()
+    inputs = (left_image_file, right_image_file, pano_image_file, bottom_image_file, prompt_text)
+    if mode == MODE_FANOUT:
+        result, usage = "", {}
+        for result, usage in multi_camera_analysis_fanout(*inputs):
+            yield result, f"{mode} 运行中，已耗时 {time.time() - start_time:.2f} 秒..."
+    elif mode == MODE_MOSAIC:
+        yield "", f"{mode} 运行中..."
+        result, usage, layout = multi_camera_analysis_mosaic(*inputs, max_pixels=mosaic_max_pixels)
+        if layout is not None:
+            result = f"{result}\n\n--- 拼图布局 ({layout.size[0]}x{layout.size[1]}) ---\n{layout.describe()}"
+    else:
+        yield "", f"{mode} 运行中..."
+        result, usage = multi_camera_analysis_four_views(*inputs)
+    yield result, format_run_stats(mode, prompt_text, time.time() - start_time, usage)
 
 # --- Gradio 界面搭建 ---
 with gr.Blocks(title="DashScope Qwen-VLM 四相机目标状态判断") as demo:
@@ -116,17 +309,32 @@ with gr.Blocks(title="DashScope Qwen-VLM 四相机目标状态判断") as demo:
         lines=3
     )
 
+    # 调用模式：单次调用四图合并，或分视角并发 + 融合 (各视角结果先到先显示)
+    mode_input = gr.Radio(
+        choices=ALL_MODES,
+        value=MODE_SINGLE,
+        label="调用模式"
+    )
+    # 拼图模式下四个视角合计的像素预算
+    mosaic_pixels_input = gr.Number(
+        label="拼图总像素预算 (仅拼图模式)",
+        value=DEFAULT_MOSAIC_MAX_PIXELS,
+        precision=0
+    )
+
     # 按钮
     submit_button = gr.Button("🚀 调用 Qwen-VLM 进行状态判断")
 
     # 输出框
     output_text = gr.Textbox(label="模型分析结果", lines=10)
+    elapsed_text = gr.Textbox(label="耗时和 Token 对比 (同一指令下各模式最近一次)", lines=4)
 
     # 绑定事件
     submit_button.click(
-        fn=multi_camera_analysis_four_views,
-        inputs=[image_input_left, image_input_right, image_input_pano, image_input_bottom, prompt_input],
-        outputs=output_text
+        fn=run_analysis,
+        inputs=[image_input_left, image_input_right, image_input_pano, image_input_bottom, prompt_input,
+                mode_input, mosaic_pixels_input],
+        outputs=[output_text, elapsed_text]
     )
     
     gr.Markdown(f"--- \n使用的模型：`{QWEN_MODEL_NAME}` | 提示：请确保你的 `.env` 文件中配置了有效的 `DASHSCOPE_API_KEY`。")
@@ -136,4 +344,5 @@ if __name__ == "__main__":
     if not DASHSCOPE_API_KEY:
         print("\n!!! 警告：DASHSCOPE_API_KEY 未设置。应用将启动，但无法调用 API。!!!\n")
         
+    start_metrics_server()
     demo.launch(inbrowser=True)
\ No newline at end of file
@@ -0,0 +1,244 @@
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+
+from usage_record import USAGE_COLUMN_TYPES, USAGE_COLUMNS, parse_legacy_token_info
+
+# 历史记录表的列 (与 HistoryManager.add_record 生成的字典字段一致)。
+# token_info 只保存旧版记录的文字，新记录的用量保存在 USAGE_COLUMNS 的数值列中
+RECORD_FIELDS = (
+    "timestamp",
+    "image_path",
+    "question",
+    "system_prompt_preview",
+    "response",
+    "token_info",
+    "annotated_image_path",
+) + USAGE_COLUMNS
+
+# usage_totals 返回的合计字段
+USAGE_TOTAL_FIELDS = ("calls", "ok", "cache_hits", "total_tokens", "latency_sum", "latency_count")
+# usage_arrays 返回的数值列
+NUMERIC_USAGE_COLUMNS = ("execution_time", "first_token_time", "retries", "image_tokens",
+                         "text_tokens", "output_tokens", "total_tokens", "cache_hit")
+
+
+class HistoryStore:
+    """
+    基于 SQLite (WAL 模式) 的追加式历史记录存储。
+
+    - 追加一条记录只是一次 INSERT，不再重写整个文件；
+    - WAL 模式下多个 Gradio worker / 进程可以同时写入；
+    - 按 (timestamp, id) 建索引，支持按时间倒序分页读取，不限制记录总数。
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS history (
+                       id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       timestamp TEXT NOT NULL,
+                       image_path TEXT,
+                       question TEXT,
+                       system_prompt_preview TEXT,
+                       response TEXT,
+                       token_info TEXT,
+                       annotated_image_path TEXT
+                   )"""
+            )
+            # 旧版数据库没有用量列：补上列，并把已有记录的 token_info 文字解析一次
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(history)")}
+            for name in USAGE_COLUMNS:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE history ADD COLUMN {name} {USAGE_COLUMN_TYPES[name]}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp, id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._backfill_usage(conn)
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作单独连接，busy timeout 让并发写入排队而不是报错
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def append(self, record):
+        """追加一条记录，返回记录 id"""
+        values = [record.get(field) for field in RECORD_FIELDS]
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"INSERT INTO history ({', '.join(RECORD_FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in RECORD_FIELDS)})",
+                values
+            )
+            return cursor.lastrowid
+
+    def extend(self, records):
+        """批量追加多条记录 (单个事务)"""
+        rows = [[record.get(field) for field in RECORD_FIELDS] for record in records]
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT INTO history ({', '.join(RECORD_FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in RECORD_FIELDS)})",
+                rows
+            )
+
+    @staticmethod
+    def _backfill_usage(conn):
+        """为只有 token_info 文字的旧记录填写用量列 (每条记录只解析一次)"""
+        rows = conn.execute("SELECT id, token_info FROM history WHERE status IS NULL").fetchall()
+        if not rows:
+            return
+        updates = []
+        for row in rows:
+            values = parse_legacy_token_info(row["token_info"]).to_row()
+            updates.append([values[name] for name in USAGE_COLUMNS] + [row["id"]])
+        conn.executemany(
+            f"UPDATE history SET {', '.join(f'{name} = ?' for name in USAGE_COLUMNS)} WHERE id = ?",
+            updates
+        )
+
+    def page(self, limit=50, before=None, before_id=None, offset=0):
+        """
+        按时间倒序读取一页记录 (最新的在前)。
+
+        before / before_id: 上一页最后一条记录的 timestamp 和 id (游标分页，翻页代价与总数无关)；
+        只给 before 时返回严格早于该时间的记录。也可以用 offset 做简单的页码分页。
+        """
+        sql = "SELECT * FROM history"
+        params = []
+        if before is not None:
+            if before_id is not None:
+                sql += " WHERE (timestamp < ? OR (timestamp = ? AND id < ?))"
+                params += [before, before, before_id]
+            else:
+                sql += " WHERE timestamp < ?"
+                params.append(before)
+        sql += " ORDER BY timestamp DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def usage_arrays(self, since=None, status=None):
+        """
+        按列读出用量，返回 {列名: numpy 数组} (另含 status 的字符串数组)，用于向量化统计。
+        since 为起始时间 (与 timestamp 同格式)，status 只保留该状态的记录。缺失值为 NaN。
+        """
+        sql = f"SELECT status, {', '.join(NUMERIC_USAGE_COLUMNS)} FROM history"
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._connect() as conn:
+            conn.row_factory = None
+            rows = conn.execute(sql, params).fetchall()
+        columns = list(zip(*rows)) if rows else [()] * (len(NUMERIC_USAGE_COLUMNS) + 1)
+        arrays = {"status": np.array(columns[0], dtype=object)}
+        for name, values in zip(NUMERIC_USAGE_COLUMNS, columns[1:]):
+            # NULL (None) 转换为 NaN
+            arrays[name] = np.array(values, dtype=np.float64)
+        return arrays
+
+    def usage_summary(self, since=None):
+        """成功调用的 Token 合计和耗时分位数 (缓存命中不计 Token)"""
+        arrays = self.usage_arrays(since=since)
+        ok = arrays["status"] == "ok"
+        billed = ok & (arrays["cache_hit"] != 1)
+        latency = arrays["execution_time"][ok & ~np.isnan(arrays["execution_time"])]
+        summary = {
+            "calls": int(len(arrays["status"])),
+            "ok": int(ok.sum()),
+            "failed": int(np.isin(arrays["status"], ("failed", "parse_error")).sum()),
+            "cache_hits": int((ok & (arrays["cache_hit"] == 1)).sum()),
+        }
+        for name in ("image_tokens", "text_tokens", "output_tokens", "total_tokens"):
+            summary[name] = int(np.nansum(arrays[name][billed]))
+        if len(latency):
+            summary["latency_mean"] = float(latency.mean())
+            summary["latency_p50"], summary["latency_p95"] = (float(v) for v in np.percentile(latency, [50, 95]))
+        return summary
+
+    def id_range(self):
+        """(最小 id, 最大 id)，没有记录时为 (None, None)。按主键取，与记录总数无关"""
+        with self._connect() as conn:
+            return tuple(conn.execute("SELECT MIN(id), MAX(id) FROM history").fetchone())
+
+    def usage_totals(self, after_id=None):
+        """
+        用量合计 (由 SQLite 聚合，不读出各行)，after_id 只统计 id 更大的新记录。
+        返回值中的 max_id 是参与统计的最大 id，供下次增量统计。
+        不含分位数，需要分位数时用 usage_summary()。
+        """
+        sql = ("SELECT COUNT(*), "
+               "COALESCE(SUM(status = 'ok'), 0), "
+               "COALESCE(SUM(status = 'ok' AND cache_hit = 1), 0), "
+               "COALESCE(SUM(CASE WHEN status = 'ok' AND COALESCE(cache_hit, 0) != 1 THEN total_tokens END), 0), "
+               "COALESCE(SUM(CASE WHEN status = 'ok' THEN execution_time END), 0), "
+               "COUNT(CASE WHEN status = 'ok' THEN execution_time END), "
+               "MAX(id) "
+               "FROM history")
+        params = []
+        if after_id is not None:
+            sql += " WHERE id > ?"
+            params.append(after_id)
+        with self._connect() as conn:
+            row = conn.execute(sql, params).fetchone()
+        return dict(zip(USAGE_TOTAL_FIELDS + ("max_id",), row))
+
+    def clear(self):
+        """删除全部记录，返回被删除记录引用的图片 {image_path: 次数}"""
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT image_path, COUNT(*) FROM history GROUP BY image_path"))
+            conn.execute("DELETE FROM history")
+        return counts
+
+    def import_json(self, json_path):
+        """
+        导入旧版 call_history.json (新记录在前)。每个存储只导入一次，
+        之后即使清空历史记录也不会重复导入。返回导入的条数。
+        """
+        with self._connect() as conn:
+            done = conn.execute("SELECT value FROM meta WHERE key = 'json_imported'").fetchone()
+        if done is not None or not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"导入旧历史记录失败: {e}")
+            records = []
+        with self._connect() as conn:
+            # 在同一个事务里检查并写入标记，避免多个进程同时启动时重复导入
+            cursor = conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('json_imported', ?)", (json_path,))
+            if cursor.rowcount == 0:
+                return 0
+            # 旧文件是倒序存放的，按时间正序插入，保证 id 与时间顺序一致
+            conn.executemany(
+                f"INSERT INTO history ({', '.join(RECORD_FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in RECORD_FIELDS)})",
+                [[record.get(field) for field in RECORD_FIELDS] for record in reversed(records)]
+            )
+            self._backfill_usage(conn)
+        return len(records)
@@ -0,0 +1,161 @@
+import os
+import shutil
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock, get_ident
+
+from response_cache import hash_file
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 上传图片的存储目录，文件名为内容的 sha256 (前 32 位) + 原扩展名
+DEFAULT_IMAGE_DIR = os.getenv("QWEN_IMAGE_STORE_DIR", "qwen_pictures")
+# 没有历史记录引用的图片在最后一次上传后至少保留这么久，避免回收正在判断中的图片
+DEFAULT_GC_GRACE_SECONDS = int(os.getenv("QWEN_IMAGE_STORE_GC_GRACE_SECONDS", 600))
+# 内存中缓存的 (路径, mtime, 大小) -> sha256 条数，重复上传同一文件时不再计算哈希
+DIGEST_CACHE_ENTRIES = 1024
+DIGEST_LENGTH = 32
+
+# Linux 的 FICLONE ioctl (btrfs / xfs 等文件系统上的 reflink)
+_FICLONE = 0x40049409
+
+
+def _clone_file(src, dst):
+    """依次尝试硬链接、reflink，都不支持 (跨文件系统、FAT 等) 时复制文件内容"""
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            return "reflink"
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+class ImageStore:
+    """
+    按内容寻址的上传图片存储。
+
+    - 相同内容的图片只保存一份，重复上传时只查一次索引，不再复制文件；
+    - 新图片优先用硬链接 / reflink 放入存储目录，不支持时才复制；
+    - 索引 (SQLite) 中记录每张图片被多少条历史记录引用，清空历史记录后
+      collect_garbage 删除不再被引用的图片。目录中不在索引里的旧文件不会被删除。
+    """
+    def __init__(self, image_dir=DEFAULT_IMAGE_DIR, db_path=None, gc_grace_seconds=DEFAULT_GC_GRACE_SECONDS):
+        self.image_dir = image_dir
+        self.db_path = db_path or os.path.join(image_dir, "index.sqlite")
+        self.gc_grace_seconds = gc_grace_seconds
+        self._digests = OrderedDict()
+        self._digests_lock = Lock()
+
+        for directory in {image_dir, os.path.dirname(self.db_path)}:
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS images (
+                       digest TEXT PRIMARY KEY,
+                       path TEXT NOT NULL UNIQUE,
+                       size INTEGER NOT NULL,
+                       refcount INTEGER NOT NULL DEFAULT 0,
+                       last_put REAL NOT NULL
+                   )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作单独连接：线程 / 进程之间无需共享连接对象
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _digest(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._digests_lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                return digest, stat.st_size
+        digest = hash_file(path)[:DIGEST_LENGTH]
+        with self._digests_lock:
+            self._digests[key] = digest
+            while len(self._digests) > DIGEST_CACHE_ENTRIES:
+                self._digests.popitem(last=False)
+        return digest, stat.st_size
+
+    def put(self, src_path):
+        """把图片放入存储，返回存储中的路径 (相同内容返回同一路径)"""
+        digest, size = self._digest(src_path)
+        ext = os.path.splitext(src_path)[1].lower()
+        path = os.path.join(self.image_dir, f"{digest}{ext}")
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO images (digest, path, size, refcount, last_put) VALUES (?, ?, ?, 0, ?) "
+                "ON CONFLICT(digest) DO UPDATE SET last_put = excluded.last_put",
+                (digest, path, size, time.time())
+            )
+            path = conn.execute("SELECT path FROM images WHERE digest = ?", (digest,)).fetchone()[0]
+
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+            method = _clone_file(src_path, tmp_path)
+            os.replace(tmp_path, path)
+            print(f"图像已保存到: {path} ({method})")
+        return path
+
+    def acquire(self, path):
+        """一条历史记录引用了该图片；不在存储中的路径忽略"""
+        with self._connect() as conn:
+            conn.execute("UPDATE images SET refcount = refcount + 1 WHERE path = ?", (path,))
+
+    def release(self, counts):
+        """释放引用，counts 为 {路径: 引用次数}"""
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE images SET refcount = MAX(refcount - ?, 0) WHERE path = ?",
+                [(count, path) for path, count in counts.items() if path]
+            )
+
+    def collect_garbage(self):
+        """删除没有引用且超过保留期的图片，返回 (删除的文件数, 释放的字节数)"""
+        cutoff = time.time() - self.gc_grace_seconds
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT digest, path, size FROM images WHERE refcount <= 0 AND last_put < ?", (cutoff,)
+            ).fetchall()
+
+        removed, freed = 0, 0
+        for digest, path, size in rows:
+            with self._connect() as conn:
+                # 在写事务中重新确认并删除文件：put 更新索引时要等待这里提交，
+                # 因此不会出现 put 刚复用的文件被同时删除的情况
+                conn.execute("BEGIN IMMEDIATE")
+                if not conn.execute(
+                    "SELECT 1 FROM images WHERE digest = ? AND refcount <= 0 AND last_put < ?", (digest, cutoff)
+                ).fetchone():
+                    continue
+                conn.execute("DELETE FROM images WHERE digest = ?", (digest,))
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            removed += 1
+            freed += size
+        return removed, freed
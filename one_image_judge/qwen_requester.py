@@ -1,30 +1,176 @@
 import dashscope
 from dashscope import MultiModalConversation
-from utils import get_file_url, encode_image
+from utils import get_file_url, encode_image_data_uri
+from response_cache import ResponseCache, get_default_response_cache, mark_cache_hit
+from image_preprocess import (prepare_image, DEFAULT_MAX_PIXELS, DEFAULT_MIN_PIXELS,
+                              DEFAULT_IMAGE_FORMAT, DEFAULT_IMAGE_QUALITY)
+from resilience import RetryPolicy, get_circuit_breaker, is_retryable, circuit_open_result
+from rate_limiter import RateLimiter, get_rate_limiter
+from key_pool import KEY_EJECT_CODES
+from tracing import Trace, add_exporter, maybe_span
+from usage_record import CIRCUIT_OPEN_CODE, UsageRecord
+from metrics import MetricsExporter, record_error, track_in_flight
+import asyncio
+import itertools
+import json
+import mimetypes
+import os
 import time
+from contextlib import aclosing
+
+import aiohttp
+import requests
 
 QWEN_MODEL_NAME = 'qwen3-vl-plus-2025-09-23'
 
+# DashScope 原生 HTTP 接口 (与 SDK 使用同一个环境变量覆盖 base url)
+DASHSCOPE_HTTP_BASE_URL = os.getenv("DASHSCOPE_HTTP_BASE_URL", "https://dashscope.aliyuncs.com/api/v1")
+MULTIMODAL_GENERATION_PATH = "/services/aigc/multimodal-generation/generation"
+
+# 异步 Requester 默认允许同时在途的请求数
+DEFAULT_MAX_CONCURRENCY = 32
+# 调用没有完成 (调用方提前关闭流式生成器或取消任务) 时结算 lease 用的错误码
+ABORTED_CODE = "Aborted"
+
+# 每次调用的结果、Token 用量和阶段耗时计入 Prometheus 指标 (见 metrics.py)
+add_exporter(MetricsExporter())
+
+
+def build_full_question(question, system_prompt):
+    """只有当 system_prompt 不为空时，才将其拼接到 question 后面"""
+    if system_prompt and system_prompt.strip():
+        return question + "\n\n" + system_prompt
+    return question
+
+
+def build_failure_result(code, message, retries=0):
+    """调用失败时返回的 (response_text, UsageRecord)"""
+    error_message = f"DashScope API 调用失败。Code: {code}，Message: {message}"
+    print(error_message)
+    return error_message, UsageRecord.failure(code, retries)
+
+
+def extract_content_text(content):
+    """拼接消息 content 列表中的文本片段 (流式增量输出中 content 可能为空列表)"""
+    return "".join(item.get("text", "") for item in content or [] if isinstance(item, dict))
+
+
+def build_preprocess_options(max_pixels, min_pixels, image_format, image_quality):
+    """上传前的图片预处理参数 (max_pixels=None 表示直接上传原图)"""
+    return {
+        "max_pixels": max_pixels,
+        "min_pixels": min_pixels,
+        "image_format": image_format,
+        "quality": image_quality,
+    }
+
+
+def resolve_cache(cache):
+    """cache=True 使用三个应用共享的默认缓存；False/None 关闭缓存；也可以直接传入 ResponseCache 实例"""
+    if cache is True:
+        return get_default_response_cache()
+    if isinstance(cache, ResponseCache):
+        return cache
+    return None
+
+
+def resolve_rate_limiter(rate_limiter, api_key):
+    """rate_limiter=True 使用按 api_key 共享的跨进程限流器；False/None 关闭；也可以直接传入 RateLimiter 实例"""
+    if rate_limiter is True:
+        return get_rate_limiter(api_key)
+    if isinstance(rate_limiter, RateLimiter):
+        return rate_limiter
+    return None
+
+
+def select_api_key(api_key, default_api_key, key_pool):
+    """
+    选择本次调用使用的 Key：调用时显式传入的 api_key > Key 池 > 构造时的默认 Key。
+    返回 (api_key, 是否从 Key 池中取出)。
+    """
+    if api_key:
+        return api_key, False
+    if key_pool is not None:
+        return key_pool.acquire(), True
+    if default_api_key:
+        return default_api_key, False
+    raise ValueError("未提供 API Key：请传入 api_key 或 key_pool")
+
+
+class CallLease:
+    """
+    一次调用占用的资源：所用的 API Key、(可选的) Key 池和限流器预留额度。
+    成功拿到 usage 后调用 settle 结算；调用失败时调用 fail 退回额度并上报错误码。
+    """
+    def __init__(self, api_key, key_pool=None, reservation=None):
+        self.api_key = api_key
+        self.key_pool = key_pool
+        self.reservation = reservation
+
+    def settle(self, usage):
+        tokens = usage.get('total_tokens', 0) if usage else 0
+        if self.reservation is not None:
+            self.reservation.settle(tokens)
+        if self.key_pool is not None:
+            self.key_pool.release(self.api_key, tokens=tokens)
+
+    def fail(self, code):
+        if self.reservation is not None:
+            self.reservation.settle(0)
+        if self.key_pool is not None:
+            self.key_pool.release(self.api_key, error_code=code)
+
+    def can_switch_key(self, code):
+        """额度 / 鉴权类错误在 Key 池里还有可用 Key 时可以换 Key 重试"""
+        return self.key_pool is not None and code in KEY_EJECT_CODES and self.key_pool.has_available_key()
+
+
 class QwenRequester:
-    # ... (这部分代码保持不变)
-    def __init__(self, api_key, model_name=QWEN_MODEL_NAME):
-        # 仅设置 API Key
-        dashscope.api_key = api_key 
+    # 失败重试策略、熔断器和限流器可以通过 retry_policy / circuit_breaker / rate_limiter 参数替换
+    def __init__(self, api_key=None, model_name=QWEN_MODEL_NAME, cache=True,
+                 max_pixels=DEFAULT_MAX_PIXELS, min_pixels=DEFAULT_MIN_PIXELS,
+                 image_format=DEFAULT_IMAGE_FORMAT, image_quality=DEFAULT_IMAGE_QUALITY,
+                 retry_policy=None, circuit_breaker=None, rate_limiter=True, key_pool=None):
+        # API Key 随每次调用显式传给 SDK，不再设置全局 dashscope.api_key，
+        # 这样同一进程里不同用户 / 不同 Key 的调用互不覆盖
         self.api_key = api_key
+        self.key_pool = key_pool
         self.model_name = model_name
+        self.cache = resolve_cache(cache)
+        self.preprocess_options = build_preprocess_options(max_pixels, min_pixels, image_format, image_quality)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or get_circuit_breaker(dashscope.base_http_api_url)
+        # True / False / RateLimiter 实例；为 True 时按实际使用的 Key 取共享限流器
+        self.rate_limiter = rate_limiter
 
-    def create_request_messages_base64(self, question, image_path, system_prompt):
+    def _open_lease(self, api_key):
+        """选择 Key 并向该 Key 的限流器申请额度 (额度不足时排队等待)"""
+        api_key, pooled = select_api_key(api_key, self.api_key, self.key_pool)
+        try:
+            limiter = resolve_rate_limiter(self.rate_limiter, api_key)
+            reservation = limiter.acquire() if limiter is not None else None
+        except BaseException:
+            # 申请额度失败时归还刚取出的 Key
+            if pooled:
+                self.key_pool.release(api_key)
+            raise
+        return CallLease(api_key, self.key_pool if pooled else None, reservation)
+
+    def create_request_messages_base64(self, question, image_path, system_prompt, trace=None):
         """
         构造 DashScope SDK 所需的消息列表。
         """
         # file_url = get_file_url(image_path)
 
-        base64_image = encode_image(image_path)
+        # 先按像素预算缩放，再编码
+        with maybe_span(trace, "prepare"):
+            prepared = prepare_image(image_path, **self.preprocess_options)
+        mime_type = mimetypes.guess_type(prepared.path)[0] or "image/png"
+        # data URI 按文件版本缓存，同一帧重复判断时不再读盘和编码
+        with maybe_span(trace, "encode"):
+            image_data_uri = encode_image_data_uri(prepared.path, mime_type)
         # ❗️ 逻辑修改：只有当 system_prompt 不为空时，才将其拼接到 question 后面
-        if system_prompt and system_prompt.strip():
-            full_question = question + "\n\n" + system_prompt
-        else:
-            full_question = question
+        full_question = build_full_question(question, system_prompt)
 
         print("28 debug-------------------")
         # print(file_url)
@@ -34,7 +180,7 @@ class QwenRequester:
                 'role': 'user',
                 'content': [
                     {"type": "image_url",
-                    'image_url': {"url": f"data:image/png;base64,{base64_image}"}},        # 图片文件 URL (使用 file:// 协议)
+                    'image_url': {"url": image_data_uri}},        # 图片文件 URL (使用 file:// 协议)
                     {'type':"text",'text': full_question}     # 文本问题 + (可选的) System Prompt
                 ]
             }
@@ -42,17 +188,19 @@ class QwenRequester:
         return messages
 
         
-    def create_request_messages(self, question, image_path, system_prompt):
+    def create_request_messages(self, question, image_path, system_prompt, trace=None):
         """
         构造 DashScope SDK 所需的消息列表。
         """
-        file_url = get_file_url(image_path)
+        # 先按像素预算缩放 (超出预算时上传的是缩放后的缓存文件)
+        with maybe_span(trace, "prepare"):
+            prepared = prepare_image(image_path, **self.preprocess_options)
+        # SDK 路径下图片由 SDK 上传，这里只解析文件路径 (上传耗时计入 network)
+        with maybe_span(trace, "encode"):
+            file_url = get_file_url(prepared.path)
         
         # ❗️ 逻辑修改：只有当 system_prompt 不为空时，才将其拼接到 question 后面
-        if system_prompt and system_prompt.strip():
-            full_question = question + "\n\n" + system_prompt
-        else:
-            full_question = question
+        full_question = build_full_question(question, system_prompt)
 
         print("28 debug-------------------")
         print(file_url)
@@ -68,52 +216,601 @@ class QwenRequester:
         ]
         return messages
 
-    def request_qwen(self, question, image_path, system_prompt):
+    def request_qwen(self, question, image_path, system_prompt, use_cache=True, api_key=None):
         """
-        接收 system_prompt 参数。
+        接收 system_prompt 参数，返回 (response_text, UsageRecord)。use_cache=False 时跳过响应缓存，强制重新调用。
+        api_key 可以按调用指定，不传时使用 Key 池或构造时的 Key。
         """
+        with track_in_flight(self.model_name):
+            return self._request_qwen(question, image_path, system_prompt, use_cache, api_key)
+
+    def _request_qwen(self, question, image_path, system_prompt, use_cache, api_key):
         start_time = time.time()
+        trace = Trace("request_qwen", model=self.model_name, stream=False)
+
+        # 0. 查询响应缓存 (命中时直接返回，不消耗 Token)
+        cache_key = None
+        if self.cache is not None and use_cache:
+            with trace.span("cache_lookup"):
+                cache_key = self.cache.make_key(image_path, question, system_prompt, self.model_name,
+                                                variant=self.preprocess_options)
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                trace.finish(status="cache_hit")
+                response_text, usage_record = cached
+                return response_text, mark_cache_hit(usage_record, time.time() - start_time)
         
         # 1. 构造消息 (传入 system_prompt)
-        messages = self.create_request_messages(question, image_path, system_prompt)
+        messages = self.create_request_messages(question, image_path, system_prompt, trace=trace)
         # base64_image = get_file_url(image_path, return_base64=True)
 
-        # 2. 调用 SDK
-        response = MultiModalConversation.call(
-            model=self.model_name,
-            messages=messages
-        )
+        # 2. 调用 SDK (失败时按策略重试)
+        response, retries, failure, lease = self._call_with_retry(messages, api_key=api_key, trace=trace)
         
         # 3. 检查并提取结果
-        if response.status_code != 200:
-            error_message = f"DashScope API 调用失败。Code: {response.code}，Message: {response.message}"
-            print(error_message)
-            return error_message, f"Status: Failed (Code {response.code})"
+        if failure is not None:
+            trace.finish(status="failed", retries=retries)
+            return failure
+        lease.settle(response.get('usage'))
             
         try:
-            response_text = response["output"]["choices"][0]["message"].content[0]["text"]
+            with trace.span("parse"):
+                response_text = response["output"]["choices"][0]["message"].content[0]["text"]
         except (KeyError, IndexError):
+            trace.finish(status="parse_error", retries=retries, usage=response.get('usage'))
             error_message = "Error: Failed to parse response content from DashScope."
             print(error_message)
-            return error_message, "Status: Failed to parse response"
+            return error_message, UsageRecord.parse_error(retries)
         
         # 4. 打印并构造 Token 统计信息
         usage = response.get('usage', {})
-        input_img_token_num = usage.get('image_tokens', 0)
-        input_txt_token_num = usage.get('input_tokens_details', {}).get('text_tokens', 0)
-        output_txt_token_num = usage.get('output_tokens_details', {}).get('text_tokens', 0)
-        total_token_num = usage.get('total_tokens', 0)
-        
-        end_time = time.time()
-        execution_time = end_time - start_time
-        
-        token_info = (
-            f"--- Token 和时间统计 ---\n"
-            f"总耗时: {execution_time:.2f} 秒\n"
-            f"输入图像的 Token 数: {input_img_token_num}\n"
-            f"输入文本的 Token 数: {input_txt_token_num}\n"
-            f"输出文本的 Token 数: {output_txt_token_num}\n"
-            f"总 Token 数: {total_token_num}"
-        )
+        execution_time = time.time() - start_time
+        usage_record = UsageRecord.from_usage(usage, execution_time, retries=retries, stages=trace.durations())
+
+        # 5. 写入响应缓存 (只缓存成功的结果)
+        if cache_key is not None:
+            with trace.span("cache_store"):
+                self.cache.put(cache_key, response_text, usage_record)
+        trace.finish(status="ok", retries=retries, usage=usage)
         
-        return response_text, token_info
+        return response_text, usage_record
+
+    def _call_with_retry(self, messages, stream=False, api_key=None, trace=None):
+        """
+        调用 SDK：限流 / 5xx / 网络错误按指数退避重试，鉴权、额度类错误直接失败
+        (使用 Key 池时换一个 Key 重试)，熔断期间直接拒绝。
+        每次尝试前先选 Key 并向限流器申请额度 (额度不足时排队等待)。
+        返回 (response, retries, failure, lease)，成功时 failure 为 None，
+        lease 需要在拿到 usage 后结算；
+        stream=True 时 response 是首个分片已确认成功的分片迭代器 (开始输出后不再重试)。
+        传入 trace 时分别记录限流等待、网络调用和重试退避的耗时。
+        """
+        retries = 0
+        while True:
+            if not self.circuit_breaker.allow_request():
+                record_error(self.model_name, CIRCUIT_OPEN_CODE)
+                return None, retries, circuit_open_result(self.circuit_breaker), None
+            lease = None
+            try:
+                with maybe_span(trace, "rate_limit"):
+                    lease = self._open_lease(api_key)
+                with maybe_span(trace, "network", attempt=retries):
+                    if stream:
+                        responses = MultiModalConversation.call(
+                            api_key=lease.api_key,
+                            model=self.model_name,
+                            messages=messages,
+                            stream=True,
+                            incremental_output=True
+                        )
+                        first = next(responses)
+                        response = itertools.chain([first], responses)
+                    else:
+                        first = response = MultiModalConversation.call(
+                            api_key=lease.api_key,
+                            model=self.model_name,
+                            messages=messages
+                        )
+                    status_code, code, message = first.status_code, first.code, first.message
+            except requests.exceptions.RequestException as e:
+                response, status_code, code, message = None, None, "NetworkError", repr(e)
+            except BaseException:
+                # 意外异常 (包括选 Key / 申请额度失败) 也要释放半开状态的探测名额和已占用的 Key、额度，
+                # 否则熔断器会一直拒绝请求
+                self.circuit_breaker.release_probe()
+                if lease is not None:
+                    lease.fail(ABORTED_CODE)
+                raise
+
+            if status_code == 200:
+                self.circuit_breaker.record_success()
+                return response, retries, None, lease
+
+            # 失败的请求不消耗 Token，退回预留额度 (额度类错误会让 Key 池临时剔除该 Key)
+            record_error(self.model_name, code)
+            lease.fail(code)
+            retryable = is_retryable(status_code, code)
+            if retryable:
+                self.circuit_breaker.record_failure()
+            else:
+                # 服务端有响应，只是请求本身有问题：不计入熔断，但要释放探测名额
+                self.circuit_breaker.release_probe()
+            retryable = retryable or lease.can_switch_key(code)
+            if not retryable or retries + 1 >= self.retry_policy.max_attempts:
+                return None, retries, build_failure_result(code, message, retries), None
+            delay = self.retry_policy.backoff(retries)
+            print(f"DashScope API 调用失败 (Code: {code})，{delay:.2f} 秒后进行第 {retries + 1} 次重试")
+            with maybe_span(trace, "retry_wait"):
+                time.sleep(delay)
+            retries += 1
+
+
+    def request_qwen_stream(self, question, image_path, system_prompt, use_cache=True, api_key=None):
+        """
+        流式调用 (SDK 增量输出)，逐步产出 (已生成的文本, UsageRecord)。
+        生成过程中 UsageRecord 的 status 为 streaming (进度)，最后一次产出完整统计 (含首 Token 耗时和输出速度)。
+        """
+        with track_in_flight(self.model_name):
+            yield from self._request_qwen_stream(question, image_path, system_prompt, use_cache, api_key)
+
+    def _request_qwen_stream(self, question, image_path, system_prompt, use_cache, api_key):
+        start_time = time.time()
+        trace = Trace("request_qwen_stream", model=self.model_name, stream=True)
+
+        # 0. 查询响应缓存，命中时一次性返回
+        cache_key = None
+        if self.cache is not None and use_cache:
+            with trace.span("cache_lookup"):
+                cache_key = self.cache.make_key(image_path, question, system_prompt, self.model_name,
+                                                variant=self.preprocess_options)
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                trace.finish(status="cache_hit")
+                response_text, usage_record = cached
+                yield response_text, mark_cache_hit(usage_record, time.time() - start_time)
+                return
+
+        # 1. 构造消息
+        messages = self.create_request_messages(question, image_path, system_prompt, trace=trace)
+
+        # 2. 以增量输出模式调用 SDK (首个分片之前失败会按策略重试)
+        responses, retries, failure, lease = self._call_with_retry(messages, stream=True, api_key=api_key,
+                                                                   trace=trace)
+        if failure is not None:
+            trace.finish(status="failed", retries=retries)
+            yield failure
+            return
+
+        response_text = ""
+        usage = {}
+        first_token_time = None
+        error = None
+        # 读取后续分片的时间计入 network (包含调用方处理每次产出的时间)
+        stream_start = time.perf_counter()
+        settled = False
+        try:
+            for response in responses:
+                if response.status_code != 200:
+                    error = response
+                    break
+
+                usage = response.get('usage') or usage
+                try:
+                    text = extract_content_text(response["output"]["choices"][0]["message"].content)
+                except (KeyError, IndexError, TypeError):
+                    continue
+                if not text:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                response_text += text
+                yield response_text, UsageRecord.progress(first_token_time)
+            settled = True
+            if error is not None:
+                record_error(self.model_name, error.code)
+                lease.fail(error.code)
+            else:
+                lease.settle(usage)
+        finally:
+            trace.add("network", time.perf_counter() - stream_start)
+            if not settled:
+                # 读取分片时出现异常，或调用方提前 close() 了生成器
+                lease.fail(ABORTED_CODE)
+
+        if error is not None:
+            trace.finish(status="failed", retries=retries)
+            yield build_failure_result(error.code, error.message, retries)
+            return
+        if first_token_time is None:
+            trace.finish(status="parse_error", retries=retries, usage=usage)
+            error_message = "Error: Failed to parse response content from DashScope."
+            print(error_message)
+            yield error_message, UsageRecord.parse_error(retries)
+            return
+
+        # 3. 构造最终统计信息并写入缓存
+        usage_record = UsageRecord.from_usage(usage, time.time() - start_time, first_token_time, retries,
+                                          stages=trace.durations())
+        if cache_key is not None:
+            with trace.span("cache_store"):
+                self.cache.put(cache_key, response_text, usage_record)
+        trace.finish(status="ok", retries=retries, usage=usage)
+        yield response_text, usage_record
+
+
+class AsyncQwenRequester:
+    """
+    QwenRequester 的异步版本。
+
+    整个进程复用同一个 aiohttp 会话 (长连接 keep-alive)，并用信号量限制同时在途的请求数，
+    这样一个进程就可以同时挂起几十个判断请求，而不是阻塞在网络延迟上。
+    request_qwen 返回值与 QwenRequester 一致: (response_text, UsageRecord)。
+
+    用法:
+        requester = AsyncQwenRequester(api_key, max_concurrency=32)
+        response_text, usage = await requester.request_qwen(question, image_path, system_prompt)
+        await requester.close()
+    """
+    def __init__(self, api_key=None, model_name=QWEN_MODEL_NAME, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 base_url=DASHSCOPE_HTTP_BASE_URL, timeout=120, cache=True,
+                 max_pixels=DEFAULT_MAX_PIXELS, min_pixels=DEFAULT_MIN_PIXELS,
+                 image_format=DEFAULT_IMAGE_FORMAT, image_quality=DEFAULT_IMAGE_QUALITY,
+                 retry_policy=None, circuit_breaker=None, rate_limiter=True, key_pool=None):
+        # 不修改全局 dashscope.api_key，鉴权信息随每个请求的请求头发送，同一个会话可以服务多个 Key
+        self.api_key = api_key
+        self.key_pool = key_pool
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.endpoint = base_url.rstrip("/") + MULTIMODAL_GENERATION_PATH
+        self.timeout = timeout
+        self.cache = resolve_cache(cache)
+        self.preprocess_options = build_preprocess_options(max_pixels, min_pixels, image_format, image_quality)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or get_circuit_breaker(self.endpoint)
+        self.rate_limiter = rate_limiter
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    def _get_session(self):
+        """懒加载持久化会话，连接池大小与并发上限一致"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._session
+
+    async def close(self):
+        """关闭底层 HTTP 会话"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _open_lease(self, api_key):
+        """选择 Key 并向该 Key 的限流器申请额度 (额度不足时异步排队等待)"""
+        api_key, pooled = select_api_key(api_key, self.api_key, self.key_pool)
+        try:
+            limiter = resolve_rate_limiter(self.rate_limiter, api_key)
+            reservation = await limiter.acquire_async() if limiter is not None else None
+        except BaseException:
+            # 申请额度失败或排队时被取消，归还刚取出的 Key
+            if pooled:
+                self.key_pool.release(api_key)
+            raise
+        return CallLease(api_key, self.key_pool if pooled else None, reservation)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def create_request_messages(self, question, image_path, system_prompt, trace=None):
+        """
+        构造 DashScope 原生 HTTP 接口所需的消息列表。
+        直连 HTTP 时没有 SDK 的 file:// 自动上传，图片以 base64 data URI 内联发送。
+        """
+        with maybe_span(trace, "prepare"):
+            prepared = prepare_image(image_path, **self.preprocess_options)
+        mime_type = mimetypes.guess_type(prepared.path)[0] or "image/png"
+        # data URI 按文件版本缓存，同一帧重复判断时不再读盘和编码
+        with maybe_span(trace, "encode"):
+            image_data_uri = encode_image_data_uri(prepared.path, mime_type)
+        full_question = build_full_question(question, system_prompt)
+
+        messages = [
+            {
+                'role': 'user',
+                'content': [
+                    {'image': image_data_uri},
+                    {'text': full_question}
+                ]
+            }
+        ]
+        return messages
+
+    async def request_qwen(self, question, image_path, system_prompt, use_cache=True, api_key=None):
+        """
+        异步调用 Qwen-VL，返回 (response_text, UsageRecord)。use_cache=False 时跳过响应缓存。
+        api_key 可以按调用指定，不传时使用 Key 池或构造时的 Key。
+        """
+        with track_in_flight(self.model_name):
+            return await self._request_qwen(question, image_path, system_prompt, use_cache, api_key)
+
+    async def _request_qwen(self, question, image_path, system_prompt, use_cache, api_key):
+        start_time = time.time()
+        trace = Trace("async_request_qwen", model=self.model_name, stream=False)
+
+        # 0. 查询响应缓存 (哈希图片和读 SQLite 都放到线程池里做)
+        cache_key = None
+        if self.cache is not None and use_cache:
+            with trace.span("cache_lookup"):
+                cache_key = await asyncio.to_thread(self.cache.make_key, image_path, question, system_prompt,
+                                                    self.model_name, self.preprocess_options)
+                cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                trace.finish(status="cache_hit")
+                response_text, usage_record = cached
+                return response_text, mark_cache_hit(usage_record, time.time() - start_time)
+
+        # 1. 构造消息 (缩放和 base64 编码放到线程池里做，避免阻塞事件循环)
+        messages = await asyncio.to_thread(self.create_request_messages, question, image_path, system_prompt,
+                                           trace)
+        payload = {
+            "model": self.model_name,
+            "input": {"messages": messages},
+            "parameters": {},
+        }
+
+        # 2. 在并发上限内发送请求 (失败时按策略重试)
+        with trace.span("queue"):
+            await self._semaphore.acquire()
+        try:
+            resp, retries, failure, lease = await self._post_with_retry(payload, api_key=api_key, trace=trace)
+            if failure is not None:
+                trace.finish(status="failed", retries=retries)
+                return failure
+            try:
+                with trace.span("network", phase="body"):
+                    data = await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                trace.finish(status="failed", retries=retries)
+                record_error(self.model_name, "NetworkError")
+                await asyncio.to_thread(lease.fail, "NetworkError")
+                return build_failure_result("NetworkError", repr(e), retries)
+            except BaseException:
+                # 读取响应体时任务被取消
+                lease.fail(ABORTED_CODE)
+                raise
+            finally:
+                resp.release()
+        finally:
+            self._semaphore.release()
+        # 响应体不是 JSON 对象时没有 usage，按解析失败处理
+        usage = data.get('usage') if isinstance(data, dict) else None
+        await asyncio.to_thread(lease.settle, usage)
+
+        # 3. 提取结果
+
+        try:
+            with trace.span("parse"):
+                response_text = data["output"]["choices"][0]["message"]["content"][0]["text"]
+        except (KeyError, IndexError, TypeError):
+            trace.finish(status="parse_error", retries=retries, usage=usage)
+            error_message = "Error: Failed to parse response content from DashScope."
+            print(error_message)
+            return error_message, UsageRecord.parse_error(retries)
+
+        # 4. 构造 Token 统计信息
+        usage = usage or {}
+        execution_time = time.time() - start_time
+        usage_record = UsageRecord.from_usage(usage, execution_time, retries=retries, stages=trace.durations())
+
+        # 5. 写入响应缓存 (只缓存成功的结果)
+        if cache_key is not None:
+            with trace.span("cache_store"):
+                await asyncio.to_thread(self.cache.put, cache_key, response_text, usage_record)
+        trace.finish(status="ok", retries=retries, usage=usage)
+
+        return response_text, usage_record
+
+    async def _post_with_retry(self, payload, headers=None, api_key=None, trace=None):
+        """
+        发送请求：限流 / 5xx / 网络错误按指数退避重试，鉴权、额度类错误直接失败
+        (使用 Key 池时换一个 Key 重试)，熔断期间直接拒绝。
+        每次尝试前先选 Key 并向限流器申请额度 (额度不足时排队等待)。
+        返回 (resp, retries, failure, lease)；成功时 resp 为状态码 200 的响应，
+        由调用方读取后 release()，并在拿到 usage 后结算 lease。
+        传入 trace 时分别记录限流等待、网络调用 (到响应头为止) 和重试退避的耗时。
+        """
+        retries = 0
+        while True:
+            if not self.circuit_breaker.allow_request():
+                record_error(self.model_name, CIRCUIT_OPEN_CODE)
+                return None, retries, circuit_open_result(self.circuit_breaker), None
+            lease = None
+            try:
+                with maybe_span(trace, "rate_limit"):
+                    lease = await self._open_lease(api_key)
+                request_headers = {"Authorization": f"Bearer {lease.api_key}", **(headers or {})}
+                try:
+                    with maybe_span(trace, "network", attempt=retries):
+                        resp = await self._get_session().post(self.endpoint, json=payload, headers=request_headers)
+                        if resp.status == 200:
+                            self.circuit_breaker.record_success()
+                            return resp, retries, None, lease
+                        status_code = resp.status
+                        try:
+                            data = await resp.json(content_type=None)
+                        finally:
+                            resp.release()
+                    code = data.get("code") if isinstance(data, dict) else None
+                    message = data.get("message") if isinstance(data, dict) else data
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    status_code, code, message = None, "NetworkError", repr(e)
+            except BaseException:
+                # 意外异常 (包括选 Key / 申请额度失败和任务取消) 也要释放半开状态的探测名额和已占用的 Key、额度
+                self.circuit_breaker.release_probe()
+                if lease is not None:
+                    lease.fail(ABORTED_CODE)
+                raise
+
+            # 失败的请求不消耗 Token，退回预留额度 (额度类错误会让 Key 池临时剔除该 Key)
+            record_error(self.model_name, code)
+            await asyncio.to_thread(lease.fail, code)
+            retryable = is_retryable(status_code, code)
+            if retryable:
+                self.circuit_breaker.record_failure()
+            else:
+                # 服务端有响应，只是请求本身有问题：不计入熔断，但要释放探测名额
+                self.circuit_breaker.release_probe()
+            retryable = retryable or lease.can_switch_key(code)
+            if not retryable or retries + 1 >= self.retry_policy.max_attempts:
+                return None, retries, build_failure_result(code, message, retries), None
+            delay = self.retry_policy.backoff(retries)
+            print(f"DashScope API 调用失败 (Code: {code})，{delay:.2f} 秒后进行第 {retries + 1} 次重试")
+            with maybe_span(trace, "retry_wait"):
+                await asyncio.sleep(delay)
+            retries += 1
+
+    async def request_qwen_stream(self, question, image_path, system_prompt, use_cache=True, api_key=None):
+        """
+        流式调用 (SSE 增量输出)，逐步产出 (已生成的文本, UsageRecord)。
+        生成过程中 UsageRecord 的 status 为 streaming (进度)，最后一次产出完整统计 (含首 Token 耗时和输出速度)。
+        """
+        # 调用方提前关闭时同步关闭内部生成器，确保其中的 finally (归还 Key 和额度) 立即执行
+        with track_in_flight(self.model_name):
+            async with aclosing(self._request_qwen_stream(question, image_path, system_prompt, use_cache,
+                                                          api_key)) as stream:
+                async for item in stream:
+                    yield item
+
+    async def _request_qwen_stream(self, question, image_path, system_prompt, use_cache, api_key):
+        start_time = time.time()
+        trace = Trace("async_request_qwen_stream", model=self.model_name, stream=True)
+
+        # 0. 查询响应缓存，命中时一次性返回
+        cache_key = None
+        if self.cache is not None and use_cache:
+            with trace.span("cache_lookup"):
+                cache_key = await asyncio.to_thread(self.cache.make_key, image_path, question, system_prompt,
+                                                    self.model_name, self.preprocess_options)
+                cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                trace.finish(status="cache_hit")
+                response_text, usage_record = cached
+                yield response_text, mark_cache_hit(usage_record, time.time() - start_time)
+                return
+
+        # 1. 构造消息
+        messages = await asyncio.to_thread(self.create_request_messages, question, image_path, system_prompt,
+                                           trace)
+        payload = {
+            "model": self.model_name,
+            "input": {"messages": messages},
+            "parameters": {"incremental_output": True},
+        }
+        sse_headers = {"X-DashScope-SSE": "enable", "Accept": "text/event-stream"}
+
+        response_text = ""
+        usage = {}
+        first_token_time = None
+        error = None
+        lease = None
+        settled = False
+
+        # 2. 在并发上限内读取 SSE 事件流 (建立连接阶段的失败按策略重试)
+        with trace.span("queue"):
+            await self._semaphore.acquire()
+        try:
+            resp, retries, failure, lease = await self._post_with_retry(payload, headers=sse_headers,
+                                                                        api_key=api_key, trace=trace)
+            if failure is not None:
+                trace.finish(status="failed", retries=retries)
+                yield failure
+                return
+            event_status = 200
+            # 读取事件流的时间计入 network (包含调用方处理每次产出的时间)
+            stream_start = time.perf_counter()
+            try:
+                async for raw_line in resp.content:
+                    line = raw_line.decode("utf-8").strip()
+                    if line.startswith(":HTTP_STATUS/"):
+                        # 每个 SSE 事件前都带有该事件对应的 HTTP 状态码
+                        event_status = int(line[len(":HTTP_STATUS/"):])
+                        continue
+                    if not line.startswith("data:"):
+                        continue
+                    data = json.loads(line[len("data:"):])
+                    if not isinstance(data, dict):
+                        continue
+                    if "output" not in data:
+                        # SSE 中的错误事件只有 code / message
+                        error = (data.get("code"), data.get("message"))
+                        if is_retryable(event_status, data.get("code")):
+                            self.circuit_breaker.record_failure()
+                        break
+                    usage = data.get("usage") or usage
+                    try:
+                        text = extract_content_text(data["output"]["choices"][0]["message"]["content"])
+                    except (KeyError, IndexError, TypeError):
+                        continue
+                    if not text:
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.time() - start_time
+                    response_text += text
+                    yield response_text, UsageRecord.progress(first_token_time)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error = ("NetworkError", repr(e))
+            finally:
+                resp.release()
+                trace.add("network", time.perf_counter() - stream_start)
+            # 读完事件流 (或收到错误事件) 后结算；先标记，避免结算途中被取消时重复结算
+            settled = True
+            if error is not None:
+                record_error(self.model_name, error[0])
+                await asyncio.to_thread(lease.fail, error[0])
+            else:
+                await asyncio.to_thread(lease.settle, usage)
+        finally:
+            self._semaphore.release()
+            if lease is not None and not settled:
+                # 调用方提前关闭生成器、断开连接或任务被取消：没有读完的调用按失败退回额度和 Key
+                # (此时不能再 await，直接同步结算)
+                lease.fail(ABORTED_CODE)
+
+        # 3. 检查结果
+        if error is not None:
+            trace.finish(status="failed", retries=retries)
+            yield build_failure_result(*error, retries)
+            return
+        if first_token_time is None:
+            trace.finish(status="parse_error", retries=retries, usage=usage)
+            error_message = "Error: Failed to parse response content from DashScope."
+            print(error_message)
+            yield error_message, UsageRecord.parse_error(retries)
+            return
+
+        # 4. 构造最终统计信息并写入缓存
+        usage_record = UsageRecord.from_usage(usage, time.time() - start_time, first_token_time, retries,
+                                          stages=trace.durations())
+        if cache_key is not None:
+            with trace.span("cache_store"):
+                await asyncio.to_thread(self.cache.put, cache_key, response_text, usage_record)
+        trace.finish(status="ok", retries=retries, usage=usage)
+        yield response_text, usage_record
+
+
+# --- 进程内复用的异步 Requester (同一模型共享长连接和并发上限，API Key 按调用传入) ---
+_async_requesters = {}
+
+def get_async_requester(model_name=QWEN_MODEL_NAME, key_pool=None):
+    """获取 (或创建) 与 model_name 绑定的 AsyncQwenRequester；调用时通过 api_key 参数指定 Key"""
+    requester = _async_requesters.get(model_name)
+    if requester is None:
+        requester = AsyncQwenRequester(model_name=model_name, key_pool=key_pool)
+        _async_requesters[model_name] = requester
+    return requester
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# 同一台机器上的所有进程 (三个 Gradio 应用、批量脚本) 共用一个限流状态文件
+DEFAULT_RATE_LIMIT_PATH = os.getenv(
+    "QWEN_RATE_LIMIT_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "qwen_vlm", "rate_limit.sqlite")
+)
+# 每个 API Key 的请求数 / Token 数预算 (每分钟)，按账号实际配额调整
+DEFAULT_RPM = int(os.getenv("QWEN_RATE_LIMIT_RPM", 600))
+DEFAULT_TPM = int(os.getenv("QWEN_RATE_LIMIT_TPM", 1000000))
+# 还没有历史用量时，每次请求预估消耗的 Token 数
+DEFAULT_ESTIMATED_TOKENS = 1000
+# 预估值使用最近请求 total_tokens 的指数滑动平均
+ESTIMATE_SMOOTHING = 0.2
+# 排队等待时单次休眠的上限，避免错过其他进程归还的额度
+MAX_SLEEP_SECONDS = 1.0
+
+
+def budget_key_for(api_key):
+    """限流状态按 API Key 区分，文件里只保存 Key 的哈希"""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+class Reservation:
+    """一次 acquire 预留的额度，拿到实际用量后调用 settle 多退少补"""
+    def __init__(self, limiter, reserved_tokens):
+        self.limiter = limiter
+        self.reserved_tokens = reserved_tokens
+        self.settled = False
+
+    def settle(self, actual_tokens):
+        if self.settled:
+            return
+        self.settled = True
+        self.limiter.record_usage(self.reserved_tokens, actual_tokens)
+
+
+class RateLimiter:
+    """
+    跨进程共享的令牌桶限流器，同时限制每分钟请求数 (RPM) 和每分钟 Token 数 (TPM)。
+
+    桶状态存放在 SQLite 中，每次取额度都在 BEGIN IMMEDIATE 事务里完成，
+    因此同一台机器上使用同一个 Key 的所有进程共享一份预算。
+    额度不足时 acquire 会排队等待，而不是直接失败。
+    """
+    def __init__(self, budget_key, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, db_path=DEFAULT_RATE_LIMIT_PATH):
+        self.budget_key = budget_key
+        self.rpm = rpm
+        self.tpm = tpm
+        self.db_path = db_path
+        self.estimated_tokens = float(DEFAULT_ESTIMATED_TOKENS)
+        self._estimate_lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS buckets (
+                       key TEXT PRIMARY KEY,
+                       requests REAL NOT NULL,
+                       tokens REAL NOT NULL,
+                       updated_at REAL NOT NULL
+                   )"""
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO buckets (key, requests, tokens, updated_at) VALUES (?, ?, ?, ?)",
+                (budget_key, float(rpm), float(tpm), time.time())
+            )
+
+    @contextmanager
+    def _transaction(self, write=True):
+        # isolation_level=None 后手动 BEGIN IMMEDIATE，读-改-写期间其他进程只能排队；
+        # 只读查询 (write=False) 用普通的延迟事务，不占写锁
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _refill(self, conn, now):
+        requests, tokens, updated_at = conn.execute(
+            "SELECT requests, tokens, updated_at FROM buckets WHERE key = ?", (self.budget_key,)
+        ).fetchone()
+        elapsed = max(0.0, now - updated_at)
+        requests = min(float(self.rpm), requests + elapsed * self.rpm / 60.0)
+        tokens = min(float(self.tpm), tokens + elapsed * self.tpm / 60.0)
+        return requests, tokens
+
+    def try_acquire(self, tokens_needed):
+        """尝试取 1 个请求额度和 tokens_needed 个 Token 额度，成功返回 0，否则返回建议等待的秒数"""
+        # 单次预估超过整桶容量时按整桶计算，否则永远取不到
+        tokens_needed = min(float(tokens_needed), float(self.tpm))
+        now = time.time()
+        with self._transaction() as conn:
+            requests, tokens = self._refill(conn, now)
+            if requests >= 1 and tokens >= tokens_needed:
+                requests -= 1
+                tokens -= tokens_needed
+                wait = 0.0
+            else:
+                wait = max((1 - requests) * 60.0 / self.rpm, (tokens_needed - tokens) * 60.0 / self.tpm, 0.001)
+            conn.execute(
+                "UPDATE buckets SET requests = ?, tokens = ?, updated_at = ? WHERE key = ?",
+                (requests, tokens, now, self.budget_key)
+            )
+        return wait
+
+    def acquire(self):
+        """阻塞直到拿到额度，返回本次预留的 Reservation"""
+        tokens_needed = self.estimated_tokens
+        while True:
+            wait = self.try_acquire(tokens_needed)
+            if wait == 0:
+                return Reservation(self, tokens_needed)
+            time.sleep(min(wait, MAX_SLEEP_SECONDS))
+
+    async def acquire_async(self):
+        """acquire 的异步版本，等待期间不阻塞事件循环"""
+        tokens_needed = self.estimated_tokens
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, tokens_needed)
+            if wait == 0:
+                return Reservation(self, tokens_needed)
+            await asyncio.sleep(min(wait, MAX_SLEEP_SECONDS))
+
+    def record_usage(self, reserved_tokens, actual_tokens):
+        """
+        用实际消耗 (usage.total_tokens) 修正预留的 Token：多退少补，
+        并更新下一次请求的预估值。actual_tokens 为 0 表示请求失败，预留的 Token 全部退回。
+        """
+        if actual_tokens:
+            with self._estimate_lock:
+                self.estimated_tokens += ESTIMATE_SMOOTHING * (actual_tokens - self.estimated_tokens)
+        delta = float(reserved_tokens) - float(actual_tokens)
+        if delta == 0:
+            return
+        now = time.time()
+        with self._transaction() as conn:
+            requests, tokens = self._refill(conn, now)
+            # 允许 tokens 暂时为负：超出预估的部分从后续额度里扣除
+            tokens = min(float(self.tpm), tokens + delta)
+            conn.execute(
+                "UPDATE buckets SET requests = ?, tokens = ?, updated_at = ? WHERE key = ?",
+                (requests, tokens, now, self.budget_key)
+            )
+
+    def headroom(self):
+        """当前剩余额度占比 (0~1)，取请求数和 Token 两者中较小的一个 (只读，Key 池选 Key 时调用)"""
+        now = time.time()
+        with self._transaction(write=False) as conn:
+            requests, tokens = self._refill(conn, now)
+        return max(0.0, min(requests / self.rpm, tokens / self.tpm))
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(api_key):
+    """获取 (或创建) 与 api_key 绑定的进程内限流器实例，状态在进程之间共享"""
+    key = budget_key_for(api_key)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(key)
+            _limiters[key] = limiter
+        return limiter
@@ -0,0 +1,94 @@
+import os
+import subprocess
+from functools import lru_cache
+
+from PIL import ImageColor, ImageFont
+
+# 常见的中文字体路径 (按优先级排列)
+CHINESE_FONT_PATHS = (
+    # Ubuntu/Debian
+    "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    "/usr/share/fonts/truetype/arphic/ukai.ttc",
+    "/usr/share/fonts/truetype/arphic/uming.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+
+    # CentOS/RHEL
+    "/usr/share/fonts/cjkuni-ukai/ukai.ttc",
+    "/usr/share/fonts/cjkuni-uming/uming.ttc",
+
+    # 通用路径
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+
+# draw_bbox_on_image 使用的标签字体 (依次尝试)
+LABEL_FONT_PATHS = (
+    "Arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+
+# 区分不同对象的颜色：常用颜色在前，其后是 PIL 的全部命名颜色，统一预先转换为 RGB 元组
+_BASE_COLOR_NAMES = (
+    'red', 'green', 'blue', 'yellow', 'orange', 'pink', 'purple', 'brown', 'gray',
+    'beige', 'turquoise', 'cyan', 'magenta', 'lime', 'navy', 'maroon', 'teal',
+    'olive', 'coral', 'lavender', 'violet', 'gold', 'silver',
+)
+BBOX_PALETTE = tuple(
+    ImageColor.getrgb(name) for name in _BASE_COLOR_NAMES + tuple(ImageColor.colormap)
+)
+# draw_bbox_on_image 的检测框颜色
+DETECTION_PALETTE = tuple(
+    ImageColor.getrgb(name) for name in ("red", "blue", "green", "yellow", "purple", "orange", "pink", "brown")
+)
+
+
+@lru_cache(maxsize=None)
+def find_chinese_font():
+    """
+    自动查找系统中的中文字体，每个进程只查找一次。
+    找不到常见路径时才调用 fc-list。
+    """
+    for font_path in CHINESE_FONT_PATHS:
+        if os.path.exists(font_path):
+            return font_path
+
+    # 如果以上都没有，尝试使用fc-list查找
+    try:
+        result = subprocess.run(['fc-list', ':lang=zh'], capture_output=True, text=True)
+        if result.returncode == 0 and result.stdout:
+            # 取第一个找到的中文字体
+            first_font = result.stdout.split('\n')[0].split(':')[0]
+            if first_font and os.path.exists(first_font):
+                return first_font
+    except Exception:
+        pass
+
+    return None
+
+
+@lru_cache(maxsize=64)
+def load_font(font_paths, size):
+    """
+    按 (字体路径, 字号) 加载并缓存字体。font_paths 可以是单个路径或按优先级排列的路径元组，
+    都加载失败时使用 PIL 的默认字体。
+    """
+    if not isinstance(font_paths, tuple):
+        font_paths = (font_paths,)
+    for font_path in font_paths:
+        if not font_path:
+            continue
+        try:
+            return ImageFont.truetype(font_path, size=size)
+        except (OSError, ValueError):
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 的默认字体不支持指定字号
+        return ImageFont.load_default()
+
+
+def get_chinese_font(size):
+    """能显示中文标签的字体 (缓存)"""
+    return load_font(find_chinese_font(), size)
@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from threading import Lock, get_ident
+
+from PIL import Image
+
+# 缩略图磁盘缓存目录 (每张图只生成一次)
+THUMBNAIL_DIR = "history_thumbs"
+THUMBNAIL_MAX_SIZE = 200
+THUMBNAIL_QUALITY = 80
+# 内存中保留的缩略图 data URI 数量
+THUMBNAIL_MEMORY_ENTRIES = 512
+
+
+class ThumbnailCache:
+    """
+    历史记录页面用的缩略图缓存。
+
+    缩略图以 JPEG 写入 THUMBNAIL_DIR，并以 data URI 形式保存在内存 LRU 中，
+    渲染时直接内嵌到 HTML，不再通过 file/ 链接加载整张原图。
+    缓存键包含文件的 mtime 和大小，原图被替换后会重新生成。
+    """
+    def __init__(self, thumb_dir=THUMBNAIL_DIR, max_size=THUMBNAIL_MAX_SIZE,
+                 memory_entries=THUMBNAIL_MEMORY_ENTRIES):
+        self.thumb_dir = thumb_dir
+        self.max_size = max_size
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = Lock()
+
+    def get_data_uri(self, image_path):
+        """返回缩略图的 data URI；原图不存在或无法读取时返回 None"""
+        try:
+            stat = os.stat(image_path)
+        except (OSError, TypeError):
+            return None
+        key = (image_path, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            data_uri = self._memory.get(key)
+            if data_uri is not None:
+                self._memory.move_to_end(key)
+                return data_uri
+
+        data = self._load_or_create(image_path, key)
+        if data is None:
+            return None
+        data_uri = "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
+
+        with self._lock:
+            self._memory[key] = data_uri
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+        return data_uri
+
+    def _load_or_create(self, image_path, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        thumb_path = os.path.join(self.thumb_dir, f"{digest}.jpg")
+        if os.path.exists(thumb_path):
+            with open(thumb_path, "rb") as f:
+                return f.read()
+
+        try:
+            with Image.open(image_path) as img:
+                img.draft("RGB", (self.max_size, self.max_size))  # JPEG 原图可以直接按缩小尺寸解码
+                img = img.convert("RGB")
+                img.thumbnail((self.max_size, self.max_size))
+                buffer = io.BytesIO()
+                img.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY)
+        except Exception as e:
+            print(f"生成缩略图失败: {image_path}: {e}")
+            return None
+
+        data = buffer.getvalue()
+        if not os.path.exists(self.thumb_dir):
+            os.makedirs(self.thumb_dir, exist_ok=True)
+        tmp_path = f"{thumb_path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, thumb_path)
+        return data
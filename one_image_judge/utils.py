@@ -1,15 +1,94 @@
 from pathlib import Path
 from PIL import Image
 import os
-import json # 导入 json 库
-from PIL import Image, ImageDraw, ImageFont # 导入 PIL 库用于图像处理
-import re
-import base64
+import binascii
+import mimetypes
+import mmap
+from collections import OrderedDict
+from threading import Lock
 
-#  编码函数： 将本地文件转换为 Base64 编码的字符串
-def encode_image(image_path):
+from detections import Detections, render_detections
+from image_probe import estimate_image_tokens, format_file_size, probe_image
+from json_extract import detections_from_data, extract_json
+from render_resources import DETECTION_PALETTE, LABEL_FONT_PATHS, load_font
+
+# --- base64 编码缓存：同一张图片重复判断时跳过读盘和编码 ---
+# 按 (路径, mtime, 大小) 缓存编码结果，总大小超过上限时按 LRU 淘汰。
+# 缓存常驻内存，默认只留 16 MB (预处理后每张几十 KB 到 1 MB 左右)；设为 0 关闭缓存，峰值内存最低
+ENCODE_CACHE_MAX_BYTES = int(os.getenv("QWEN_ENCODE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+# 每次编码的原始字节数 (3 的倍数，保证分块编码结果可以直接拼接)
+ENCODE_CHUNK_SIZE = 3 * 256 * 1024
+
+_encode_cache = OrderedDict()
+_encode_cache_bytes = 0
+_encode_cache_lock = Lock()
+
+
+def _encode_file(image_path, prefix):
+    """
+    通过 mmap 分块读取并编码，返回 prefix + base64 字符串。
+
+    不把整个文件读进内存，也不生成完整的 base64 bytes 中间副本：每块编码后直接追加到
+    结果字符串上 (CPython 对引用计数为 1 的局部 str 做 += 时原地扩容)，
+    读过的页随即释放，峰值内存约为结果本身的大小。
+    """
+    result = prefix
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+        size = os.fstat(image_file.fileno()).st_size
+        if size == 0:
+            return result
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in range(0, size, ENCODE_CHUNK_SIZE):
+                chunk = mm[offset:offset + ENCODE_CHUNK_SIZE]
+                result += binascii.b2a_base64(chunk, newline=False).decode("ascii")
+                if hasattr(mm, "madvise"):
+                    mm.madvise(mmap.MADV_DONTNEED, offset, len(chunk))
+    return result
+
+
+def _cached_encode(image_path, prefix):
+    global _encode_cache_bytes
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, prefix)
+    with _encode_cache_lock:
+        encoded = _encode_cache.get(key)
+        if encoded is not None:
+            _encode_cache.move_to_end(key)
+            return encoded
+
+    encoded = _encode_file(image_path, prefix)
+    if len(encoded) > ENCODE_CACHE_MAX_BYTES:
+        return encoded
+    with _encode_cache_lock:
+        if key not in _encode_cache:
+            _encode_cache[key] = encoded
+            _encode_cache_bytes += len(encoded)
+        while _encode_cache_bytes > ENCODE_CACHE_MAX_BYTES:
+            _, evicted = _encode_cache.popitem(last=False)
+            _encode_cache_bytes -= len(evicted)
+    return encoded
+
+
+def clear_encode_cache():
+    """清空 base64 编码缓存 (基准测试中用于测量冷启动的编码耗时)"""
+    global _encode_cache_bytes
+    with _encode_cache_lock:
+        _encode_cache.clear()
+        _encode_cache_bytes = 0
+
+
+#  编码函数： 将本地文件转换为 Base64 编码的字符串 (结果按文件内容版本缓存)
+def encode_image(image_path):
+    return _cached_encode(image_path, "")
+
+def encode_image_data_uri(image_path, mime_type=None):
+    """
+    返回 "data:<mime>;base64,..." 形式的 data URI，一次生成完整字符串并缓存，
+    不再先得到 base64 字符串再用 f-string 拼出第二份副本。
+    """
+    if mime_type is None:
+        mime_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+    return _cached_encode(image_path, f"data:{mime_type};base64,")
 
 def get_file_url(local_path):
     """确保本地文件路径以 'file://' 格式返回"""
@@ -19,43 +98,28 @@ def get_file_url(local_path):
 # --- 新增：获取图片尺寸的辅助函数 ---
 def get_image_size(image_path):
     """
-    根据图片路径获取图片的尺寸 (Width x Height)。
+    根据图片路径获取图片的尺寸 (Width x Height)、格式、文件大小和预计的图像 Token 数。
+    只读取文件头，结果按文件版本缓存 (见 image_probe.probe_image)。
     """
     if not image_path:
         return "请上传图片"
     
     try:
-        with Image.open(image_path) as img:
-            width, height = img.size
-            return f"{width} x {height}"
+        info = probe_image(image_path)
+        tokens = estimate_image_tokens(info.width, info.height)
+        return (f"{info.width} x {info.height} | {info.format} {format_file_size(info.file_size)} | "
+                f"预计图像 Token: {tokens}")
     except Exception as e:
         return f"无法读取图片尺寸: {e}"
     
 
 def parse_vlm_response(vlm_response):
     """
-    解析VLM响应，提取JSON数据
+    解析VLM响应，提取JSON数据 (代码块或夹在文字中的 JSON，截断的输出会尽量修复)
     """
     if not vlm_response:
         return None
-    
-    # 尝试直接解析JSON
-    try:
-        return json.loads(vlm_response)
-    except json.JSONDecodeError:
-        pass
-    
-    # 如果直接解析失败，尝试从文本中提取JSON
-    try:
-        # 使用正则表达式匹配JSON格式
-        json_match = re.search(r'\{.*\}', vlm_response, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
-            return json.loads(json_str)
-    except:
-        pass
-    
-    return None
+    return extract_json(vlm_response)
 
 def draw_bbox_on_image(vlm_response, original_image_path, output_image_path=None):
     """
@@ -84,22 +148,9 @@ def draw_bbox_on_image(vlm_response, original_image_path, output_image_path=None
 
         # 加载原始图片
         img = Image.open(original_image_path).convert("RGB")
-        draw = ImageDraw.Draw(img)
-        img_width, img_height = img.size
 
-        bbox_drawn_count = 0
-        
-        # 提取检测结果
-        detections = []
-        if isinstance(response_data, dict):
-            if "detections" in response_data:
-                detections = response_data["detections"]
-            elif "boxes" in response_data:
-                detections = response_data["boxes"]
-            elif "predictions" in response_data:
-                detections = response_data["predictions"]
-        elif isinstance(response_data, list):
-            detections = response_data
+        # 提取检测结果 (与 qwen3_vl_2d 共用 json_extract 的解析逻辑)
+        detections = detections_from_data(response_data)
         
         if not detections:
             return img, "警告：VLM 响应中未找到检测信息，将返回原图。"
@@ -107,87 +158,16 @@ def draw_bbox_on_image(vlm_response, original_image_path, output_image_path=None
         print(f"检测到的对象数量: {len(detections)}")
         print(f"检测详情: {detections}")
 
-        # 设置字体
-        try:
-            # 尝试使用系统字体
-            font = ImageFont.truetype("Arial.ttf", 16)
-        except IOError:
-            try:
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 16)
-            except IOError:
-                try:
-                    font = ImageFont.load_default()
-                    print("警告：使用默认字体，可能显示效果不佳")
-                except:
-                    font = None
-
-        colors = ["red", "blue", "green", "yellow", "purple", "orange", "pink", "brown"]
-        
-        for i, detection in enumerate(detections):
-            color = colors[i % len(colors)]
-            
-            # 处理不同的bbox键名
-            bbox = None
-            if "bbox" in detection and len(detection["bbox"]) == 4:
-                bbox = detection["bbox"]
-            elif "box" in detection and len(detection["box"]) == 4:
-                bbox = detection["box"]
-            elif "coordinates" in detection and len(detection["coordinates"]) == 4:
-                bbox = detection["coordinates"]
-            
-            if bbox is None:
-                continue
-                
-            # 确保坐标是数值类型
-            try:
-                x1, y1, x2, y2 = map(float, bbox)
-            except (ValueError, TypeError):
-                continue
-            
-            # 验证坐标范围
-            x1 = max(0, min(x1, img_width))
-            y1 = max(0, min(y1, img_height))
-            x2 = max(0, min(x2, img_width))
-            y2 = max(0, min(y2, img_height))
-            
-            if x1 >= x2 or y1 >= y2:
-                continue
-
-            # 获取标签和置信度
-            label = detection.get("label", "object")
-            confidence = detection.get("confidence", detection.get("score", 1.0))
-            
-            # 绘制边界框
-            draw.rectangle([x1, y1, x2, y2], outline=color, width=3)
-            
-            # 准备标签文本
-            text = f"{label}"
-            if confidence is not None:
-                try:
-                    conf_value = float(confidence)
-                    text += f" {conf_value:.2f}"
-                except (ValueError, TypeError):
-                    pass
-            
-            # 绘制标签背景和文本
-            if font:
-                try:
-                    # 获取文本尺寸
-                    bbox_text = draw.textbbox((0, 0), text, font=font)
-                    text_width = bbox_text[2] - bbox_text[0]
-                    text_height = bbox_text[3] - bbox_text[1]
-                    
-                    # 绘制文本背景
-                    draw.rectangle([x1, y1 - text_height - 4, x1 + text_width + 4, y1], fill=color)
-                    # 绘制文本
-                    draw.text((x1 + 2, y1 - text_height - 2), text, fill="white", font=font)
-                except:
-                    # 如果字体渲染失败，使用简单文本
-                    draw.text((x1, y1 - 15), text, fill=color)
-            else:
-                draw.text((x1, y1 - 15), text, fill=color)
-            
-            bbox_drawn_count += 1
+        # 坐标整体裁剪到图像范围内，去掉宽或高为 0 的框 (颜色仍按原始序号选取)
+        boxes = Detections.from_detections(detections).clip(img.size).filter()
+
+        # 设置字体 (按路径和字号缓存，只在第一次使用时加载)
+        font = load_font(LABEL_FONT_PATHS, 16)
+
+        bbox_drawn_count = render_detections(
+            img, boxes, DETECTION_PALETTE, font=font, line_width=3,
+            label_background=True, show_confidence=True, default_label="object"
+        )
 
         if output_image_path:
             img.save(output_image_path)
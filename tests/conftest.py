@@ -0,0 +1,6 @@
+import os
+import sys
+
+# 各应用目录中的模块按顶层模块导入 (与直接运行 Gradio 应用时一致)，测试使用 cable_detection 中的副本
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), "cable_detection"))
@@ -0,0 +1,41 @@
+from unittest import mock
+
+from history_manager import HistoryManager
+from usage_record import UsageRecord
+
+
+def add_records(manager, count):
+    for i in range(count):
+        manager.add_record(f"img{i}.png", f"q{i}", "", "r", UsageRecord.from_usage({}, 1.0))
+
+
+def test_cursor_pages_match_offset_pages(tmp_path):
+    manager = HistoryManager(history_file=str(tmp_path / "call_history.json"))
+    add_records(manager, 7)
+    expected = [manager.store.page(limit=3, offset=offset) for offset in (0, 3, 6)]
+
+    with mock.patch.object(manager.store, "page", wraps=manager.store.page) as page:
+        pages = [manager._read_page(n, 3) for n in (1, 2, 3)]
+    assert pages == expected
+    # 顺序翻页时第 2、3 页按游标读取，不用 OFFSET
+    assert [call.kwargs.get("offset", 0) for call in page.call_args_list] == [0, 0, 0]
+    assert page.call_args_list[1].kwargs["before_id"] == expected[0][-1]["id"]
+
+
+def test_cursors_reset_when_records_change(tmp_path):
+    manager = HistoryManager(history_file=str(tmp_path / "call_history.json"))
+    add_records(manager, 4)
+    manager._read_page(1, 2)
+    add_records(manager, 1)
+    # 新记录让第 2 页整体后移，旧游标作废
+    assert manager._read_page(2, 2) == manager.store.page(limit=2, offset=2)
+
+
+def test_history_card_links_to_stored_image(tmp_path):
+    manager = HistoryManager(history_file=str(tmp_path / "call_history.json"))
+    image_path = "qwen_pictures/0123abcd.png"
+    manager.add_record(image_path, "q", "", "r", UsageRecord.from_usage({}, 1.0))
+    with mock.patch.object(manager.thumbnails, "get_data_uri", return_value="data:image/png;base64,AA=="), \
+            mock.patch("history_manager.describe_image", return_value=""):
+        html = manager.load_history_records()
+    assert f'href="file/{image_path}"' in html
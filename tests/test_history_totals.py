@@ -0,0 +1,39 @@
+from history_manager import HistoryManager
+from usage_record import UsageRecord
+
+
+def test_cached_totals_match_store_after_add_record(tmp_path):
+    manager = HistoryManager(history_file=str(tmp_path / "call_history.json"))
+    manager.add_record("a.png", "q", "", "r", UsageRecord.from_usage({"total_tokens": 100}, 1.0))
+    # 首次显示时聚合，之后的记录增量计入
+    manager.load_history_page(1)
+    manager.add_record("a.png", "q", "", "r", UsageRecord.from_usage({"total_tokens": 50}, 3.0))
+    manager.add_record("a.png", "q", "", "r", UsageRecord(total_tokens=80, execution_time=0.1).as_cache_hit(0.001))
+    manager.add_record("a.png", "q", "", "r", UsageRecord.failure("InternalError"))
+
+    assert manager._usage_totals() == manager.store.usage_totals()
+    _, _, page_info = manager.load_history_page(1)
+    assert "共 4 条记录" in page_info and "消耗 Token 150" in page_info
+
+    manager.clear_history()
+    assert manager._usage_totals()["calls"] == 0
+
+
+def test_totals_include_records_from_other_managers(tmp_path):
+    history_file = str(tmp_path / "call_history.json")
+    manager_a = HistoryManager(history_file=history_file)
+    manager_b = HistoryManager(history_file=history_file)
+    manager_a.add_record("a.png", "q", "", "r", UsageRecord.from_usage({"total_tokens": 10}, 1.0))
+    assert manager_a._usage_totals()["calls"] == 1
+
+    # 另一个 worker 写入同一个数据库
+    manager_b.add_record("a.png", "q", "", "r", UsageRecord.from_usage({"total_tokens": 20}, 1.0))
+    manager_b.add_record("a.png", "q", "", "r", UsageRecord.from_usage({"total_tokens": 30}, 1.0))
+    assert manager_a._usage_totals() == manager_a.store.usage_totals()
+    assert manager_a._usage_totals()["total_tokens"] == 60
+
+    # 另一个 worker 清空后又写入
+    manager_b.clear_history()
+    manager_b.add_record("a.png", "q", "", "r", UsageRecord.from_usage({"total_tokens": 5}, 1.0))
+    assert manager_a._usage_totals() == manager_a.store.usage_totals()
+    assert manager_a._usage_totals()["calls"] == 1
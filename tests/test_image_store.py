@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+from unittest import mock
+
+from PIL import Image
+
+# image_store 只在使用内容寻址存储的应用目录中
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "diff_image_judge"))
+import image_store  # noqa: E402
+from image_store import ImageStore  # noqa: E402
+
+
+def make_image(tmp_path):
+    src = str(tmp_path / "upload.png")
+    Image.new("RGB", (8, 8)).save(src)
+    return src
+
+
+def test_reupload_during_gc_keeps_the_file(tmp_path):
+    src = make_image(tmp_path)
+    store = ImageStore(str(tmp_path / "store"), gc_grace_seconds=0)
+    path = store.put(src)
+    real_remove = os.remove
+    uploads = []
+
+    def remove_while_uploading(target):
+        # 正要删除文件时，另一个请求上传了同一张图片 (put 应等待回收的事务提交后再判断文件是否存在)
+        uploader = threading.Thread(target=lambda: uploads.append(store.put(src)))
+        uploader.start()
+        uploader.join(timeout=0.5)
+        uploads.append(uploader)
+        real_remove(target)
+
+    with mock.patch.object(image_store.os, "remove", side_effect=remove_while_uploading):
+        store.collect_garbage()
+    uploads[-1].join()
+    assert path in uploads
+    assert os.path.exists(path)
+
+
+def test_unreferenced_image_is_collected(tmp_path):
+    src = make_image(tmp_path)
+    store = ImageStore(str(tmp_path / "store"), gc_grace_seconds=0)
+    path = store.put(src)
+    store.acquire(path)
+    store.release({path: 1})
+    assert store.collect_garbage()[0] == 1
+    assert not os.path.exists(path)
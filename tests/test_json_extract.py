@@ -0,0 +1,20 @@
+from json_extract import extract_detections, extract_json, scan_json
+
+BOX = '{"bbox_2d": [1, 2, 3, 4], "label": "cable"}'
+
+
+def test_deeply_nested_brackets_do_not_raise():
+    # 模型输出失控时可能出现成千上万层括号，json 解码器会抛 RecursionError
+    text = "[" * 5000 + "]" * 5000
+    scan_json(text)
+    scan_json("[" * 5000)
+    assert extract_detections("结果: " + text) is not None
+
+
+def test_valid_json_after_nested_noise():
+    assert extract_json("[" * 5000 + " " + BOX) == {"bbox_2d": [1, 2, 3, 4], "label": "cable"}
+    assert extract_json("[" * 5000 + " [" + BOX + "]") == [{"bbox_2d": [1, 2, 3, 4], "label": "cable"}]
+
+
+def test_truncated_output_is_still_repaired():
+    assert extract_json('[' + BOX + ', {"bbox_2d": [5, 6') == [{"bbox_2d": [1, 2, 3, 4], "label": "cable"}]
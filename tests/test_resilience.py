@@ -0,0 +1,127 @@
+import time
+from unittest import mock
+
+from PIL import Image
+
+import qwen_requester
+from key_pool import ApiKeyPool
+from rate_limiter import RateLimiter
+from resilience import CircuitBreaker, RetryPolicy
+
+
+class FakeResponse:
+    def __init__(self, status_code, code=None, message=""):
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+
+
+def make_requester(breaker):
+    return qwen_requester.QwenRequester(api_key="sk-test", cache=False, rate_limiter=False,
+                                        retry_policy=RetryPolicy(max_attempts=1), circuit_breaker=breaker)
+
+
+def test_half_open_probe_released_after_non_retryable_error(tmp_path):
+    image_path = str(tmp_path / "probe.png")
+    Image.new("RGB", (32, 32)).save(image_path)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    requester = make_requester(breaker)
+    responses = [FakeResponse(500, "InternalError"), FakeResponse(400, "InvalidParameter"),
+                 FakeResponse(400, "InvalidParameter")]
+
+    with mock.patch.object(qwen_requester.MultiModalConversation, "call", side_effect=responses) as call:
+        requester.request_qwen("q", image_path, "")
+        assert breaker.state == CircuitBreaker.OPEN
+        time.sleep(0.02)
+        # 半开状态的探测请求返回不可重试的错误
+        _, usage = requester.request_qwen("q", image_path, "")
+        assert usage.error_code == "InvalidParameter"
+        # 探测名额已释放，下一个请求仍然会发出
+        _, usage = requester.request_qwen("q", image_path, "")
+        assert usage.error_code == "InvalidParameter"
+        assert call.call_count == 3
+
+
+def test_half_open_probe_released_after_unexpected_exception(tmp_path):
+    image_path = str(tmp_path / "probe.png")
+    Image.new("RGB", (32, 32)).save(image_path)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    requester = make_requester(breaker)
+
+    with mock.patch.object(qwen_requester.MultiModalConversation, "call", side_effect=RuntimeError("boom")):
+        try:
+            requester.request_qwen("q", image_path, "")
+        except RuntimeError:
+            pass
+    assert breaker.allow_request()
+
+
+class FailingLimiter(RateLimiter):
+    def acquire(self):
+        raise RuntimeError("rate limit store unavailable")
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    return breaker
+
+
+def test_half_open_probe_released_when_no_key_is_available(tmp_path):
+    image_path = str(tmp_path / "probe.png")
+    Image.new("RGB", (32, 32)).save(image_path)
+    breaker = half_open_breaker()
+    requester = qwen_requester.QwenRequester(cache=False, rate_limiter=False, circuit_breaker=breaker,
+                                             retry_policy=RetryPolicy(max_attempts=1))
+
+    with mock.patch.object(qwen_requester.MultiModalConversation, "call") as call:
+        try:
+            requester.request_qwen("q", image_path, "")
+        except ValueError:
+            pass
+        assert not call.called
+    assert breaker.allow_request()
+
+
+def test_key_and_probe_released_when_rate_limiter_fails(tmp_path):
+    image_path = str(tmp_path / "probe.png")
+    Image.new("RGB", (32, 32)).save(image_path)
+    breaker = half_open_breaker()
+    pool = ApiKeyPool(["k1", "k2"], use_rate_limiter=False)
+    requester = qwen_requester.QwenRequester(cache=False, circuit_breaker=breaker, key_pool=pool,
+                                             rate_limiter=FailingLimiter("test", db_path=str(tmp_path / "rl.sqlite")),
+                                             retry_policy=RetryPolicy(max_attempts=1))
+
+    try:
+        requester.request_qwen("q", image_path, "")
+    except RuntimeError:
+        pass
+    assert breaker.allow_request()
+    assert [stats["in_flight"] for stats in pool.stats()] == [0, 0]
+
+
+class FakeChunk(dict):
+    status_code = 200
+    code = None
+    message = ""
+
+    def __init__(self, text):
+        super().__init__(output={"choices": [{"message": mock.Mock(content=[{"text": text}])}]})
+
+
+def test_sync_stream_closed_early_releases_key(tmp_path):
+    image_path = str(tmp_path / "stream.png")
+    Image.new("RGB", (32, 32)).save(image_path)
+    pool = ApiKeyPool(["k1", "k2"], use_rate_limiter=False)
+    requester = qwen_requester.QwenRequester(cache=False, rate_limiter=False, key_pool=pool,
+                                             circuit_breaker=CircuitBreaker())
+
+    with mock.patch.object(qwen_requester.MultiModalConversation, "call",
+                           side_effect=lambda **kwargs: iter([FakeChunk("a"), FakeChunk("b"), FakeChunk("c")])):
+        stream = requester.request_qwen_stream("q", image_path, "")
+        next(stream)
+        stream.close()
+    assert [stats["in_flight"] for stats in pool.stats()] == [0, 0]
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from key_pool import ApiKeyPool
+from qwen_requester import AsyncQwenRequester
+from usage_record import STATUS_PARSE_ERROR
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from mock_dashscope import CannedOutputs, MockConfig, start_background_server  # noqa: E402
+
+
+def test_dropped_streams_release_their_key(tmp_path):
+    image_path = str(tmp_path / "stream.png")
+    Image.new("RGB", (64, 64)).save(image_path)
+    server, base_url = start_background_server(MockConfig(token_interval_s=0.01, outputs=CannedOutputs("bbox", 10)))
+    pool = ApiKeyPool(["k1", "k2"], use_rate_limiter=False)
+
+    async def drop_streams():
+        async with AsyncQwenRequester(base_url=base_url, cache=False, rate_limiter=False, key_pool=pool) as requester:
+            for _ in range(3):
+                stream = requester.request_qwen_stream("检测线缆", image_path, "")
+                async for text, usage in stream:
+                    break
+                # 调用方只读了第一段就关闭 (相当于 Gradio 中断)
+                await stream.aclose()
+
+    try:
+        asyncio.run(drop_streams())
+    finally:
+        server.shutdown()
+    assert [stats["in_flight"] for stats in pool.stats()] == [0, 0]
+
+
+class ListBodyHandler(BaseHTTPRequestHandler):
+    """状态码 200，但响应体是 JSON 数组而不是对象"""
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = b"[1, 2]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_non_object_body_is_a_parse_error(tmp_path):
+    image_path = str(tmp_path / "body.png")
+    Image.new("RGB", (64, 64)).save(image_path)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ListBodyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pool = ApiKeyPool(["k1"], use_rate_limiter=False)
+
+    async def call():
+        async with AsyncQwenRequester(base_url=f"http://127.0.0.1:{server.server_address[1]}/api/v1", cache=False,
+                                      rate_limiter=False, key_pool=pool) as requester:
+            return await requester.request_qwen("检测线缆", image_path, "")
+
+    try:
+        _, usage = asyncio.run(call())
+    finally:
+        server.shutdown()
+    assert usage.status == STATUS_PARSE_ERROR
+    assert pool.stats()[0]["in_flight"] == 0